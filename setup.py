@@ -106,6 +106,10 @@ setup(name='Zope2',
       'zope.traversing',
       'zope.viewlet',
     ] + additional_install_requires,
+    extras_require={
+      # sendfile(2) for ZServer on Pythons without os.sendfile
+      'sendfile': ['pysendfile'],
+    },
 
     include_package_data=True,
     zip_safe=False,
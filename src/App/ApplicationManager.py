@@ -207,6 +207,24 @@ class DebugManager(Item, Implicit):
         import Zope2  # for data
         return Zope2.DB.connectionDebugInfo()
 
+    def request_queue(self):
+        # return the ZServer request queue counters, if ZServer is running
+        try:
+            from ZServer.PubCore import getStatistics
+        except ImportError:
+            return None
+        return getStatistics()
+
+    def traversal_cache(self):
+        # return the traversal step cache counters, if the cache is enabled
+        from ZPublisher.traversalcache import getStatistics
+        return getStatistics()
+
+    def field_plans(self):
+        # return the counters of the cache of parsed form field names
+        from ZPublisher.HTTPRequest import field_plans
+        return field_plans.getStatistics()
+
 
     # Profiling support
 
@@ -23,8 +23,13 @@ from Acquisition import Explicit
 from App.Common import package_home
 from App.Common import rfc1123_date
 from App.config import getConfiguration
-from DateTime.DateTime import DateTime
+from App.gzipcache import acceptsGzip
+from App.gzipcache import gzipVariant
+from App.gzipcache import setGzipHeaders
+from App.gzipcache import setVary
 from zope.contenttype import guess_content_type
+from ZPublisher.HTTPConditional import gzipETag
+from ZPublisher.HTTPConditional import handleConditional
 from ZPublisher.Iterators import filestream_iterator
 
 import Zope2
@@ -45,6 +50,8 @@ class ImageFile(Explicit):
 
     security = ClassSecurityInfo()
 
+    etag = gzip_path = gzip_size = None
+
     def __init__(self, path, _prefix=None):
         if _prefix is None:
             _prefix = PREFIX
@@ -85,39 +92,54 @@ class ImageFile(Explicit):
         self.size = stat_info[stat.ST_SIZE]
         self.lmt = float(stat_info[stat.ST_MTIME]) or time.time()
         self.lmh = rfc1123_date(self.lmt)
+        self.etag = '"%x-%x"' % (long(self.lmt), self.size)
+
+        # A gzip compressed copy of the file next to it is served to
+        # clients accepting gzip, as long as it is up to date.
+        gzip_path = path + '.gz'
+        if os.path.exists(gzip_path):
+            gzip_info = os.stat(gzip_path)
+            if gzip_info[stat.ST_MTIME] >= stat_info[stat.ST_MTIME]:
+                self.gzip_path = gzip_path
+                self.gzip_size = gzip_info[stat.ST_SIZE]
 
     def index_html(self, REQUEST, RESPONSE):
         """Default document"""
-        # HTTP If-Modified-Since header handling. This is duplicated
-        # from OFS.Image.Image - it really should be consolidated
-        # somewhere...
         RESPONSE.setHeader('Content-Type', self.content_type)
         RESPONSE.setHeader('Last-Modified', self.lmh)
         RESPONSE.setHeader('Cache-Control', self.cch)
         RESPONSE.setHeader('Content-Length', str(self.size).replace('L', ''))
-        header = REQUEST.get_header('If-Modified-Since', None)
-        if header is not None:
-            header=header.split(';')[0]
-            # Some proxies seem to send invalid date strings for this
-            # header. If the date string is not valid, we ignore it
-            # rather than raise an error to be generally consistent
-            # with common servers such as Apache (which can usually
-            # understand the screwy date string as a lucky side effect
-            # of the way they parse it).
-            try:
-                mod_since = long(DateTime(header).timeTime())
-            except:
-                mod_since = None
-            if mod_since is not None:
-                if getattr(self, 'lmt', None):
-                    last_mod = long(self.lmt)
-                else:
-                    last_mod = long(0)
-                if last_mod > 0 and last_mod <= mod_since:
-                    RESPONSE.setStatus(304)
-                    return ''
-
-        return filestream_iterator(self.path, mode='rb')
+
+        path = self.path
+        data = None
+        etag = self.etag
+        if self.gzip_path is not None:
+            setVary(RESPONSE)
+            if acceptsGzip(REQUEST):
+                setGzipHeaders(RESPONSE, self.gzip_size)
+                path = self.gzip_path
+                etag = gzipETag(etag)
+        else:
+            data = gzipVariant(REQUEST, RESPONSE, (self.path, self.lmt),
+                               self.content_type, self.size, self._read)
+            if data is not None:
+                etag = gzipETag(etag)
+        if etag is not None:
+            RESPONSE.setHeader('ETag', etag)
+
+        if handleConditional(REQUEST, RESPONSE, etag, self.lmt):
+            return ''
+
+        if data is not None:
+            return data
+        return filestream_iterator(path, mode='rb')
+
+    def _read(self):
+        f = open(self.path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
 
     security.declarePublic('HEAD')
     def HEAD(self, REQUEST, RESPONSE):
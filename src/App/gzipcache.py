@@ -0,0 +1,218 @@
+##############################################################################
+#
+# Copyright (c) 2010 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cache of gzip encoded variants of static content.
+
+App.ImageFile and OFS.Image.File serve text content (style sheets,
+scripts, ...) gzip encoded to clients that accept it.  The encoded data is
+compressed once and kept in memory, keyed by the identity and
+modification time of the object, until the total size of the cached
+variants exceeds the configured size (see the 'gzip-cache-size'
+directive); the least recently used variants are dropped first.
+"""
+
+from threading import Lock
+
+from ZPublisher.HTTPResponse import GzipEncoder
+
+# Content types that are compressed, by prefix.
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'image/svg+xml',
+    )
+
+# Content bigger than this is not compressed.
+MAX_CONTENT_SIZE = 1 << 20
+
+# The cache used by ImageFile and File, None if disabled.
+cache = None
+
+
+def configure(max_size):
+    """Keep up to max_size bytes of encoded variants, or disable the cache."""
+    global cache
+    if max_size:
+        cache = GzipCache(max_size)
+    else:
+        cache = None
+
+
+def compressible(content_type, size):
+    """Return true if content of the given type and size gets compressed."""
+    if not size or size > MAX_CONTENT_SIZE:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    for prefix in COMPRESSIBLE_TYPES:
+        if content_type.startswith(prefix):
+            return True
+    return False
+
+
+def acceptsGzip(request):
+    """Return true if the Accept-Encoding header of request allows gzip."""
+    header = request.get_header('Accept-Encoding', None)
+    if not header:
+        return False
+    qualities = {}
+    for coding in header.split(','):
+        coding, params = (coding.split(';', 1) + [''])[:2]
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[coding.strip().lower()] = q
+    q = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0)))
+    return q > 0
+
+
+def setVary(response):
+    """Add Accept-Encoding to the Vary header of response."""
+    vary = response.getHeader('Vary')
+    if not vary:
+        response.setHeader('Vary', 'Accept-Encoding')
+    elif 'accept-encoding' not in vary.lower():
+        response.setHeader('Vary', '%s, Accept-Encoding' % vary)
+
+
+def setGzipHeaders(response, length):
+    """Declare the body of response as gzip encoded data of length bytes."""
+    response.setHeader('Content-Encoding', 'gzip')
+    response.setHeader('Content-Length', length)
+    setVary(response)
+
+
+def compress(data):
+    encoder = GzipEncoder(9)
+    return encoder.compress(data) + encoder.finish()
+
+
+def gzipVariant(request, response, key, content_type, size, loader):
+    """Return the gzip encoded variant of some content, or None.
+
+    key identifies the content and its version, loader returns the
+    content.  If the variant is returned, the response headers have been
+    set up for it.  The Vary header is set for all compressible content,
+    whether the client accepts gzip or not.
+    """
+    if cache is None or not compressible(content_type, size):
+        return None
+    setVary(response)
+    if not acceptsGzip(request):
+        return None
+    data = cache.get(key, loader)
+    if data is not None:
+        setGzipHeaders(response, len(data))
+    return data
+
+
+class GzipCache(object):
+
+    # Variants that are not smaller than the original data are cached as
+    # None, this limits the number of those.
+    max_entries = 10000
+
+    def __init__(self, max_size=16 << 20):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = {}
+        self._clock = 0
+        self._lock = Lock()
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.hits = self.misses = 0
+
+    def get(self, key, loader):
+        """Return the gzip encoded variant for key.
+
+        loader is called to get the data to compress on a miss.  Returns
+        None if compressing the data doesn't make it smaller.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._clock += 1
+                entry[0] = self._clock
+                return entry[1]
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        data = loader()
+        encoded = compress(data)
+        if len(encoded) >= len(data):
+            encoded = None
+        self._store(key, encoded)
+        return encoded
+
+    def _store(self, key, encoded):
+        size = encoded is not None and len(encoded) or 0
+        if size > self.max_size:
+            return
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                return
+            self._clock += 1
+            self._entries[key] = [self._clock, encoded, size]
+            self.size += size
+            if (self.size > self.max_size or
+                len(self._entries) > self.max_entries):
+                self._prune()
+        finally:
+            self._lock.release()
+
+    def _prune(self):
+        # Drop the least recently used entries until half of the cache
+        # is free again.
+        entries = sorted(self._entries.items(), key=lambda item: item[1][0])
+        for key, (clock, encoded, size) in entries:
+            if (self.size <= self.max_size // 2 and
+                len(self._entries) <= self.max_entries // 2):
+                break
+            del self._entries[key]
+            self.size -= size
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': total and float(self.hits) / total or 0.0,
+            }
+
+
+def getStatistics():
+    """Return the statistics of the cache, or None if it is disabled."""
+    if cache is not None:
+        return cache.getStatistics()
@@ -235,6 +235,26 @@ class DebugManagerTests(unittest.TestCase):
         self.assertTrue('pc' in mapping)
         self.assertEqual(mapping['delta'], mapping['rc'] - mapping['pc'])
 
+    def test_traversal_cache(self):
+        from ZPublisher import traversalcache
+        dm = self._makeOne('test')
+        self.assertEqual(dm.traversal_cache(), None)
+        traversalcache.configure(10)
+        try:
+            stats = dm.traversal_cache()
+        finally:
+            traversalcache.configure(0)
+        self.assertEqual(stats['max_entries'], 10)
+        self.assertEqual(stats['hits'], 0)
+
+    def test_field_plans(self):
+        from ZPublisher.HTTPRequest import field_plans
+        dm = self._makeOne('test')
+        field_plans.get('test_field_plans:int')
+        stats = dm.field_plans()
+        self.assertEqual(stats, field_plans.getStatistics())
+        self.assertTrue(stats['entries'] >= 1)
+
     #def test_dbconnections(self):  XXX -- TOO UGLY TO TEST
     #def test_manage_profile_stats(self):  XXX -- TOO UGLY TO TEST
 
@@ -0,0 +1,178 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class Request(dict):
+
+    def __init__(self, accept_encoding=None, **headers):
+        self['REQUEST_METHOD'] = 'GET'
+        self.headers = headers
+        if accept_encoding is not None:
+            self.headers['Accept-Encoding'] = accept_encoding
+
+    def get_header(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class GzipCacheTests(unittest.TestCase):
+
+    def _makeOne(self, max_size=1000):
+        from App.gzipcache import GzipCache
+        return GzipCache(max_size)
+
+    def test_get(self):
+        cache = self._makeOne()
+        loads = []
+        def loader():
+            loads.append(1)
+            return 'abc' * 100
+        data = cache.get('key', loader)
+        self.assertEqual(gunzip(data), 'abc' * 100)
+        self.assertTrue(cache.get('key', loader) is data)
+        self.assertEqual(len(loads), 1)
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['size'], len(data))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_get_incompressible(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('key', lambda: 'a'), None)
+        self.assertEqual(cache.get('key', lambda: 1 / 0), None)
+
+    def test_prune_least_recently_used(self):
+        cache = self._makeOne()
+        cache.max_entries = 4
+        for key in 'abcd':
+            cache.get(key, lambda: key * 1000)
+        cache.get('a', None)
+        cache.get('e', lambda: 'e' * 1000)
+        self.assertEqual(sorted(cache._entries), ['a', 'e'])
+        self.assertEqual(cache.size,
+                         sum([entry[2] for entry in cache._entries.values()]))
+
+    def test_too_big(self):
+        cache = self._makeOne(10)
+        self.assertEqual(gunzip(cache.get('key', lambda: 'a' * 1000)),
+                         'a' * 1000)
+        self.assertEqual(cache.getStatistics()['entries'], 0)
+
+
+class FunctionTests(unittest.TestCase):
+
+    def test_acceptsGzip(self):
+        from App.gzipcache import acceptsGzip
+        self.assertFalse(acceptsGzip(Request()))
+        self.assertFalse(acceptsGzip(Request('deflate')))
+        self.assertTrue(acceptsGzip(Request('gzip, deflate')))
+        self.assertTrue(acceptsGzip(Request('deflate;q=1.0, GZIP;q=0.5')))
+        self.assertTrue(acceptsGzip(Request('x-gzip')))
+        self.assertTrue(acceptsGzip(Request('*')))
+        self.assertFalse(acceptsGzip(Request('gzip;q=0')))
+        self.assertFalse(acceptsGzip(Request('gzip;q=0, *')))
+
+    def test_compressible(self):
+        from App.gzipcache import compressible
+        self.assertTrue(compressible('text/css', 100))
+        self.assertTrue(compressible('application/javascript', 100))
+        self.assertTrue(compressible('Text/HTML; charset=utf-8', 100))
+        self.assertFalse(compressible('image/png', 100))
+        self.assertFalse(compressible('text/css', 0))
+        self.assertFalse(compressible('text/css', 1 << 30))
+
+
+class ImageFileTests(unittest.TestCase):
+
+    def setUp(self):
+        from App import gzipcache
+        gzipcache.configure(1 << 20)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.css')
+        f = open(self.path, 'wb')
+        f.write('body { color: black; }\n' * 100)
+        f.close()
+
+    def tearDown(self):
+        from App import gzipcache
+        gzipcache.configure(0)
+        shutil.rmtree(self.tmpdir)
+
+    def _callIndexHtml(self, accept_encoding=None, **headers):
+        from App.ImageFile import ImageFile
+        from ZPublisher.HTTPResponse import HTTPResponse
+        response = HTTPResponse()
+        request = Request(accept_encoding, **headers)
+        result = ImageFile(self.path).index_html(request, response)
+        if not isinstance(result, str):
+            result = result.read()
+        return result, response
+
+    def test_index_html_wo_gzip(self):
+        result, response = self._callIndexHtml()
+        self.assertEqual(result, 'body { color: black; }\n' * 100)
+        self.assertEqual(response.getHeader('Content-Encoding'), None)
+        self.assertEqual(response.getHeader('Vary'), 'Accept-Encoding')
+
+    def test_index_html_w_gzip(self):
+        result, response = self._callIndexHtml('gzip')
+        self.assertEqual(gunzip(result), 'body { color: black; }\n' * 100)
+        self.assertEqual(response.getHeader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getHeader('Content-Length'),
+                         str(len(result)))
+        self.assertEqual(response.getHeader('Vary'), 'Accept-Encoding')
+
+    def test_index_html_w_gzip_file(self):
+        f = gzip.open(self.path + '.gz', 'wb')
+        f.write('precompressed')
+        f.close()
+        result, response = self._callIndexHtml('gzip')
+        self.assertEqual(gunzip(result), 'precompressed')
+        self.assertEqual(response.getHeader('Content-Length'),
+                         str(len(result)))
+
+    def test_index_html_etag(self):
+        result, response = self._callIndexHtml()
+        etag = response.getHeader('ETag')
+        self.assertTrue(etag)
+        result, response = self._callIndexHtml('gzip')
+        self.assertEqual(response.getHeader('ETag'), etag[:-1] + '-gzip"')
+
+    def test_index_html_if_none_match(self):
+        result, response = self._callIndexHtml()
+        etag = response.getHeader('ETag')
+        result, response = self._callIndexHtml(**{'If-None-Match': etag})
+        self.assertEqual(result, '')
+        self.assertEqual(response.getStatus(), 304)
+        result, response = self._callIndexHtml(**{'If-None-Match': '"x"'})
+        self.assertEqual(response.getStatus(), 200)
+
+    def test_index_html_if_modified_since(self):
+        from App.Common import rfc1123_date
+        since = rfc1123_date(os.stat(self.path).st_mtime)
+        result, response = self._callIndexHtml(
+            **{'If-Modified-Since': since})
+        self.assertEqual(result, '')
+        self.assertEqual(response.getStatus(), 304)
+
+    def test_index_html_cache_disabled(self):
+        from App import gzipcache
+        gzipcache.configure(0)
+        result, response = self._callIndexHtml('gzip')
+        self.assertEqual(result, 'body { color: black; }\n' * 100)
+        self.assertEqual(response.getHeader('Content-Encoding'), None)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(GzipCacheTests),
+        unittest.makeSuite(FunctionTests),
+        unittest.makeSuite(ImageFileTests),
+        ))
@@ -13,10 +13,14 @@
 """Image object
 """
 
+from array import array
+from bisect import bisect_right
 from cgi import escape
 from cStringIO import StringIO
 from mimetools import choose_boundary
+import os
 import struct
+import tempfile
 
 from AccessControl.class_init import InitializeClass
 from AccessControl.Permissions import change_images_and_files
@@ -25,17 +29,29 @@ from AccessControl.Permissions import view as View
 from AccessControl.Permissions import ftp_access
 from AccessControl.Permissions import delete_objects
 from AccessControl.SecurityInfo import ClassSecurityInfo
+from Acquisition import aq_base
 from Acquisition import Implicit
+from App.gzipcache import gzipVariant
 from App.special_dtml import DTMLFile
-from DateTime.DateTime import DateTime
+from ComputedAttribute import ComputedAttribute
 from Persistence import Persistent
 from webdav.common import rfc1123_date
 from webdav.interfaces import IWriteLock
 from webdav.Lockable import ResourceLockedError
 from ZPublisher import HTTPRangeSupport
+from ZPublisher.HTTPConditional import gzipETag
+from ZPublisher.HTTPConditional import handleConditional
+from ZPublisher.HTTPConditional import ifRangeMatches
+from ZPublisher.HTTPConditional import serialETag
 from ZPublisher.HTTPRequest import FileUpload
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import byterange_iterator
+from ZPublisher.Iterators import file_range_reader
 from ZPublisher.Iterators import filestream_iterator
 from zExceptions import Redirect
+from ZODB.blob import Blob
+from ZODB.interfaces import BlobError
+from ZODB.interfaces import IBlobStorage
 from zope.contenttype import guess_content_type
 from zope.interface import implementedBy
 from zope.interface import implements
@@ -49,6 +65,10 @@ from zope.event import notify
 from zope.lifecycleevent import ObjectModifiedEvent
 from zope.lifecycleevent import ObjectCreatedEvent
 
+# Store the data of new uploads of 64KB and more in ZODB blobs, if the
+# storage supports them.  Set by the 'file-blobs' zope.conf option.
+USE_BLOBS = False
+
 manage_addFileForm = DTMLFile('dtml/imageAdd',
                               globals(),
                               Kind='File',
@@ -108,6 +128,12 @@ class File(Persistent, Implicit, PropertyManager,
     precondition=''
     size=None
 
+    # the ZODB blob holding the data, if the file is stored in a blob
+    _blob=None
+
+    # the PdataIndex of the data, if it is a Pdata chain
+    _pdata_index=None
+
     manage_editForm  =DTMLFile('dtml/fileEdit',globals(),
                                Kind='File',kind='file')
     manage_editForm._setName('manage_editForm')
@@ -141,34 +167,22 @@ class File(Persistent, Implicit, PropertyManager,
         content_type=self._get_content_type(file, data, id, content_type)
         self.update_data(data, content_type, size)
 
+    def _etag(self):
+        # The entity tag of the content, None if it isn't committed yet.
+        return serialETag(self)
+
     def _if_modified_since_request_handler(self, REQUEST, RESPONSE):
-        # HTTP If-Modified-Since header handling: return True if
-        # we can handle this request by returning a 304 response
-        header=REQUEST.get_header('If-Modified-Since', None)
-        if header is not None:
-            header=header.split( ';')[0]
-            # Some proxies seem to send invalid date strings for this
-            # header. If the date string is not valid, we ignore it
-            # rather than raise an error to be generally consistent
-            # with common servers such as Apache (which can usually
-            # understand the screwy date string as a lucky side effect
-            # of the way they parse it).
-            # This happens to be what RFC2616 tells us to do in the face of an
-            # invalid date.
-            try:    mod_since=long(DateTime(header).timeTime())
-            except: mod_since=None
-            if mod_since is not None:
-                if self._p_mtime:
-                    last_mod = long(self._p_mtime)
-                else:
-                    last_mod = long(0)
-                if last_mod > 0 and last_mod <= mod_since:
-                    RESPONSE.setHeader('Last-Modified',
-                                       rfc1123_date(self._p_mtime))
-                    RESPONSE.setHeader('Content-Type', self.content_type)
-                    RESPONSE.setHeader('Accept-Ranges', 'bytes')
-                    RESPONSE.setStatus(304)
-                    return True
+        # HTTP conditional request handling (If-None-Match,
+        # If-Modified-Since, ...): return True if we can handle this
+        # request by returning a 304 (or 412) response
+        etag = self._etag()
+        if etag is not None:
+            RESPONSE.setHeader('ETag', etag)
+        if handleConditional(REQUEST, RESPONSE, etag, self._p_mtime):
+            RESPONSE.setHeader('Last-Modified', rfc1123_date(self._p_mtime))
+            RESPONSE.setHeader('Content-Type', self.content_type)
+            RESPONSE.setHeader('Accept-Ranges', 'bytes')
+            return True
 
     def _range_request_handler(self, REQUEST, RESPONSE):
         # HTTP Range header handling: return True if we've served a range
@@ -187,27 +201,16 @@ class File(Persistent, Implicit, PropertyManager,
                 # Only send ranges if the data isn't modified, otherwise send
                 # the whole object. Support both ETags and Last-Modified dates!
                 if len(if_range) > 1 and if_range[:2] == 'ts':
-                    # ETag:
+                    # WebDAV ETag:
                     if if_range != self.http__etag():
                         # Modified, so send a normal response. We delete
                         # the ranges, which causes us to skip to the 200
                         # response.
                         ranges = None
-                else:
-                    # Date
-                    date = if_range.split( ';')[0]
-                    try: mod_since=long(DateTime(date).timeTime())
-                    except: mod_since=None
-                    if mod_since is not None:
-                        if self._p_mtime:
-                            last_mod = long(self._p_mtime)
-                        else:
-                            last_mod = long(0)
-                        if last_mod > mod_since:
-                            # Modified, so send a normal response. We delete
-                            # the ranges, which causes us to skip to the 200
-                            # response.
-                            ranges = None
+                elif not ifRangeMatches(REQUEST, self._etag(),
+                                        self._p_mtime):
+                    # Modified, so send a normal response.
+                    ranges = None
 
             if ranges:
                 # Search for satisfiable ranges.
@@ -229,6 +232,7 @@ class File(Persistent, Implicit, PropertyManager,
                     return True
 
                 ranges = HTTPRangeSupport.expandRanges(ranges, self.size)
+                ranges = HTTPRangeSupport.coalesceRanges(ranges)
 
                 if len(ranges) == 1:
                     # Easy case, set extra header and return partial set.
@@ -244,56 +248,34 @@ class File(Persistent, Implicit, PropertyManager,
                         'bytes %d-%d/%d' % (start, end - 1, self.size))
                     RESPONSE.setStatus(206) # Partial content
 
+                    blob = self._blob
+                    if blob is not None:
+                        f = blob.open('r')
+                        try:
+                            _write_file_range(RESPONSE, f, start, end)
+                        finally:
+                            f.close()
+                        return True
+
                     data = self.data
                     if isinstance(data, str):
                         RESPONSE.write(data[start:end])
                         return True
 
-                    # Linked Pdata objects. Urgh.
-                    pos = 0
-                    while data is not None:
-                        l = len(data.data)
-                        pos = pos + l
-                        if pos > start:
-                            # We are within the range
-                            lstart = l - (pos - start)
-
-                            if lstart < 0: lstart = 0
-
-                            # find the endpoint
-                            if end <= pos:
-                                lend = l - (pos - end)
-
-                                # Send and end transmission
-                                RESPONSE.write(data[lstart:lend])
-                                break
-
-                            # Not yet at the end, transmit what we have.
-                            RESPONSE.write(data[lstart:])
-
-                        data = data.next
-
+                    # Linked Pdata objects.
+                    self._write_pdata_range(RESPONSE, data, start, end)
                     return True
 
                 else:
                     boundary = choose_boundary()
-
-                    # Calculate the content length
-                    size = (8 + len(boundary) + # End marker length
-                        len(ranges) * (         # Constant lenght per set
-                            49 + len(boundary) + len(self.content_type) +
-                            len('%d' % self.size)))
-                    for start, end in ranges:
-                        # Variable length per set
-                        size = (size + len('%d%d' % (start, end - 1)) +
-                            end - start)
-
+                    body = HTTPRangeSupport.MultipartByteranges(
+                        ranges, self.size, self.content_type, boundary)
 
                     # Some clients implement an earlier draft of the spec, they
                     # will only accept x-byteranges.
                     draftprefix = (request_range is not None) and 'x-' or ''
 
-                    RESPONSE.setHeader('Content-Length', size)
+                    RESPONSE.setHeader('Content-Length', len(body))
                     RESPONSE.setHeader('Accept-Ranges', 'bytes')
                     RESPONSE.setHeader('Last-Modified',
                         rfc1123_date(self._p_mtime))
@@ -302,68 +284,36 @@ class File(Persistent, Implicit, PropertyManager,
                             draftprefix, boundary))
                     RESPONSE.setStatus(206) # Partial content
 
-                    data = self.data
-                    # The Pdata map allows us to jump into the Pdata chain
-                    # arbitrarily during out-of-order range searching.
-                    pdata_map = {}
-                    pdata_map[0] = data
-
-                    for start, end in ranges:
-                        RESPONSE.write('\r\n--%s\r\n' % boundary)
-                        RESPONSE.write('Content-Type: %s\r\n' %
-                            self.content_type)
-                        RESPONSE.write(
-                            'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
-                                start, end - 1, self.size))
-
-                        if isinstance(data, str):
-                            RESPONSE.write(data[start:end])
-
-                        else:
-                            # Yippee. Linked Pdata objects. The following
-                            # calculations allow us to fast-forward through the
-                            # Pdata chain without a lot of dereferencing if we
-                            # did the work already.
-                            first_size = len(pdata_map[0].data)
-                            if start < first_size:
-                                closest_pos = 0
-                            else:
-                                closest_pos = (
-                                    ((start - first_size) >> 16 << 16) +
-                                    first_size)
-                            pos = min(closest_pos, max(pdata_map.keys()))
-                            data = pdata_map[pos]
-
-                            while data is not None:
-                                l = len(data.data)
-                                pos = pos + l
-                                if pos > start:
-                                    # We are within the range
-                                    lstart = l - (pos - start)
-
-                                    if lstart < 0: lstart = 0
-
-                                    # find the endpoint
-                                    if end <= pos:
-                                        lend = l - (pos - end)
-
-                                        # Send and loop to next range
-                                        RESPONSE.write(data[lstart:lend])
-                                        break
-
-                                    # Not yet at the end, transmit what we have.
-                                    RESPONSE.write(data[lstart:])
-
-                                data = data.next
-                                # Store a reference to a Pdata chain link so we
-                                # don't have to deref during this request again.
-                                pdata_map[pos] = data
-
-                    # Do not keep the link references around.
-                    del pdata_map
-
-                    RESPONSE.write('\r\n--%s--\r\n' % boundary)
-                    return True
+                    return self._multipart_body(RESPONSE, body)
+
+    def _multipart_body(self, RESPONSE, body):
+        # Return a stream iterator producing the parts of a multipart
+        # range response lazily.  Data in Pdata chains or uncommitted
+        # blobs can't be read by an iterator, it is written to the
+        # response instead, and True is returned.
+        blob = self._blob
+        if blob is not None:
+            try:
+                f = open(blob.committed(), 'rb')
+            except BlobError:
+                f = blob.open('r')
+                try:
+                    for data in body.parts(file_range_reader(f)):
+                        RESPONSE.write(data)
+                finally:
+                    f.close()
+                return True
+            return byterange_iterator(body, file_range_reader(f), f.close)
+
+        data = self.data
+        if isinstance(data, str):
+            return byterange_iterator(body,
+                                      lambda start, end: (data[start:end],))
+
+        # Linked Pdata objects.
+        for part in body.parts(self._pdata_range_reader(data)):
+            RESPONSE.write(part)
+        return True
 
     security.declareProtected(View, 'index_html')
     def index_html(self, REQUEST, RESPONSE):
@@ -394,8 +344,11 @@ class File(Persistent, Implicit, PropertyManager,
             else:
                 c()
 
-        if self._range_request_handler(REQUEST, RESPONSE):
+        result = self._range_request_handler(REQUEST, RESPONSE)
+        if result:
             # we served a chunk of content in response to a range request.
+            if IStreamIterator.providedBy(result):
+                return result
             return ''
 
         RESPONSE.setHeader('Last-Modified', rfc1123_date(self._p_mtime))
@@ -414,6 +367,13 @@ class File(Persistent, Implicit, PropertyManager,
 
         self.ZCacheable_set(None)
 
+        data = self._gzip_body(REQUEST, RESPONSE)
+        if data is not None:
+            return data
+
+        if self._blob is not None:
+            return self._blob_body(RESPONSE)
+
         data=self.data
         if isinstance(data, str):
             RESPONSE.setBase(None)
@@ -425,6 +385,18 @@ class File(Persistent, Implicit, PropertyManager,
 
         return ''
 
+    def _gzip_body(self, REQUEST, RESPONSE):
+        # Return the cached gzip encoded variant of the content, or None.
+        # Uncommitted content isn't cached, its serial is not known yet.
+        if self._p_jar is None or self._p_changed:
+            return None
+        key = (self._p_jar.db().database_name, self._p_oid, self._p_serial)
+        data = gzipVariant(REQUEST, RESPONSE, key, self.content_type,
+                           self.get_size(), lambda: str(self.data))
+        if data is not None:
+            RESPONSE.setHeader('ETag', gzipETag(serialETag(self)))
+        return data
+
     security.declareProtected(View, 'view_image_or_file')
     def view_image_or_file(self, URL1):
         """
@@ -449,7 +421,7 @@ class File(Persistent, Implicit, PropertyManager,
         if content_type is not None: self.content_type=content_type
         if size is None: size=len(data)
         self.size=size
-        self.data=data
+        self._set_data(data)
         self.ZCacheable_invalidate()
         self.ZCacheable_set(None)
         self.http__refreshEtag()
@@ -504,7 +476,11 @@ class File(Persistent, Implicit, PropertyManager,
         if headers and 'content-type' in headers:
             content_type=headers['content-type']
         else:
-            if not isinstance(body, str): body=body.data
+            if isinstance(body, Blob):
+                f=body.open('r')
+                try: body=f.read(1 << 16)
+                finally: f.close()
+            elif not isinstance(body, str): body=body.data
             content_type, enc=guess_content_type(
                 getattr(file, 'filename',id), body, content_type)
         return content_type
@@ -533,6 +509,11 @@ class File(Persistent, Implicit, PropertyManager,
         seek(0,2)
         size=end=file.tell()
 
+        if USE_BLOBS and size >= n:
+            blob = self._read_blob(file)
+            if blob is not None:
+                return blob, size
+
         if size <= 2*n:
             seek(0)
             if size < n: return read(size), size
@@ -552,6 +533,8 @@ class File(Persistent, Implicit, PropertyManager,
         # and to allow us to get things out of memory as soon as
         # possible.
         next = None
+        chunks = []
+        offsets = []
         while end > 0:
             pos = end-n
             if pos < n:
@@ -574,9 +557,167 @@ class File(Persistent, Implicit, PropertyManager,
 
             next = data
             end = pos
+            chunks.append(data)
+            offsets.append(pos)
+
+        # Remember where the chunks start, so that ranges can be served
+        # without walking the chain.
+        chunks.reverse()
+        offsets.reverse()
+        self._pdata_index = PdataIndex(chunks, offsets)
 
         return next, size
 
+    def _pdata_seek(self, data, pos, cursor=None):
+        # Return the chunk of the Pdata chain starting with 'data' that
+        # holds the byte at 'pos', and the offset of that chunk.  Chains
+        # without an index are walked, from 'cursor' if it is before
+        # 'pos'.
+        index = self._pdata_index
+        if index is not None and aq_base(index.chunks[0]) is aq_base(data):
+            return index.find(pos)
+        offset = 0
+        if cursor is not None and cursor[1] <= pos:
+            data, offset = cursor
+        while data.next is not None:
+            l = len(data.data)
+            if offset + l > pos:
+                break
+            offset = offset + l
+            data = data.next
+        return data, offset
+
+    def _pdata_range_reader(self, data):
+        # Return a function generating the chunks of a range of the Pdata
+        # chain starting with 'data'.  Each range is searched from where
+        # the previous one ended.
+        cursor = [None]
+        def read(start, end):
+            chunk, offset = self._pdata_seek(data, start, cursor[0])
+            while 1:
+                cursor[0] = chunk, offset
+                piece = chunk.data
+                yield piece[max(start - offset, 0):end - offset]
+                if offset + len(piece) >= end or chunk.next is None:
+                    return
+                offset = offset + len(piece)
+                chunk = chunk.next
+        return read
+
+    def _write_pdata_range(self, RESPONSE, data, start, end):
+        # Write the bytes from 'start' to 'end' of a Pdata chain.
+        for chunk in self._pdata_range_reader(data)(start, end):
+            RESPONSE.write(chunk)
+
+    def _blobs_supported(self):
+        jar = self._p_jar
+        return jar is not None and IBlobStorage.providedBy(jar.db().storage)
+
+    def _read_blob(self, file):
+        # Copy the file into a new blob, or let the blob take it over if
+        # it is a spooled request body or upload.  Return None if our
+        # storage can't store blobs.
+        import transaction
+
+        # Make sure we have an _p_jar, even if we are a new object.
+        transaction.savepoint(optimistic=True)
+        if not self._blobs_supported():
+            return None
+
+        blob = Blob()
+        link = _link_spool_file(file)
+        if link is not None:
+            try:
+                blob.consumeFile(link)
+            finally:
+                if os.path.exists(link):
+                    os.remove(link)
+            return blob
+
+        f = blob.open('w')
+        try:
+            file.seek(0)
+            while 1:
+                data = file.read(1 << 16)
+                if not data:
+                    break
+                f.write(data)
+        finally:
+            f.close()
+        return blob
+
+    def _set_data(self, data):
+        # Files stored in a blob have no 'data' in their instance
+        # dictionary, so that reading the attribute reads the blob.
+        index = self._pdata_index
+        if (index is not None and
+            aq_base(index.chunks[0]) is not aq_base(data)):
+            self._pdata_index = None
+        if isinstance(data, Blob):
+            self._blob = data
+            if 'data' in self.__dict__:
+                del self.data
+        else:
+            if self._blob is not None:
+                self._blob = None
+            self.data = data
+
+    def _blob_data(self):
+        blob = self._blob
+        if blob is None:
+            return ''
+        f = blob.open('r')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    data = ComputedAttribute(_blob_data)
+
+    def _blob_body(self, RESPONSE):
+        # Serve the blob file directly.  A blob with uncommitted changes
+        # has no file of its own yet, so it is written to the response.
+        blob = self._blob
+        try:
+            return filestream_iterator(blob.committed(), 'rb')
+        except BlobError:
+            f = blob.open('r')
+            try:
+                _write_file_range(RESPONSE, f, 0, self.size)
+            finally:
+                f.close()
+            return ''
+
+    security.declarePrivate('convertToBlob')
+    def convertToBlob(self):
+        """Move the data of the file into a ZODB blob.
+
+        Returns true if the file was converted.  Files smaller than 64KB,
+        files already stored in a blob and files in storages without
+        blob support are left alone.
+        """
+        if (self._blob is not None or self.get_size() < (1 << 16)
+            or not self._blobs_supported()):
+            return False
+
+        data = self.data
+        blob = Blob()
+        f = blob.open('w')
+        try:
+            if isinstance(data, str):
+                f.write(data)
+            else:
+                while data is not None:
+                    f.write(data.data)
+                    next = data.next
+                    # Don't let the chain push hot objects out of the cache
+                    data._p_deactivate()
+                    data = next
+        finally:
+            f.close()
+        self._set_data(blob)
+        return True
+
     security.declareProtected(delete_objects, 'DELETE')
 
     security.declareProtected(change_images_and_files, 'PUT')
@@ -640,6 +781,10 @@ class File(Persistent, Implicit, PropertyManager,
                 RESPONSE.setHeader('Content-Length', self.size)
                 return result
 
+        if self._blob is not None:
+            RESPONSE.setHeader('Content-Length', self.size)
+            return self._blob_body(RESPONSE)
+
         data = self.data
         if isinstance(data, str):
             RESPONSE.setBase(None)
@@ -692,7 +837,15 @@ def manage_addImage(self, id, file, title='', precondition='', content_type='',
 
 
 def getImageInfo(data):
-    data = str(data)
+    # data can also be a file open at the start of the image, of which
+    # only as much is read as is needed to find the image size.
+    file = None
+    if hasattr(data, 'read'):
+        file = data
+        # enough for GIF and PNG, JPEG is searched in the file
+        data = file.read(24)
+    else:
+        data = str(data)
     size = len(data)
     height = -1
     width = -1
@@ -727,7 +880,11 @@ def getImageInfo(data):
     # handle JPEGs
     elif (size >= 2) and (data[:2] == '\377\330'):
         content_type = 'image/jpeg'
-        jpeg = StringIO(data)
+        if file is None:
+            jpeg = StringIO(data)
+        else:
+            jpeg = file
+            jpeg.seek(0)
         jpeg.read(2)
         b = jpeg.read(1)
         try:
@@ -811,9 +968,17 @@ class Image(File):
         if size is None: size=len(data)
 
         self.size=size
-        self.data=data
-
-        ct, width, height = getImageInfo(data)
+        self._set_data(data)
+
+        if self._blob is not None:
+            # don't read all of the blob for its header
+            f = self._blob.open('r')
+            try:
+                ct, width, height = getImageInfo(f)
+            finally:
+                f.close()
+        else:
+            ct, width, height = getImageInfo(self.data)
         if ct:
             content_type = ct
         if width >= 0 and height >= 0:
@@ -891,6 +1056,51 @@ class Image(File):
         return '%s />' % result
 
 
+def convertFilesToBlobs(ob):
+    """Move the data of all files and images in and below 'ob' to blobs.
+
+    Returns the number of converted objects.  The transaction is not
+    committed.
+    """
+    import transaction
+
+    count = 0
+    convert = getattr(aq_base(ob), 'convertToBlob', None)
+    if convert is not None and convert():
+        count = count + 1
+        # release the memory held by the new blob and old chunks
+        transaction.savepoint(optimistic=True)
+    objectValues = getattr(aq_base(ob), 'objectValues', None)
+    if objectValues is not None:
+        for sub in ob.objectValues():
+            count = count + convertFilesToBlobs(sub)
+    return count
+
+
+def _link_spool_file(file):
+    # Request bodies and uploads are spooled to named temporary files,
+    # which go away with the request.  Return the path of a new hard
+    # link to such a file, so that a blob can take it over without
+    # copying the data, or None.
+    name = getattr(file, 'name', None)
+    if (not isinstance(name, str) or
+        os.path.dirname(name) != tempfile.gettempdir()):
+        return None
+    link = name + '.blob'
+    try:
+        file.flush()
+        os.link(name, link)
+    except (AttributeError, OSError):
+        return None
+    return link
+
+
+def _write_file_range(RESPONSE, file, start, end, n=1 << 16):
+    # Write the bytes from 'start' to 'end' of an open file.
+    for data in file_range_reader(file, n)(start, end):
+        RESPONSE.write(data)
+
+
 def cookId(id, title, file):
     if not id and hasattr(file,'filename'):
         filename=file.filename
@@ -913,8 +1123,12 @@ class Pdata(Persistent, Implicit):
         return self.data[i:j]
 
     def __len__(self):
-        data = str(self)
-        return len(data)
+        # add up the chunk sizes instead of joining them
+        size = 0
+        while self is not None:
+            size = size + len(self.data)
+            self = self.next
+        return size
 
     def __str__(self):
         next=self.next
@@ -927,3 +1141,21 @@ class Pdata(Persistent, Implicit):
             next=self.next
 
         return ''.join(r)
+
+
+class PdataIndex(Persistent):
+    """Start offsets of the chunks of a Pdata chain
+
+    The index is a separate record, so that it is only loaded when a
+    range of the data is requested.
+    """
+
+    def __init__(self, chunks, offsets):
+        self.chunks = tuple(chunks)
+        self.offsets = array('L', offsets)
+
+    def find(self, pos):
+        """Return the chunk holding the byte at 'pos' and its offset
+        """
+        i = max(bisect_right(self.offsets, pos) - 1, 0)
+        return self.chunks[i], self.offsets[i]
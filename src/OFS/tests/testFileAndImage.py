@@ -5,6 +5,7 @@ import Zope2
 Zope2.startup()
 
 import os, sys
+import struct
 import time
 from cStringIO import StringIO
 
@@ -200,6 +201,34 @@ class FileTests(unittest.TestCase):
         data, size = self.file._read_data(s)
         self.assertNotEqual(data.next, None)
 
+    def testPdataIndex(self):
+        n = 1 << 16
+        s = ''.join([chr(i % 256) for i in range(3 * n + 100)])
+        data, size = self.file._read_data(StringIO(s))
+        index = self.file._pdata_index
+        self.assertTrue(aq_base(index.chunks[0]) is aq_base(data))
+        self.assertEqual(list(index.offsets), [0, n + 100, 2 * n + 100])
+        chunk, offset = index.find(0)
+        self.assertTrue(aq_base(chunk) is aq_base(data))
+        chunk, offset = index.find(n + 105)
+        self.assertTrue(aq_base(chunk) is aq_base(data.next))
+        self.assertEqual(offset, n + 100)
+        chunk, offset = index.find(size - 1)
+        self.assertTrue(aq_base(chunk) is aq_base(data.next.next))
+        self.assertEqual(chunk.data[size - 1 - offset], s[-1])
+
+    def testPdataIndexDroppedOnUpdate(self):
+        s = "a" * (1 << 16) * 3
+        self.file.manage_upload(StringIO(s))
+        self.assertFalse(self.file._pdata_index is None)
+        self.file.update_data('foo')
+        self.assertTrue(self.file._pdata_index is None)
+
+    def testPdataLen(self):
+        first = Pdata('abc')
+        first.next = Pdata('defg')
+        self.assertEqual(len(first), 7)
+
     def testManageEditWithFileData(self):
         self.file.manage_edit('foobar', 'text/plain', filedata='ASD')
         self.assertEqual(self.file.title, 'foobar')
@@ -249,6 +278,27 @@ class FileTests(unittest.TestCase):
         self.assertEqual(resp.getStatus(), 200)
         self.assertEqual(data, str(self.file.data))
 
+    def testIfNoneMatch(self):
+        transaction.commit()
+        request = self.app.REQUEST
+        data = self.file.index_html(request, request.RESPONSE)
+        etag = request.RESPONSE.getHeader('ETag')
+        self.assertTrue(etag)
+        request.environ['HTTP_IF_NONE_MATCH'] = etag
+        resp = request.RESPONSE
+        resp.setStatus(200)
+        data = self.file.index_html(request, resp)
+        self.assertEqual(data, '')
+        self.assertEqual(resp.getStatus(), 304)
+
+        self.file.manage_edit('foobar', 'text/plain', filedata='changed')
+        transaction.commit()
+        resp.setStatus(200)
+        data = self.file.index_html(request, resp)
+        self.assertEqual(data, 'changed')
+        self.assertEqual(resp.getStatus(), 200)
+        self.assertNotEqual(resp.getHeader('ETag'), etag)
+
     def testPUT(self):
         s = '# some python\n'
 
@@ -280,6 +330,28 @@ class FileTests(unittest.TestCase):
         self.file.index_html(self.app.REQUEST, self.app.REQUEST.RESPONSE)
         self.assert_(not self.app.REQUEST.RESPONSE._wrote)
 
+    def testIndexHtmlGzipVariant(self):
+        import gzip
+        from App import gzipcache
+        self.file.manage_edit('foobar', 'text/plain', filedata='abc' * 100)
+        request = self.app.REQUEST
+        request.environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        gzipcache.configure(1 << 20)
+        try:
+            # uncommitted data is not compressed
+            data = self.file.index_html(request, request.RESPONSE)
+            self.assertEqual(data, 'abc' * 100)
+            transaction.commit()
+            data = self.file.index_html(request, request.RESPONSE)
+        finally:
+            gzipcache.configure(0)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         'abc' * 100)
+        response = request.RESPONSE
+        self.assertEqual(response.getHeader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getHeader('Content-Length'), str(len(data)))
+        self.assertEqual(response.getHeader('Vary'), 'Accept-Encoding')
+
     def testStr(self):
         self.assertEqual(str(self.file), self.data)
 
@@ -353,8 +425,175 @@ class ImageTests(FileTests):
 
         verifyClass(IWriteLock, Image)
 
+class FileBlobTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        import ZODB
+        from ZODB.blob import BlobStorage
+        from ZODB.MappingStorage import MappingStorage
+        self._old_USE_BLOBS = OFS.Image.USE_BLOBS
+        OFS.Image.USE_BLOBS = True
+        self.blob_dir = tempfile.mkdtemp()
+        storage = BlobStorage(self.blob_dir, MappingStorage())
+        self.connection = ZODB.DB(storage).open()
+        r = self.connection.root()
+        r['Application'] = self.root = Application()
+        self.app = makerequest(self.root, stdout=StringIO())
+        transaction.commit()
+
+    def tearDown(self):
+        import shutil
+        transaction.abort()
+        self.connection.close()
+        OFS.Image.USE_BLOBS = self._old_USE_BLOBS
+        shutil.rmtree(self.blob_dir)
+
+    def _addFile(self, data):
+        self.app.manage_addFile('file', file=data,
+                                content_type='text/plain')
+        return self.app.file
+
+    def testSmallFileNotInBlob(self):
+        f = self._addFile('small')
+        self.assertTrue(f._blob is None)
+        self.assertEqual(f.data, 'small')
+
+    def testBigFileInBlob(self):
+        s = 'a' * (3 << 16)
+        f = self._addFile(s)
+        self.assertFalse(f._blob is None)
+        self.assertFalse('data' in f.__dict__)
+        self.assertEqual(f.size, len(s))
+        self.assertEqual(f.data, s)
+        self.assertEqual(str(f), s)
+        self.assertEqual(f.PrincipiaSearchSource(), s)
+
+    def testSpooledUploadMovedIntoBlob(self):
+        import os
+        import tempfile
+        s = 'a' * (3 << 16)
+        upload = tempfile.NamedTemporaryFile('w+b')
+        upload.write(s)
+        f = self._addFile(upload)
+        blob_file = f._blob._p_blob_uncommitted
+        self.assertEqual(os.stat(blob_file).st_ino,
+                         os.fstat(upload.fileno()).st_ino)
+        self.assertFalse(os.path.exists(upload.name + '.blob'))
+        upload.close()
+        transaction.commit()
+        self.assertEqual(f.data, s)
+
+    def testIndexHtmlServesBlobFile(self):
+        from ZPublisher.Iterators import filestream_iterator
+        s = 'a' * (3 << 16)
+        f = self._addFile(s)
+        transaction.commit()
+        request = self.app.REQUEST
+        result = f.index_html(request, request.RESPONSE)
+        self.assertTrue(isinstance(result, filestream_iterator))
+        self.assertEqual(result.read(), s)
+        result.close()
+
+    def testIndexHtmlUncommittedBlob(self):
+        s = 'a' * (3 << 16)
+        f = self._addFile(s)
+        request = self.app.REQUEST
+        self.assertEqual(f.index_html(request, request.RESPONSE), '')
+        self.assertTrue(self.app.REQUEST.RESPONSE.stdout.getvalue()
+                        .endswith(s))
+
+    def testUpdateDataReplacesBlob(self):
+        f = self._addFile('a' * (3 << 16))
+        f.update_data('foo')
+        self.assertTrue(f._blob is None)
+        self.assertEqual(f.data, 'foo')
+
+    def testWithoutBlobSupport(self):
+        from ZODB.MappingStorage import MappingStorage
+        import ZODB
+        connection = ZODB.DB(MappingStorage()).open()
+        try:
+            app = connection.root()['Application'] = Application()
+            transaction.savepoint(optimistic=True)
+            app.manage_addFile('file', file='a' * (3 << 16))
+            self.assertTrue(app.file._blob is None)
+            self.assertTrue(isinstance(app.file.data, Pdata))
+        finally:
+            transaction.abort()
+            connection.close()
+
+    def testConvertToBlob(self):
+        s = 'abcdefgh' * (1 << 15)
+        OFS.Image.USE_BLOBS = False
+        f = self._addFile(s)
+        transaction.commit()
+        self.assertTrue(isinstance(f.data, Pdata))
+        self.assertTrue(f.convertToBlob())
+        self.assertFalse(f.convertToBlob())
+        transaction.commit()
+        self.assertFalse(f._blob is None)
+        self.assertEqual(f.data, s)
+        self.assertEqual(f.size, len(s))
+
+    def testImageInBlobReadsHeaderOnly(self):
+        from ComputedAttribute import ComputedAttribute
+        from OFS.Image import Image
+        def data(self):
+            raise AssertionError('all image data read')
+        image = open(imagedata, 'rb').read() + '\0' * (3 << 16)
+        Image.data = ComputedAttribute(data)
+        try:
+            self.app.manage_addImage('image', file=image)
+        finally:
+            del Image.data
+        image = self.app.image
+        self.assertFalse(image._blob is None)
+        self.assertEqual(image.content_type, 'image/gif')
+        self.assertEqual((image.width, image.height), (16, 16))
+
+    def testConvertFilesToBlobs(self):
+        from OFS.Folder import manage_addFolder
+        from OFS.Image import convertFilesToBlobs
+        OFS.Image.USE_BLOBS = False
+        manage_addFolder(self.app, 'folder')
+        self.app.folder.manage_addFile('big', file='a' * (3 << 16))
+        self.app.folder.manage_addFile('small', file='a')
+        self.app.manage_addImage('image', file=open(imagedata, 'rb'))
+        self.assertEqual(convertFilesToBlobs(self.app), 1)
+        self.assertFalse(self.app.folder.big._blob is None)
+        self.assertTrue(self.app.folder.small._blob is None)
+        self.assertEqual(convertFilesToBlobs(self.app), 0)
+
+
+class GetImageInfoTests(unittest.TestCase):
+
+    def _callFUT(self, data):
+        from OFS.Image import getImageInfo
+        return getImageInfo(data)
+
+    def _jpeg(self):
+        # a JPEG header with a big application segment before the frame
+        app1 = '\xff\xe1' + struct.pack('>H', 60002) + 'x' * 60000
+        sof0 = '\xff\xc0\x00\x11\x08' + struct.pack('>HH', 48, 64)
+        return '\xff\xd8' + app1 + sof0 + '\x03' + '\0' * 9 + '\xff\xda'
+
+    def test_string_and_file(self):
+        data = open(imagedata, 'rb').read()
+        self.assertEqual(self._callFUT(data), ('image/gif', 16, 16))
+        self.assertEqual(self._callFUT(StringIO(data)), ('image/gif', 16, 16))
+
+    def test_jpeg_file(self):
+        data = self._jpeg()
+        self.assertEqual(self._callFUT(data), ('image/jpeg', 64, 48))
+        self.assertEqual(self._callFUT(StringIO(data)),
+                         ('image/jpeg', 64, 48))
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(FileTests),
+        unittest.makeSuite(GetImageInfoTests),
         unittest.makeSuite(ImageTests),
+        unittest.makeSuite(FileBlobTests),
         ))
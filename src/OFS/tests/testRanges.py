@@ -20,6 +20,14 @@ def makeConnection():
     s = DemoStorage()
     return ZODB.DB( s ).open()
 
+def makeBlobConnection(blob_dir):
+    import ZODB
+    from ZODB.blob import BlobStorage
+    from ZODB.MappingStorage import MappingStorage
+
+    s = BlobStorage(blob_dir, MappingStorage())
+    return ZODB.DB( s ).open()
+
 def createBigFile():
     # Create a file that is several 1<<16 blocks of data big, to force the
     # use of chained Pdata objects.
@@ -51,7 +59,7 @@ class TestRequestRange(unittest.TestCase):
         from OFS.Image import manage_addFile
         from Testing.makerequest import makerequest
         self.responseOut = cStringIO.StringIO()
-        self.connection = makeConnection()
+        self.connection = self._makeConnection()
         try:
             r = self.connection.root()
             a = Application()
@@ -91,12 +99,18 @@ class TestRequestRange(unittest.TestCase):
         del self.app
 
     # Utility methods
+    def _makeConnection(self):
+        return makeConnection()
+
     def uploadBigFile(self):
         self.file.manage_upload(BIGFILE)
         self.data = BIGFILE.getvalue()
 
     def doGET(self, request, response):
+        from ZPublisher.Iterators import IStreamIterator
         rv = self.file.index_html(request, response)
+        if IStreamIterator.providedBy(rv):
+            rv = ''.join(rv)
 
         # Large files are written to resposeOut directly, small ones are
         # returned from the index_html method.
@@ -301,7 +315,12 @@ class TestRequestRange(unittest.TestCase):
 
     # Multiple ranges
     def testAdjacentRanges(self):
-        self.expectMultipleRanges('21-25,10-20', [(21, 26), (10, 21)])
+        # Adjacent ranges are coalesced
+        self.expectSingleRange('21-25,10-20', 10, 26)
+
+    def testOverlappingRanges(self):
+        self.expectMultipleRanges('30-40,3-7,5-10,35-37',
+            [(30, 41), (3, 11)])
 
     def testMultipleRanges(self):
         self.expectMultipleRanges('3-7,10-15', [(3, 8), (10, 16)])
@@ -312,7 +331,7 @@ class TestRequestRange(unittest.TestCase):
     def testMultipleRangesBigFile(self):
         self.uploadBigFile()
         self.expectMultipleRanges('3-700,10-15,-10000',
-            [(3, 701), (10, 16), (len(self.data) - 10000, len(self.data))])
+            [(3, 701), (len(self.data) - 10000, len(self.data))])
 
     def testMultipleRangesBigFileOutOfOrder(self):
         self.uploadBigFile()
@@ -320,6 +339,14 @@ class TestRequestRange(unittest.TestCase):
             [(10, 16), (len(self.data) - 10000, len(self.data)),
              (70000, 80001)])
 
+    def testManyRangesBigFile(self):
+        self.uploadBigFile()
+        sets = [(start, start + 100)
+                for start in range(len(self.data) - 1000, 0, -3000)]
+        self.expectMultipleRanges(
+            ','.join(['%d-%d' % (start, end - 1) for start, end in sets]),
+            sets)
+
     def testMultipleRangesBigFileEndOverflow(self):
         self.uploadBigFile()
         l = len(self.data)
@@ -354,7 +381,58 @@ class TestRequestRange(unittest.TestCase):
             if_range=self.file.http__etag() + 'bar')
 
 
+class TestRequestRangeWithoutIndex(TestRequestRange):
+    # Pdata chains uploaded before files had a chunk index are walked
+
+    def uploadBigFile(self):
+        TestRequestRange.uploadBigFile(self)
+        self.assertFalse(self.file._pdata_index is None)
+        self.file._pdata_index = None
+
+
+class TestRequestRangeBlob(TestRequestRange):
+    # The same, with big files stored in blobs
+
+    def _makeConnection(self):
+        import tempfile
+        self.blob_dir = tempfile.mkdtemp()
+        return makeBlobConnection(self.blob_dir)
+
+    def setUp(self):
+        import OFS.Image
+        self._old_USE_BLOBS = OFS.Image.USE_BLOBS
+        OFS.Image.USE_BLOBS = True
+        TestRequestRange.setUp(self)
+
+    def tearDown(self):
+        import shutil
+        import OFS.Image
+        TestRequestRange.tearDown(self)
+        OFS.Image.USE_BLOBS = self._old_USE_BLOBS
+        shutil.rmtree(self.blob_dir)
+
+    def uploadBigFile(self):
+        TestRequestRange.uploadBigFile(self)
+        self.assertFalse(self.file._blob is None)
+
+    def testBigFileCommitted(self):
+        import transaction
+        self.uploadBigFile()
+        transaction.commit()
+        self.expectSingleRange('70000-80000', 70000, 80001)
+
+    def testMultipleRangesBigFileCommitted(self):
+        import transaction
+        self.uploadBigFile()
+        transaction.commit()
+        self.expectMultipleRanges('10-15,-10000,70000-80000',
+            [(10, 16), (len(self.data) - 10000, len(self.data)),
+             (70000, 80001)])
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest( unittest.makeSuite( TestRequestRange ) )
+    suite.addTest( unittest.makeSuite( TestRequestRangeWithoutIndex ) )
+    suite.addTest( unittest.makeSuite( TestRequestRangeBlob ) )
     return suite
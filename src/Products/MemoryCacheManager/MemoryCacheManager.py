@@ -0,0 +1,462 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""Memory cache manager
+
+Caches the results of rendering cacheable objects, such as page
+templates and DTML methods, in memory.  The cache is bounded by the
+number of entries and by their approximate size in bytes; the least
+recently used entries are evicted first.
+"""
+
+from thread import allocate_lock
+import time
+
+from AccessControl.class_init import InitializeClass
+from AccessControl.Permissions import view_management_screens
+from AccessControl.SecurityInfo import ClassSecurityInfo
+from App.special_dtml import DTMLFile
+from OFS.Cache import Cache
+from OFS.Cache import CacheManager
+from OFS.SimpleItem import SimpleItem
+
+try:
+    from cPickle import Pickler
+    from cPickle import HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import Pickler
+    from pickle import HIGHEST_PROTOCOL
+
+change_cache_managers = 'Change cache managers'
+
+
+class _ByteCounter:
+    # file-like object that only counts the bytes written to it
+    count = 0
+
+    def write(self, bytes):
+        self.count = self.count + len(bytes)
+
+
+def entrySize(data):
+    """Return the approximate size of 'data' in bytes
+
+    Strings are measured directly, other data by the size of its
+    pickle.  Data that can't be pickled raises TypeError, so that it is
+    not cached: it may refer to persistent objects.
+    """
+    if isinstance(data, str):
+        return len(data)
+    if isinstance(data, unicode):
+        return len(data) * 2
+    counter = _ByteCounter()
+    try:
+        Pickler(counter, HIGHEST_PROTOCOL).dump(data)
+    except Exception:
+        raise TypeError('The data for the cache is not pickleable.')
+    return counter.count
+
+
+def cacheIndex(view_name, request, request_vars, keywords):
+    """Return the key of a cache entry within an object's entries
+    """
+    req_index = []
+    for key in request_vars:
+        if request is None:
+            val = ''
+        else:
+            val = request.get(key, '')
+        req_index.append((str(key), str(val)))
+    if keywords:
+        local_index = [(str(key), str(val)) for key, val in keywords.items()]
+        local_index.sort()
+    else:
+        local_index = ()
+    return (str(view_name), tuple(req_index), tuple(local_index))
+
+
+class CacheEntry:
+
+    __slots__ = ('key', 'data', 'size', 'lastmod', 'created', 'prev', 'next')
+
+    def __init__(self, key, data, size, lastmod, created):
+        self.key = key
+        self.data = data
+        self.size = size
+        self.lastmod = lastmod
+        self.created = created
+        self.prev = self.next = self
+
+
+class MemoryCache(Cache):
+    """Thread-safe, size bounded LRU cache
+
+    Entries are kept in a mapping from (physical path, index) to
+    CacheEntry.  The entries are also linked in a ring, from the least
+    to the most recently used, starting after the sentinel entry
+    '_lru'.  An entry is stale if
+    the modification time of its object has changed since it was
+    stored, or if it is older than 'max_age' seconds.
+
+    Objects of this class are neither persistent nor acquisition aware.
+    """
+
+    max_entries = 1000
+    max_bytes = 1 << 24
+    max_age = 0
+    request_vars = ('AUTHENTICATED_USER',)
+
+    def __init__(self):
+        self._lock = allocate_lock()
+        self._entries = {}
+        self._lru = CacheEntry(None, None, 0, 0, 0)
+        self._paths = {}   # physical path -> {index: 1}
+        self.bytes = 0
+        self.resetStatistics()
+
+    def initSettings(self, kw):
+        self._lock.acquire()
+        try:
+            self.__dict__.update(kw)
+            self.settings = kw
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def resetStatistics(self):
+        self._lock.acquire()
+        try:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+            self._report = {}  # physical path -> [hits, misses]
+        finally:
+            self._lock.release()
+
+    def _count(self, path, hit):
+        # must be called with the lock held
+        report = self._report
+        counts = report.get(path)
+        if counts is None:
+            if len(report) > self.max_entries:
+                # forget objects that are no longer cached
+                for p in report.keys():
+                    if p not in self._paths:
+                        del report[p]
+            counts = report[path] = [0, 0]
+        if hit:
+            self.hits = self.hits + 1
+            counts[0] = counts[0] + 1
+        else:
+            self.misses = self.misses + 1
+            counts[1] = counts[1] + 1
+
+    def _link(self, entry):
+        # Make entry the most recently used one; must be called with the
+        # lock held.
+        lru = self._lru
+        entry.prev = lru.prev
+        entry.next = lru
+        lru.prev.next = entry
+        lru.prev = entry
+
+    def _unlink(self, entry):
+        # must be called with the lock held
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = entry.next = entry
+
+    def _remove(self, key):
+        # must be called with the lock held
+        entry = self._entries.pop(key)
+        self._unlink(entry)
+        self.bytes = self.bytes - entry.size
+        path, index = key
+        indexes = self._paths[path]
+        del indexes[index]
+        if not indexes:
+            del self._paths[path]
+
+    def _evict(self):
+        # must be called with the lock held
+        entries = self._entries
+        while entries and (len(entries) > self.max_entries
+                           or self.bytes > self.max_bytes):
+            self._remove(self._lru.next.key)
+            self.evictions = self.evictions + 1
+
+    def ZCache_get(self, ob, view_name='', keywords=None,
+                   mtime_func=None, default=None):
+        path = ob.getPhysicalPath()
+        index = cacheIndex(view_name, getattr(ob, 'REQUEST', None),
+                           self.request_vars, keywords)
+        key = (path, index)
+        lastmod = ob.ZCacheable_getModTime(mtime_func)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                max_age = self.max_age
+                if entry.lastmod < lastmod or (
+                    max_age and entry.created < time.time() - max_age):
+                    self._remove(key)
+                    self.invalidations = self.invalidations + 1
+                    entry = None
+            if entry is None:
+                self._count(path, False)
+                return default
+            # mark the entry as most recently used
+            self._unlink(entry)
+            self._link(entry)
+            self._count(path, True)
+            return entry.data
+        finally:
+            self._lock.release()
+
+    def ZCache_set(self, ob, data, view_name='', keywords=None,
+                   mtime_func=None):
+        size = entrySize(data)
+        if size > self.max_bytes:
+            return
+        path = ob.getPhysicalPath()
+        index = cacheIndex(view_name, getattr(ob, 'REQUEST', None),
+                           self.request_vars, keywords)
+        key = (path, index)
+        entry = CacheEntry(key, data, size,
+                           ob.ZCacheable_getModTime(mtime_func), time.time())
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._link(entry)
+            self._paths.setdefault(path, {})[index] = 1
+            self.bytes = self.bytes + size
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def ZCache_invalidate(self, ob):
+        # Invalidates the entries of subobjects as well.
+        path = ob.getPhysicalPath()
+        self._lock.acquire()
+        try:
+            for p in self._paths.keys():
+                if p[:len(path)] == path:
+                    for index in self._paths[p].keys():
+                        self._remove((p, index))
+                        self.invalidations = self.invalidations + 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._lru = CacheEntry(None, None, 0, 0, 0)
+            self._paths.clear()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self.clear()
+
+    def getStatistics(self):
+        """Return the cache counters as a mapping
+        """
+        self._lock.acquire()
+        try:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                }
+        finally:
+            self._lock.release()
+
+    def getCacheReport(self):
+        """Return a mapping with the counters of every cached object
+        """
+        self._lock.acquire()
+        try:
+            rval = []
+            paths = self._paths
+            entries = self._entries
+            for path, (hits, misses) in self._report.items():
+                indexes = paths.get(path, {})
+                size = 0
+                views = {}
+                for index in indexes:
+                    size = size + entries[(path, index)].size
+                    views[index[0] or '<default>'] = 1
+                views = views.keys()
+                views.sort()
+                rval.append({'path': '/'.join(path),
+                             'hits': hits,
+                             'misses': misses,
+                             'size': size,
+                             'views': views,
+                             'entries': len(indexes),
+                             })
+            return rval
+        finally:
+            self._lock.release()
+
+
+caches = {}
+
+
+class MemoryCacheManager(CacheManager, SimpleItem):
+    """Manage a MemoryCache, which stores rendered data in memory.
+
+    Like the results of any RAM cache, cached pages don't carry the
+    HTTP headers set while rendering them.
+    """
+
+    security = ClassSecurityInfo()
+    security.setPermissionDefault(change_cache_managers, ('Manager',))
+
+    manage_options = (
+        {'label': 'Properties', 'action': 'manage_main'},
+        {'label': 'Statistics', 'action': 'manage_stats'},
+        ) + CacheManager.manage_options + SimpleItem.manage_options
+
+    meta_type = 'Memory Cache Manager'
+
+    _cache_class = MemoryCache
+
+    def __init__(self, ob_id):
+        self.id = ob_id
+        self.title = ''
+        self._settings = {
+            'max_entries': MemoryCache.max_entries,
+            'max_bytes': MemoryCache.max_bytes,
+            'max_age': MemoryCache.max_age,
+            'request_vars': MemoryCache.request_vars,
+            }
+        self._resetCacheId()
+
+    def getId(self):
+        ' '
+        return self.id
+
+    security.declarePrivate('_remove_data')
+    def _remove_data(self):
+        cache = caches.pop(self.__cacheid, None)
+        if cache is not None:
+            cache.close()
+
+    security.declarePrivate('_resetCacheId')
+    def _resetCacheId(self):
+        self.__cacheid = '%s_%f' % (id(self), time.time())
+
+    ZCacheManager_getCache__roles__ = ()
+    def ZCacheManager_getCache(self):
+        cacheid = self.__cacheid
+        settings = self._settings
+        cache = caches.get(cacheid)
+        if cache is None:
+            cache = self._cache_class()
+            cache.initSettings(settings)
+            cache = caches.setdefault(cacheid, cache)
+        elif cache.settings != settings and not self._p_changed:
+            # The settings were changed by a committed transaction,
+            # possibly in another process.  Settings changed by the
+            # current transaction are applied once they are committed.
+            cache.initSettings(settings)
+        return cache
+
+    security.declareProtected(view_management_screens, 'getSettings')
+    def getSettings(self):
+        'Returns the current cache settings.'
+        return self._settings.copy()
+
+    security.declareProtected(view_management_screens, 'manage_main')
+    manage_main = DTMLFile('dtml/propsMCM', globals())
+
+    security.declareProtected(change_cache_managers, 'manage_editProps')
+    def manage_editProps(self, title, settings=None, REQUEST=None):
+        'Changes the cache settings.'
+        if settings is None:
+            settings = REQUEST
+        self.title = str(title)
+        request_vars = list(settings['request_vars'])
+        request_vars.sort()
+        self._settings = {
+            'max_entries': int(settings['max_entries']),
+            'max_bytes': int(settings['max_bytes']),
+            'max_age': int(settings['max_age']),
+            'request_vars': tuple(request_vars),
+            }
+        if REQUEST is not None:
+            return self.manage_main(
+                self, REQUEST, manage_tabs_message='Properties changed.')
+
+    security.declareProtected(view_management_screens, 'manage_stats')
+    manage_stats = DTMLFile('dtml/statsMCM', globals())
+
+    security.declareProtected(view_management_screens, 'getStatistics')
+    def getStatistics(self):
+        """Returns the cache counters as a mapping.
+        """
+        return self.ZCacheManager_getCache().getStatistics()
+
+    security.declareProtected(view_management_screens, 'getCacheReport')
+    def getCacheReport(self):
+        """Returns the objects in the cache, most hits first.
+        """
+        rval = self.ZCacheManager_getCache().getCacheReport()
+        rval.sort(key=lambda info: info['hits'], reverse=True)
+        return rval
+
+    security.declareProtected(change_cache_managers, 'manage_invalidate')
+    def manage_invalidate(self, paths=(), REQUEST=None):
+        """Invalidates the entries of the given objects.
+        """
+        for path in paths:
+            try:
+                ob = self.unrestrictedTraverse(path)
+            except (AttributeError, KeyError):
+                continue
+            ob.ZCacheable_invalidate()
+        if REQUEST is not None:
+            return self.manage_stats(
+                self, REQUEST, manage_tabs_message='Cache entries invalidated.')
+
+    security.declareProtected(change_cache_managers, 'manage_clearCache')
+    def manage_clearCache(self, REQUEST=None):
+        """Removes all entries and resets the statistics.
+        """
+        cache = self.ZCacheManager_getCache()
+        cache.clear()
+        cache.resetStatistics()
+        if REQUEST is not None:
+            return self.manage_stats(
+                self, REQUEST, manage_tabs_message='Cache cleared.')
+
+InitializeClass(MemoryCacheManager)
+
+
+manage_addMemoryCacheManagerForm = DTMLFile('dtml/addMCM', globals())
+
+def manage_addMemoryCacheManager(self, id, REQUEST=None):
+    'Adds a memory cache manager to the folder.'
+    self._setObject(id, MemoryCacheManager(id))
+    if REQUEST is not None:
+        return self.manage_main(self, REQUEST)
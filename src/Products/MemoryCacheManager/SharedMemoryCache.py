@@ -0,0 +1,487 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""Shared memory cache manager
+
+Caches rendered results in a memory-mapped file, so that all Zope
+processes on a host that use the same file share the cached results,
+and the cache survives restarts.  Cache files live in the 'caches'
+directory of the client home; a file that does not start with the
+cache's magic is never touched.
+
+The file holds a header, a clock hand for every set and a number of
+fixed-size slots.  The slots are grouped into sets of 'ways' slots; an
+entry can only be stored in the set selected by the digest of its key.
+When a set is full, the clock hand of the set looks for a slot that has
+not been used since it last passed, and reuses it.
+
+Every slot starts with a header followed by the path and view name of
+the cached object, and the pickled data.  Processes lock the file with
+flock(2) while they read or write it.
+"""
+
+from cPickle import dumps
+from cPickle import loads
+from cPickle import HIGHEST_PROTOCOL
+from hashlib import md5
+from logging import getLogger
+from thread import allocate_lock
+import mmap
+import os
+import stat
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock(2), only one process may use a cache file.
+    fcntl = None
+
+from AccessControl.class_init import InitializeClass
+from App.config import getConfiguration
+from App.special_dtml import DTMLFile
+from OFS.Cache import Cache
+
+from Products.MemoryCacheManager.MemoryCacheManager import cacheIndex
+from Products.MemoryCacheManager.MemoryCacheManager import MemoryCacheManager
+
+LOG = getLogger('SharedMemoryCache')
+
+MAGIC = 'ZSMC0001'
+
+# magic, number of slots, size of a slot, ways
+HEADER = struct.Struct('<8sIII')
+
+# used, referenced, key digest, modification time, creation time,
+# length of the path and view name, length of the data
+SLOT = struct.Struct('<BB16sddII')
+
+# Refuse to follow a symbolic link planted in the cache directory.
+O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+
+def getCacheDirectory():
+    """Return the directory that holds the cache files"""
+    return os.path.join(getConfiguration().clienthome, 'caches')
+
+
+def checkFilename(filename):
+    """Make sure that a cache file name doesn't lead out of the cache
+    directory, and return it.
+    """
+    if (not filename or filename.startswith('.') or '\0' in filename or
+        os.path.basename(filename) != filename or
+        (os.altsep and os.altsep in filename)):
+        raise ValueError('Invalid cache file name: %r' % filename)
+    return filename
+
+
+class SharedMemoryCache(Cache):
+    """Cache whose entries live in a memory-mapped file
+
+    Hit and miss counters are kept for each process.
+    """
+
+    filename = None
+    size = 1 << 26
+    slot_size = 1 << 16
+    ways = 8
+    max_age = 0
+    request_vars = ('AUTHENTICATED_USER',)
+
+    def __init__(self):
+        self._lock = allocate_lock()
+        self._fd = None
+        self._map = None
+        self._refused = False
+        self.resetStatistics()
+
+    def initSettings(self, kw):
+        self._lock.acquire()
+        try:
+            self.__dict__.update(kw)
+            self.settings = kw
+            self._close()
+            self._refused = False
+        finally:
+            self._lock.release()
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.too_large = 0
+        self._report = {}  # path -> [hits, misses]
+
+    def _geometry(self):
+        ways = self.ways
+        nsets = max(self.size // (self.slot_size * ways), 1)
+        return nsets * ways, nsets
+
+    def _open(self):
+        # Map the cache file, initializing it if it is new or doesn't
+        # match our settings.  Return false if the file is not a cache
+        # file.  Must be called with the thread lock held.
+        if self._map is not None:
+            return True
+        if self._refused:
+            return False
+        nslots, nsets = self._geometry()
+        length = HEADER.size + nsets + nslots * self.slot_size
+        header = HEADER.pack(MAGIC, nslots, self.slot_size, self.ways)
+        directory = getCacheDirectory()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        path = os.path.join(directory, checkFilename(self.filename))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | O_NOFOLLOW, 0600)
+        try:
+            self._flock(fd, True)
+            try:
+                st = os.fstat(fd)
+                foreign = not stat.S_ISREG(st.st_mode)
+                if not foreign and st.st_size:
+                    current = os.read(fd, HEADER.size)
+                    foreign = not current.startswith(MAGIC)
+                else:
+                    current = ''
+                if not foreign and (current != header or
+                                    st.st_size != length):
+                    # The file starts with the magic at all times, so
+                    # that it is never mistaken for a foreign file.
+                    os.lseek(fd, 0, 0)
+                    os.write(fd, header)
+                    os.ftruncate(fd, HEADER.size)
+                    os.ftruncate(fd, length)
+            finally:
+                self._flock(fd, None)
+            if not foreign:
+                self._map = mmap.mmap(fd, length)
+        except:
+            os.close(fd)
+            raise
+        if foreign:
+            os.close(fd)
+            self._refused = True
+            LOG.error('%s is not a shared memory cache file; '
+                      'not caching until the settings change.', path)
+            return False
+        self._fd = fd
+        self._header = header
+        self._nsets = nsets
+        self._slots = HEADER.size + nsets
+        return True
+
+    def _close(self):
+        # must be called with the thread lock held
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = self._fd = None
+
+    def _flock(self, fd, exclusive):
+        if fcntl is not None:
+            if exclusive is None:
+                op = fcntl.LOCK_UN
+            elif exclusive:
+                op = fcntl.LOCK_EX
+            else:
+                op = fcntl.LOCK_SH
+            fcntl.flock(fd, op)
+
+    def _acquire(self, exclusive):
+        # Lock the cache file and return its map, or None if another
+        # process changed the layout of the file or the file is not a
+        # cache file.  Callers must release the locks with '_release',
+        # even if None is returned.
+        self._lock.acquire()
+        try:
+            if not self._open():
+                return None
+            self._flock(self._fd, exclusive)
+        except:
+            self._lock.release()
+            raise
+        map = self._map
+        if map[:HEADER.size] != self._header:
+            # reopen the file on the next access
+            self._flock(self._fd, None)
+            self._close()
+            return None
+        return map
+
+    def _release(self):
+        try:
+            if self._fd is not None:
+                self._flock(self._fd, None)
+        finally:
+            self._lock.release()
+
+    def _slotOffsets(self, digest):
+        ways = self.ways
+        set_index = struct.unpack('<I', digest[:4])[0] % self._nsets
+        first = self._slots + set_index * ways * self.slot_size
+        return set_index, [first + i * self.slot_size for i in range(ways)]
+
+    def _allSlotOffsets(self):
+        nslots = self._nsets * self.ways
+        return [self._slots + i * self.slot_size for i in range(nslots)]
+
+    def _key(self, ob, view_name, keywords):
+        path = '/'.join(ob.getPhysicalPath())
+        index = cacheIndex(view_name, getattr(ob, 'REQUEST', None),
+                           self.request_vars, keywords)
+        digest = md5(dumps((path, index), HIGHEST_PROTOCOL)).digest()
+        return path, digest
+
+    def _count(self, path, hit):
+        # must be called with the thread lock held
+        report = self._report
+        counts = report.get(path)
+        if counts is None:
+            if len(report) >= self._geometry()[0]:
+                report.clear()
+            counts = report[path] = [0, 0]
+        if hit:
+            self.hits = self.hits + 1
+            counts[0] = counts[0] + 1
+        else:
+            self.misses = self.misses + 1
+            counts[1] = counts[1] + 1
+
+    def ZCache_get(self, ob, view_name='', keywords=None,
+                   mtime_func=None, default=None):
+        path, digest = self._key(ob, view_name, keywords)
+        lastmod = ob.ZCacheable_getModTime(mtime_func)
+        data = None
+        map = self._acquire(False)
+        try:
+            if map is not None:
+                set_index, offsets = self._slotOffsets(digest)
+                for offset in offsets:
+                    (used, referenced, slot_digest, slot_lastmod, created,
+                     meta_len, data_len) = SLOT.unpack_from(map, offset)
+                    if not used or slot_digest != digest:
+                        continue
+                    max_age = self.max_age
+                    if slot_lastmod < lastmod or (
+                        max_age and created < time.time() - max_age):
+                        # stale, ZCache_set will replace it
+                        break
+                    if not referenced:
+                        map[offset + 1] = '\1'
+                    start = offset + SLOT.size + meta_len
+                    data = map[start:start + data_len]
+                    break
+            self._count(path, data is not None)
+        finally:
+            self._release()
+        if data is None:
+            return default
+        return loads(data)
+
+    def ZCache_set(self, ob, data, view_name='', keywords=None,
+                   mtime_func=None):
+        path, digest = self._key(ob, view_name, keywords)
+        meta = '%s\0%s' % (path, view_name)
+        try:
+            data = dumps(data, HIGHEST_PROTOCOL)
+        except Exception:
+            raise TypeError('The data for the cache is not pickleable.')
+        if SLOT.size + len(meta) + len(data) > self.slot_size:
+            self._lock.acquire()
+            try:
+                self.too_large = self.too_large + 1
+            finally:
+                self._lock.release()
+            return
+        slot = SLOT.pack(1, 1, digest, ob.ZCacheable_getModTime(mtime_func),
+                         time.time(), len(meta), len(data))
+        map = self._acquire(True)
+        try:
+            if map is None:
+                return
+            set_index, offsets = self._slotOffsets(digest)
+            target = None
+            for offset in offsets:
+                used, referenced, slot_digest = SLOT.unpack_from(map, offset)[:3]
+                if used and slot_digest == digest:
+                    target = offset
+                    break
+                if not used and target is None:
+                    target = offset
+            if target is None:
+                target = self._sweep(map, set_index, offsets)
+                self.evictions = self.evictions + 1
+            end = target + SLOT.size + len(meta) + len(data)
+            map[target:end] = slot + meta + data
+        finally:
+            self._release()
+
+    def _sweep(self, map, set_index, offsets):
+        # Advance the clock hand of the set to a slot that has not been
+        # referenced since the hand passed it last, clearing the
+        # referenced bits on the way.
+        hand_offset = HEADER.size + set_index
+        hand = ord(map[hand_offset]) % len(offsets)
+        while 1:
+            offset = offsets[hand]
+            hand = (hand + 1) % len(offsets)
+            if map[offset + 1] == '\0':
+                break
+            map[offset + 1] = '\0'
+        map[hand_offset] = chr(hand)
+        return offset
+
+    def _entries(self, map):
+        # Yield the offset, path, view name and data length of all
+        # entries.
+        for offset in self._allSlotOffsets():
+            if map[offset] == '\0':
+                continue
+            meta_len, data_len = SLOT.unpack_from(map, offset)[-2:]
+            start = offset + SLOT.size
+            path, view_name = map[start:start + meta_len].split('\0', 1)
+            yield offset, path, view_name, data_len
+
+    def ZCache_invalidate(self, ob):
+        # Invalidates the entries of subobjects as well.
+        path = '/'.join(ob.getPhysicalPath())
+        prefix = path + '/'
+        map = self._acquire(True)
+        try:
+            if map is not None:
+                for offset, p, view_name, data_len in self._entries(map):
+                    if p == path or p.startswith(prefix):
+                        map[offset] = '\0'
+                        self.invalidations = self.invalidations + 1
+        finally:
+            self._release()
+
+    def clear(self):
+        map = self._acquire(True)
+        try:
+            if map is not None:
+                for offset in self._allSlotOffsets():
+                    map[offset] = '\0'
+        finally:
+            self._release()
+
+    def close(self):
+        # Unmap the file.  Entries stay in the file for other processes.
+        self._lock.acquire()
+        try:
+            self._close()
+        finally:
+            self._lock.release()
+
+    def getStatistics(self):
+        """Return the cache counters as a mapping
+        """
+        entries = size = 0
+        map = self._acquire(False)
+        try:
+            if map is not None:
+                for offset, path, view_name, data_len in self._entries(map):
+                    entries = entries + 1
+                    size = size + data_len
+        finally:
+            self._release()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'too_large': self.too_large,
+            }
+
+    def getCacheReport(self):
+        """Return a mapping with the counters of every cached object
+        """
+        info = {}
+        map = self._acquire(False)
+        try:
+            if map is not None:
+                for offset, path, view_name, data_len in self._entries(map):
+                    d = info.get(path)
+                    if d is None:
+                        d = info[path] = {'path': path, 'size': 0,
+                                          'views': [], 'entries': 0}
+                    d['size'] = d['size'] + data_len
+                    d['entries'] = d['entries'] + 1
+                    view_name = view_name or '<default>'
+                    if view_name not in d['views']:
+                        d['views'].append(view_name)
+        finally:
+            self._release()
+        for path, d in info.items():
+            d['views'].sort()
+            d['hits'], d['misses'] = self._report.get(path, (0, 0))
+        return info.values()
+
+
+class SharedMemoryCacheManager(MemoryCacheManager):
+    """Manage a SharedMemoryCache, which stores rendered data in a
+    memory-mapped file shared by the processes of a host.
+    """
+
+    meta_type = 'Shared Memory Cache Manager'
+
+    _cache_class = SharedMemoryCache
+
+    def __init__(self, ob_id):
+        self.id = ob_id
+        self.title = ''
+        self._settings = {
+            'filename': '%s.cache' % ob_id,
+            'size': SharedMemoryCache.size,
+            'slot_size': SharedMemoryCache.slot_size,
+            'max_age': SharedMemoryCache.max_age,
+            'request_vars': SharedMemoryCache.request_vars,
+            }
+        self._resetCacheId()
+
+    manage_main = DTMLFile('dtml/propsSMCM', globals())
+
+    def manage_editProps(self, title, settings=None, REQUEST=None):
+        'Changes the cache settings.'
+        if settings is None:
+            settings = REQUEST
+        self.title = str(title)
+        request_vars = list(settings['request_vars'])
+        request_vars.sort()
+        self._settings = {
+            'filename': checkFilename(str(settings['filename'])),
+            'size': int(settings['size']),
+            'slot_size': int(settings['slot_size']),
+            'max_age': int(settings['max_age']),
+            'request_vars': tuple(request_vars),
+            }
+        if REQUEST is not None:
+            return self.manage_main(
+                self, REQUEST, manage_tabs_message='Properties changed.')
+
+InitializeClass(SharedMemoryCacheManager)
+
+
+manage_addSharedMemoryCacheManagerForm = DTMLFile('dtml/addSMCM', globals())
+
+def manage_addSharedMemoryCacheManager(self, id, REQUEST=None):
+    'Adds a shared memory cache manager to the folder.'
+    self._setObject(id, SharedMemoryCacheManager(id))
+    if REQUEST is not None:
+        return self.manage_main(self, REQUEST)
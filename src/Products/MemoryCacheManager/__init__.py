@@ -0,0 +1,32 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""Cache managers that keep rendered results in memory.
+"""
+
+import MemoryCacheManager
+import SharedMemoryCache
+
+
+def initialize(context):
+    context.registerClass(
+        MemoryCacheManager.MemoryCacheManager,
+        constructors=(MemoryCacheManager.manage_addMemoryCacheManagerForm,
+                      MemoryCacheManager.manage_addMemoryCacheManager),
+        )
+
+    context.registerClass(
+        SharedMemoryCache.SharedMemoryCacheManager,
+        constructors=(
+            SharedMemoryCache.manage_addSharedMemoryCacheManagerForm,
+            SharedMemoryCache.manage_addSharedMemoryCacheManager),
+        )
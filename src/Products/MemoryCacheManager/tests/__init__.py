@@ -0,0 +1 @@
+# MemoryCacheManager test package
@@ -0,0 +1,270 @@
+import unittest
+
+
+class DummyObject:
+
+    _mtime = 0
+
+    def __init__(self, path, request=None):
+        self._path = path
+        self.REQUEST = request or {}
+
+    def getPhysicalPath(self):
+        return self._path
+
+    def ZCacheable_getModTime(self, mtime_func=None):
+        return self._mtime
+
+
+class MemoryCacheTests(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from Products.MemoryCacheManager.MemoryCacheManager import MemoryCache
+        cache = MemoryCache()
+        cache.initSettings(kw)
+        return cache
+
+    def test_get_miss(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        self.assertEqual(cache.ZCache_get(ob, default='d'), 'd')
+        stats = cache.getStatistics()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 0)
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        self.assertEqual(cache.ZCache_get(ob), 'data')
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], 4)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['hit_rate'], 1.0)
+
+    def test_keys(self):
+        cache = self._makeOne(request_vars=('user',))
+        ob = DummyObject(('', 'a'), {'user': 'joe'})
+        cache.ZCache_set(ob, 'joe')
+        cache.ZCache_set(ob, 'view', view_name='v')
+        cache.ZCache_set(ob, 'kw', keywords={'x': 1})
+        self.assertEqual(cache.ZCache_get(ob), 'joe')
+        self.assertEqual(cache.ZCache_get(ob, view_name='v'), 'view')
+        self.assertEqual(cache.ZCache_get(ob, keywords={'x': 1}), 'kw')
+        self.assertEqual(cache.ZCache_get(ob, keywords={'x': 2}), None)
+        ob.REQUEST['user'] = 'jane'
+        self.assertEqual(cache.ZCache_get(ob), None)
+
+    def test_mtime_invalidates(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        ob._mtime = 10
+        self.assertEqual(cache.ZCache_get(ob), None)
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 0)
+        self.assertEqual(stats['invalidations'], 1)
+
+    def test_max_age(self):
+        cache = self._makeOne(max_age=10)
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        self.assertEqual(cache.ZCache_get(ob), 'data')
+        cache._entries.values()[0].created -= 11
+        self.assertEqual(cache.ZCache_get(ob), None)
+
+    def test_lru_eviction_by_entries(self):
+        cache = self._makeOne(max_entries=2)
+        a, b, c = [DummyObject(('', name)) for name in 'abc']
+        cache.ZCache_set(a, 'a')
+        cache.ZCache_set(b, 'b')
+        cache.ZCache_get(a)  # a is now more recently used than b
+        cache.ZCache_set(c, 'c')
+        self.assertEqual(cache.ZCache_get(a), 'a')
+        self.assertEqual(cache.ZCache_get(b), None)
+        self.assertEqual(cache.ZCache_get(c), 'c')
+        self.assertEqual(cache.getStatistics()['evictions'], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = self._makeOne(max_bytes=10)
+        a, b = DummyObject(('', 'a')), DummyObject(('', 'b'))
+        cache.ZCache_set(a, 'x' * 6)
+        cache.ZCache_set(b, 'x' * 6)
+        self.assertEqual(cache.ZCache_get(a), None)
+        self.assertEqual(cache.ZCache_get(b), 'x' * 6)
+        self.assertEqual(cache.getStatistics()['bytes'], 6)
+
+    def test_too_large(self):
+        cache = self._makeOne(max_bytes=10)
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'x' * 11)
+        self.assertEqual(cache.getStatistics()['entries'], 0)
+
+    def test_replace(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        cache.ZCache_set(ob, 'new data')
+        self.assertEqual(cache.ZCache_get(ob), 'new data')
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], 8)
+
+    def test_unpickleable(self):
+        import thread
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        self.assertRaises(TypeError, cache.ZCache_set,
+                          ob, thread.allocate_lock())
+
+    def test_invalidate_subobjects(self):
+        cache = self._makeOne()
+        folder = DummyObject(('', 'f'))
+        inner = DummyObject(('', 'f', 'a'))
+        other = DummyObject(('', 'g'))
+        for ob in folder, inner, other:
+            cache.ZCache_set(ob, 'data')
+        cache.ZCache_invalidate(folder)
+        self.assertEqual(cache.ZCache_get(folder), None)
+        self.assertEqual(cache.ZCache_get(inner), None)
+        self.assertEqual(cache.ZCache_get(other), 'data')
+        self.assertEqual(cache.getStatistics()['invalidations'], 2)
+
+    def test_report(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_get(ob)
+        cache.ZCache_set(ob, 'data', view_name='v')
+        cache.ZCache_get(ob, view_name='v')
+        info, = cache.getCacheReport()
+        self.assertEqual(info['path'], '/a')
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['size'], 4)
+        self.assertEqual(info['views'], ['v'])
+        self.assertEqual(info['entries'], 1)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        cache.clear()
+        cache.resetStatistics()
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 0)
+        self.assertEqual(stats['bytes'], 0)
+        self.assertEqual(cache.getCacheReport(), [])
+
+
+class MemoryCacheManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        from OFS.Application import Application
+        from OFS.Folder import Folder
+        from Testing.makerequest import makerequest
+        from Products.MemoryCacheManager.MemoryCacheManager \
+            import manage_addMemoryCacheManager
+        self.root = makerequest(Application())
+        self.root._setObject('folder', Folder('folder'))
+        self.folder = self.root.folder
+        manage_addMemoryCacheManager(self.folder, 'cache')
+        self.manager = self.folder.cache
+        # normally done by an event subscriber
+        self.manager.manage_afterAdd(self.manager, self.folder)
+
+    def tearDown(self):
+        self.manager._remove_data()
+
+    def _associate(self, ob):
+        ob.ZCacheable_setManagerId('cache')
+        self.assertTrue(ob.ZCacheable_getCache() is
+                        self.manager.ZCacheManager_getCache())
+
+    def test_settings(self):
+        self.manager.manage_editProps('Title', {
+            'max_entries': '5', 'max_bytes': '100', 'max_age': '0',
+            'request_vars': ['b', 'a']})
+        self.assertEqual(self.manager.title, 'Title')
+        settings = self.manager.getSettings()
+        self.assertEqual(settings['max_entries'], 5)
+        self.assertEqual(settings['request_vars'], ('a', 'b'))
+        self.assertEqual(self.manager.ZCacheManager_getCache().max_bytes, 100)
+
+    def test_settings_committed_elsewhere(self):
+        cache = self.manager.ZCacheManager_getCache()
+        settings = self.manager.getSettings()
+        settings['max_bytes'] = 100
+        # as if loaded after another process changed the settings
+        self.manager._settings = settings
+        self.assertTrue(self.manager.ZCacheManager_getCache() is cache)
+        self.assertEqual(cache.max_bytes, 100)
+
+    def test_settings_applied_on_commit(self):
+        import transaction
+        from ZODB import DB
+        from ZODB.DemoStorage import DemoStorage
+        db = DB(DemoStorage())
+        try:
+            conn = db.open()
+            conn.root()['folder'] = self.folder.aq_base
+            transaction.commit()
+            manager = conn.root()['folder'].cache
+            cache = manager.ZCacheManager_getCache()
+            max_bytes = cache.max_bytes
+            settings = {'max_entries': '5', 'max_bytes': '100',
+                        'max_age': '0', 'request_vars': []}
+            manager.manage_editProps('Title', settings)
+            self.assertEqual(manager.ZCacheManager_getCache().max_bytes,
+                             max_bytes)
+            transaction.abort()
+            self.assertEqual(manager.ZCacheManager_getCache().max_bytes,
+                             max_bytes)
+            manager.manage_editProps('Title', settings)
+            transaction.commit()
+            self.assertEqual(manager.ZCacheManager_getCache().max_bytes, 100)
+        finally:
+            transaction.abort()
+            db.close()
+
+    def test_clone_gets_own_cache(self):
+        from Products.MemoryCacheManager.subscribers import cloned
+        cache = self.manager.ZCacheManager_getCache()
+        cloned(self.manager, None)
+        self.assertFalse(self.manager.ZCacheManager_getCache() is cache)
+
+    def test_dtml_method(self):
+        from OFS.DTMLMethod import addDTMLMethod
+        addDTMLMethod(self.folder, 'doc', file='<dtml-var foo>')
+        doc = self.folder.doc
+        self._associate(doc)
+        self.assertEqual(doc(self.folder, self.root.REQUEST, foo='1'), '1')
+        self.assertEqual(doc(self.folder, self.root.REQUEST, foo='2'), '1')
+        stats = self.manager.getStatistics()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        doc.ZCacheable_invalidate()
+        self.assertEqual(doc(self.folder, self.root.REQUEST, foo='2'), '2')
+        info, = self.manager.getCacheReport()
+        self.assertEqual(info['path'], '/folder/doc')
+
+    def test_page_template(self):
+        from Products.PageTemplates.ZopePageTemplate \
+            import manage_addPageTemplate
+        manage_addPageTemplate(self.folder, 'pt',
+                               text='<p tal:content="here/title" />')
+        pt = self.folder.pt
+        self._associate(pt)
+        self.folder.title = 'one'
+        self.assertEqual(pt(), '<p>one</p>')
+        self.folder.title = 'two'
+        self.assertEqual(pt(), '<p>one</p>')
+        self.manager.manage_invalidate(['/folder/pt'])
+        self.assertEqual(pt(), '<p>two</p>')
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(MemoryCacheTests),
+        unittest.makeSuite(MemoryCacheManagerTests),
+    ))
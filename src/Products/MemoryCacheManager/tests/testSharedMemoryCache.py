@@ -0,0 +1,244 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Products.MemoryCacheManager.tests.testMemoryCacheManager \
+    import DummyObject
+
+
+class ClientHomeSetup:
+
+    def setUp(self):
+        from App.config import getConfiguration
+        config = getConfiguration()
+        self._clienthome = config.clienthome
+        self.dir = config.clienthome = tempfile.mkdtemp()
+
+    def tearDown(self):
+        from App.config import getConfiguration
+        getConfiguration().clienthome = self._clienthome
+        shutil.rmtree(self.dir)
+
+
+class SharedMemoryCacheTests(ClientHomeSetup, unittest.TestCase):
+
+    def setUp(self):
+        ClientHomeSetup.setUp(self)
+        self.filename = os.path.join(self.dir, 'caches', 'test.cache')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        ClientHomeSetup.tearDown(self)
+
+    def _makeOne(self, **kw):
+        from Products.MemoryCacheManager.SharedMemoryCache \
+            import SharedMemoryCache
+        settings = {'filename': 'test.cache', 'size': 1 << 14,
+                    'slot_size': 1 << 10, 'ways': 4}
+        settings.update(kw)
+        cache = SharedMemoryCache()
+        cache.initSettings(settings)
+        self.caches.append(cache)
+        return cache
+
+    def test_get_miss(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        self.assertEqual(cache.ZCache_get(ob, default='d'), 'd')
+        self.assertEqual(cache.getStatistics()['misses'], 1)
+        self.assertEqual(os.path.getsize(self.filename),
+                         20 + 4 + 16 * 1024)
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, u'data')
+        self.assertEqual(cache.ZCache_get(ob), u'data')
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_shared_between_caches(self):
+        writer = self._makeOne()
+        reader = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        writer.ZCache_set(ob, 'data')
+        self.assertEqual(reader.ZCache_get(ob), 'data')
+        reader.ZCache_invalidate(ob)
+        self.assertEqual(writer.ZCache_get(ob), None)
+
+    def test_survives_close(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        cache.close()
+        self.assertEqual(self._makeOne().ZCache_get(ob), 'data')
+
+    def test_changed_layout_resets_file(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        other = self._makeOne(slot_size=2048)
+        self.assertEqual(other.ZCache_get(ob), None)
+        # the first cache notices the change and uses the new layout
+        self.assertEqual(cache.ZCache_get(ob), None)
+        other.ZCache_set(ob, 'data')
+        self.assertEqual(other.ZCache_get(ob), 'data')
+
+    def test_keys(self):
+        cache = self._makeOne(request_vars=('user',))
+        ob = DummyObject(('', 'a'), {'user': 'joe'})
+        cache.ZCache_set(ob, 'joe')
+        cache.ZCache_set(ob, 'view', view_name='v')
+        cache.ZCache_set(ob, 'kw', keywords={'x': 1})
+        self.assertEqual(cache.ZCache_get(ob), 'joe')
+        self.assertEqual(cache.ZCache_get(ob, view_name='v'), 'view')
+        self.assertEqual(cache.ZCache_get(ob, keywords={'x': 1}), 'kw')
+        ob.REQUEST['user'] = 'jane'
+        self.assertEqual(cache.ZCache_get(ob), None)
+
+    def test_mtime_invalidates(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        ob._mtime = 10
+        self.assertEqual(cache.ZCache_get(ob), None)
+        cache.ZCache_set(ob, 'new data')
+        self.assertEqual(cache.ZCache_get(ob), 'new data')
+        self.assertEqual(cache.getStatistics()['entries'], 1)
+
+    def test_too_large(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'x' * 1024)
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 0)
+        self.assertEqual(stats['too_large'], 1)
+
+    def test_foreign_file_untouched(self):
+        os.mkdir(os.path.dirname(self.filename))
+        f = open(self.filename, 'wb')
+        f.write('precious data')
+        f.close()
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        self.assertEqual(cache.ZCache_get(ob, default='d'), 'd')
+        self.assertEqual(open(self.filename, 'rb').read(), 'precious data')
+        # the file is used once the settings change
+        os.remove(self.filename)
+        cache.initSettings({})
+        cache.ZCache_set(ob, 'data')
+        self.assertEqual(cache.ZCache_get(ob), 'data')
+
+    def test_symlink_not_followed(self):
+        target = os.path.join(self.dir, 'Data.fs')
+        f = open(target, 'wb')
+        f.write('precious data')
+        f.close()
+        os.mkdir(os.path.dirname(self.filename))
+        os.symlink(target, self.filename)
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        self.assertRaises(OSError, cache.ZCache_set, ob, 'data')
+        self.assertEqual(open(target, 'rb').read(), 'precious data')
+
+    def test_invalid_filename(self):
+        from Products.MemoryCacheManager.SharedMemoryCache \
+            import checkFilename
+        self.assertEqual(checkFilename('test.cache'), 'test.cache')
+        for name in ('', '.cache', '..', '../Data.fs', '/tmp/test.cache',
+                     'a/b', 'a\0b'):
+            self.assertRaises(ValueError, checkFilename, name)
+
+    def test_clock_eviction(self):
+        cache = self._makeOne(size=4 << 10)  # a single set of 4 slots
+        obs = [DummyObject(('', str(i))) for i in range(5)]
+        for ob in obs[:4]:
+            cache.ZCache_set(ob, ob._path[1])
+        self.assertEqual(cache.getStatistics()['entries'], 4)
+        # the hand clears all referenced bits, then takes the first slot
+        cache.ZCache_set(obs[4], '4')
+        self.assertEqual(cache.ZCache_get(obs[0]), None)
+        # entries used since the hand passed them get a second chance
+        cache.ZCache_get(obs[1])
+        cache.ZCache_set(obs[0], '0')
+        self.assertEqual(cache.ZCache_get(obs[1]), '1')
+        self.assertEqual(cache.ZCache_get(obs[2]), None)
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 4)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_invalidate_subobjects(self):
+        cache = self._makeOne()
+        folder = DummyObject(('', 'f'))
+        inner = DummyObject(('', 'f', 'a'))
+        other = DummyObject(('', 'fg'))
+        for ob in folder, inner, other:
+            cache.ZCache_set(ob, 'data')
+        cache.ZCache_invalidate(folder)
+        self.assertEqual(cache.ZCache_get(folder), None)
+        self.assertEqual(cache.ZCache_get(inner), None)
+        self.assertEqual(cache.ZCache_get(other), 'data')
+        self.assertEqual(cache.getStatistics()['invalidations'], 2)
+
+    def test_report(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_get(ob, view_name='v')
+        cache.ZCache_set(ob, 'data', view_name='v')
+        cache.ZCache_get(ob, view_name='v')
+        info, = cache.getCacheReport()
+        self.assertEqual(info['path'], '/a')
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['views'], ['v'])
+        self.assertEqual(info['entries'], 1)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        ob = DummyObject(('', 'a'))
+        cache.ZCache_set(ob, 'data')
+        cache.clear()
+        self.assertEqual(cache.ZCache_get(ob), None)
+        self.assertEqual(cache.getStatistics()['entries'], 0)
+
+
+class SharedMemoryCacheManagerTests(ClientHomeSetup, unittest.TestCase):
+
+    def _makeOne(self):
+        from Products.MemoryCacheManager.SharedMemoryCache \
+            import SharedMemoryCacheManager
+        return SharedMemoryCacheManager('cache')
+
+    def test_settings(self):
+        manager = self._makeOne()
+        self.assertEqual(manager.getSettings()['filename'], 'cache.cache')
+        try:
+            manager.manage_editProps('Title', {
+                'filename': 'test.cache', 'size': '8192',
+                'slot_size': '1024', 'max_age': '0', 'request_vars': ()})
+            cache = manager.ZCacheManager_getCache()
+            self.assertEqual(cache.filename, 'test.cache')
+            cache.ZCache_set(DummyObject(('', 'a')), 'data')
+            filename = os.path.join(self.dir, 'caches', 'test.cache')
+            self.assertEqual(os.path.getsize(filename), 20 + 1 + 8 * 1024)
+        finally:
+            manager._remove_data()
+
+    def test_settings_path_refused(self):
+        manager = self._makeOne()
+        self.assertRaises(ValueError, manager.manage_editProps, 'Title', {
+            'filename': os.path.join(self.dir, 'Data.fs'), 'size': '8192',
+            'slot_size': '1024', 'max_age': '0', 'request_vars': ()})
+        self.assertEqual(manager.getSettings()['filename'], 'cache.cache')
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(SharedMemoryCacheTests),
+        unittest.makeSuite(SharedMemoryCacheManagerTests),
+    ))
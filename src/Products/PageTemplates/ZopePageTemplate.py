@@ -24,6 +24,7 @@ from AccessControl.SecurityManagement import getSecurityManager
 from AccessControl.SecurityInfo import ClassSecurityInfo
 from Acquisition import Acquired
 from Acquisition import Explicit
+from Acquisition import aq_base
 from Acquisition import aq_get
 from App.Common import package_home
 from DateTime.DateTime import DateTime
@@ -35,6 +36,8 @@ from OFS.PropertyManager import PropertyManager
 from Shared.DC.Scripts.Script import Script 
 from Shared.DC.Scripts.Signature import FuncCode
 from webdav.Lockable import ResourceLockedError
+from ZPublisher.HTTPConditional import contentETag
+from ZPublisher.HTTPConditional import handleConditional
 
 from Products.PageTemplates.PageTemplate import PageTemplate
 from Products.PageTemplates.PageTemplateFile import PageTemplateFile
@@ -321,7 +324,7 @@ class ZopePageTemplate(Script, PageTemplate, Historical, Cacheable,
             result = self.ZCacheable_get(keywords=keyset)
             if result is not None:
                 # Got a cached value.
-                return result
+                return self._conditionalResult(request, result)
 
         # Execute the template in a new security context.
         security.addContext(self)
@@ -331,10 +334,30 @@ class ZopePageTemplate(Script, PageTemplate, Historical, Cacheable,
             if keyset is not None:
                 # Store the result in the cache.
                 self.ZCacheable_set(result, keywords=keyset)
+                return self._conditionalResult(request, result)
             return result
         finally:
             security.removeContext(self)
 
+    def _conditionalResult(self, request, result):
+        # The result of a cached template is tagged with a hash of its
+        # content when the template is published itself, so clients can
+        # revalidate it and get a '304 Not Modified' response.
+        if request is None or request.get('REQUEST_METHOD') not in (
+            'GET', 'HEAD'):
+            return result
+        published = request.get('PUBLISHED', None)
+        if aq_base(published) is not aq_base(self):
+            return result
+        response = request.response
+        if response.getStatus() != 200:
+            return result
+        etag = contentETag(result)
+        response.setHeader('ETag', etag)
+        if handleConditional(request, response, etag):
+            return ''
+        return result
+
     security.declareProtected(change_page_templates,
       'manage_historyCopy',
       'manage_beforeHistoryCopy', 'manage_afterHistoryCopy')
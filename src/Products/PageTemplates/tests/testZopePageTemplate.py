@@ -18,6 +18,7 @@ from zope.publisher.http import HTTPCharsets
 
 from Testing.makerequest import makerequest
 from Testing.ZopeTestCase import ZopeTestCase, installProduct
+from OFS.SimpleItem import SimpleItem
 from Products.PageTemplates.ZopePageTemplate import ZopePageTemplate
 from Products.PageTemplates.ZopePageTemplate import manage_addPageTemplate
 from Products.PageTemplates.utils import encodingFromXMLPreamble
@@ -236,6 +237,33 @@ class ZPTUnicodeEncodingConflictResolution(ZopeTestCase):
         self.app.REQUEST.debug.sourceAnnotations = True
         self.assertEqual(zpt.pt_render().startswith(unicode('<!--')), True)
 
+class DummyCache:
+
+    def __init__(self):
+        self.data = {}
+
+    def ZCache_get(self, ob, view_name, keywords, mtime_func, default):
+        return self.data.get(ob.getPhysicalPath(), default)
+
+    def ZCache_set(self, ob, data, view_name, keywords, mtime_func):
+        self.data[ob.getPhysicalPath()] = data
+
+    def ZCache_invalidate(self, ob):
+        self.data.pop(ob.getPhysicalPath(), None)
+
+
+class DummyCacheManager(SimpleItem):
+
+    _isCacheManager = 1
+
+    def __init__(self, id):
+        self.id = id
+        self.cache = DummyCache()
+
+    def ZCacheManager_getCache(self):
+        return self.cache
+
+
 class ZopePageTemplateFileTests(ZopeTestCase):
 
     def test_class_conforms_to_IWriteLock(self):
@@ -297,6 +325,49 @@ class ZopePageTemplateFileTests(ZopeTestCase):
         zpt.pt_edit(xml_unicode, 'text/xml; charset=utf-8')
         self.assertEqual(zpt.read(), xml_unicode)
 
+    def _createCachedZPT(self):
+        self.app._setObject('cache', DummyCacheManager('cache'))
+        self.app.__ZCacheManager_ids__ = ('cache',)
+        zpt = self._createZPT()
+        zpt.ZCacheable_setManagerId('cache')
+        request = self.app.REQUEST
+        request['PUBLISHED'] = zpt
+        request['REQUEST_METHOD'] = 'GET'
+        return zpt
+
+    def testETagOfCachedTemplate(self):
+        zpt = self._createCachedZPT()
+        request = self.app.REQUEST
+        result = zpt()
+        etag = request.response.getHeader('ETag')
+        self.assertTrue(etag)
+        self.assertEqual(zpt(), result)
+        self.assertEqual(request.response.getHeader('ETag'), etag)
+        self.assertEqual(request.response.getStatus(), 200)
+
+    def testNotModifiedCachedTemplate(self):
+        zpt = self._createCachedZPT()
+        request = self.app.REQUEST
+        zpt()
+        request.environ['HTTP_IF_NONE_MATCH'] = \
+            request.response.getHeader('ETag')
+        self.assertEqual(zpt(), '')
+        self.assertEqual(request.response.getStatus(), 304)
+
+    def testNoETagIfNotPublished(self):
+        zpt = self._createCachedZPT()
+        request = self.app.REQUEST
+        request['PUBLISHED'] = self.app
+        zpt()
+        self.assertEqual(request.response.getHeader('ETag'), None)
+
+    def testNoETagIfNotCached(self):
+        zpt = self._createZPT()
+        request = self.app.REQUEST
+        request['PUBLISHED'] = zpt
+        zpt()
+        self.assertEqual(request.response.getHeader('ETag'), None)
+
     def _createZPT(self):
         manage_addPageTemplate(self.app, 'test',
                                text=utf8_str, encoding='utf-8')
@@ -12,7 +12,10 @@
 ############################################################################
 import binascii
 from cgi import escape
+import hashlib
+import hmac
 import logging
+import os
 import random
 import re
 import string
@@ -54,6 +57,15 @@ twodotsin = re.compile('(\w*\.){2,}').search
 
 _marker = []
 
+try:
+    from hmac import compare_digest as _compare
+except ImportError: # Python < 2.7.7
+    def _compare(a, b):
+        result = len(a) ^ len(b)
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
 constructBrowserIdManagerForm = DTMLFile('dtml/addIdManager', globals())
 
 BROWSERID_MANAGER_NAME = 'browser_id_manager'# imported by SessionDataManager
@@ -67,12 +79,13 @@ def constructBrowserIdManager(
     self, id=BROWSERID_MANAGER_NAME, title='', idname='_ZopeId',
     location=('cookies', 'form'), cookiepath='/', cookiedomain='',
     cookielifedays=0, cookiesecure=0, cookiehttponly=0, auto_url_encoding=0,
-    REQUEST=None
+    signed_ids=0, id_max_age_days=0, REQUEST=None
     ):
     """ """
     ob = BrowserIdManager(id, title, idname, location, cookiepath,
                           cookiedomain, cookielifedays, cookiesecure,
-                          cookiehttponly, auto_url_encoding)
+                          cookiehttponly, auto_url_encoding, signed_ids,
+                          id_max_age_days)
     self._setObject(id, ob)
     ob = self._getOb(id)
     if REQUEST is not None:
@@ -95,11 +108,15 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
     # BBB
     auto_url_encoding = 0
     cookie_http_only = 0
+    signed_ids = 0
+    id_max_age_days = 0
+    _secret = None
 
     def __init__(self, id, title='', idname='_ZopeId',
                  location=('cookies', 'form'), cookiepath=('/'),
                  cookiedomain='', cookielifedays=0, cookiesecure=0,
-                 cookiehttponly=0, auto_url_encoding=0):
+                 cookiehttponly=0, auto_url_encoding=0, signed_ids=0,
+                 id_max_age_days=0):
         self.id = str(id)
         self.title = str(title)
         self.setBrowserIdName(idname)
@@ -110,6 +127,8 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
         self.setCookieSecure(cookiesecure)
         self.setCookieHTTPOnly(cookiehttponly)
         self.setAutoUrlEncoding(auto_url_encoding)
+        self.setSignedIds(signed_ids)
+        self.setIdMaxAgeDays(id_max_age_days)
 
     # IBrowserIdManager
     security.declareProtected(ACCESS_CONTENTS_PERM, 'hasBrowserId')
@@ -150,7 +169,7 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
             bid = current_ns.get(tk, None)
             if bid is not None:
                 # hey, we got a browser id!
-                if isAWellFormedBrowserId(bid):
+                if self._isAValidBrowserId(bid):
                     # bid is not "plain old broken"
                     REQUEST.browser_id_ = bid
                     REQUEST.browser_id_ns_ = name
@@ -158,7 +177,7 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
         # fall through if bid is invalid or not in namespaces
         if create:
             # create a brand new bid
-            bid = getNewBrowserId()
+            bid = self._getNewBrowserId()
             if 'cookies' in ns:
                 self._setCookie(bid, REQUEST)
             REQUEST.browser_id_ = bid
@@ -367,6 +386,33 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
         """ """
         return self.auto_url_encoding
 
+    security.declareProtected(CHANGE_IDMGR_PERM, 'setSignedIds')
+    def setSignedIds(self, signed_ids):
+        """ sets signing of new browser ids on or off """
+        self.signed_ids = not not signed_ids
+        if self.signed_ids and self._secret is None:
+            self._secret = binascii.hexlify(os.urandom(20))
+
+    security.declareProtected(ACCESS_CONTENTS_PERM, 'getSignedIds')
+    def getSignedIds(self):
+        """ """
+        return self.signed_ids
+
+    security.declareProtected(CHANGE_IDMGR_PERM, 'setIdMaxAgeDays')
+    def setIdMaxAgeDays(self, days):
+        """ maximum age of signed browser ids, 0 for no maximum """
+        if type(days) not in (type(1), type(1.0)) or days < 0:
+            raise BrowserIdManagerErr(
+                            'Bad browser id maximum age in days %s '
+                            '(requires positive integer value)'
+                                % escape(repr(days)))
+        self.id_max_age_days = int(days)
+
+    security.declareProtected(ACCESS_CONTENTS_PERM, 'getIdMaxAgeDays')
+    def getIdMaxAgeDays(self):
+        """ """
+        return self.id_max_age_days
+
     security.declareProtected(ACCESS_CONTENTS_PERM, 'isUrlInBidNamespaces')
     def isUrlInBidNamespaces(self):
         """ Returns true if 'url' is in the browser id namespaces
@@ -405,6 +451,22 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
                 cookie[k] = v #only stuff things with true values
         cookie['value'] = bid
 
+    def _getNewBrowserId(self):
+        if self.signed_ids:
+            return getNewSignedBrowserId(self._secret)
+        return getNewBrowserId()
+
+    def _isAValidBrowserId(self, bid):
+        """ Return true if bid may be used as this request's browser id.
+
+        When signing is on, forged and expired browser ids are refused
+        here, before they can cause a session data container lookup.
+        """
+        if self.signed_ids:
+            return isAValidSignedBrowserId(bid, self._secret,
+                                           self.id_max_age_days * 86400)
+        return isAWellFormedBrowserId(bid)
+
     def _setId(self, id):
         if id != self.id:
             raise ValueError('Cannot rename a browser id manager')
@@ -456,7 +518,8 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
     def manage_changeBrowserIdManager(
         self, title='', idname='_ZopeId', location=('cookies', 'form'),
         cookiepath='/', cookiedomain='', cookielifedays=0, cookiesecure=0,
-        cookiehttponly=0, auto_url_encoding=0,  REQUEST=None
+        cookiehttponly=0, auto_url_encoding=0, signed_ids=0,
+        id_max_age_days=0, REQUEST=None
         ):
         """ """
         self.title = str(title)
@@ -468,6 +531,8 @@ class BrowserIdManager(Item, Persistent, Implicit, RoleManager, Owned, Tabs):
         self.setCookieHTTPOnly(cookiehttponly)
         self.setBrowserIdNamespaces(location)
         self.setAutoUrlEncoding(auto_url_encoding)
+        self.setSignedIds(signed_ids)
+        self.setIdMaxAgeDays(id_max_age_days)
         self.updateTraversalData()
         if REQUEST is not None:
             msg = '/manage_browseridmgr?manage_tabs_message=Changes saved'
@@ -504,7 +569,7 @@ class BrowserIdManagerTraverser(Persistent):
             # two elements.  Only remove these elements from the
             # traversal stack if they are a "well-formed pair".
             if len(stack) >= 2 and stack[-1] == bid_name:
-                if isAWellFormedBrowserId(stack[-2]):
+                if browser_id_manager._isAValidBrowserId(stack[-2]):
                     name       = stack.pop() # pop the name off the stack
                     browser_id = stack.pop() # pop id off the stack
                     request.browser_id_    = browser_id
@@ -515,7 +580,8 @@ class BrowserIdManagerTraverser(Persistent):
             # pair by munging request._script.
             if browser_id_manager.getAutoUrlEncoding():
                 if browser_id is None:
-                    request.browser_id_ = browser_id = getNewBrowserId()
+                    browser_id = browser_id_manager._getNewBrowserId()
+                    request.browser_id_ = browser_id
                 request._script.append(quote(bid_name))
                 request._script.append(quote(browser_id))
         except:
@@ -570,3 +636,42 @@ def getNewBrowserId(randint=random.randint, maxint=99999999):
     """
     return '%08i%s' % (randint(0, maxint-1), getB64TStamp())
 
+
+
+def getBrowserIdSignature(bid, secret):
+    """ Returns the 16-character signature of a browser id, a modified
+    base64-encoded HMAC of the browser id keyed with secret """
+    digest = hmac.new(secret, bid, hashlib.sha1).digest()[:12]
+    return string.translate(binascii.b2a_base64(digest)[:-1], b64_trans)
+
+
+def getNewSignedBrowserId(secret):
+    """ Returns 35-character signed browser id
+    'AAAAAAAABBBBBBBBBBBCCCCCCCCCCCCCCCC'
+    where:
+
+    AAAAAAAABBBBBBBBBBB is a browser id as returned by getNewBrowserId
+    C == signature of that browser id, see getBrowserIdSignature
+
+    A signed browser id carries the time it was created in its timestamp
+    part and can be checked with isAValidSignedBrowserId without keeping
+    any state on the server.
+    """
+    bid = getNewBrowserId()
+    return bid + getBrowserIdSignature(bid, secret)
+
+
+def isAValidSignedBrowserId(bid, secret, max_age=0, time=time.time):
+    """ Returns bid if it is a well-formed browser id signed with secret
+    and, if max_age is not 0, no more than max_age seconds old """
+    if not isinstance(bid, str) or len(bid) != 35:
+        return None
+    if not isAWellFormedBrowserId(bid):
+        return None
+    if not _compare(getBrowserIdSignature(bid[:19], secret), bid[19:]):
+        return None
+    if max_age and getB64TStampToInt(getBrowserIdPieces(bid)[1]) < \
+           time() - max_age:
+        return None
+    return bid
+
@@ -27,6 +27,7 @@ from ZPublisher.BeforeTraverse import registerBeforeTraverse
 from ZPublisher.BeforeTraverse import unregisterBeforeTraverse
 from ZODB.POSException import ConflictError
 from zope.interface import implements
+import transaction
 
 from Products.Sessions.interfaces import ISessionDataManager
 from Products.Sessions.interfaces import SessionDataManagerErr
@@ -171,6 +172,7 @@ class SessionDataManager(Item, Implicit, Persistent, RoleManager, Owned, Tabs):
             self.obpath = list(path) # sequence
         else:
             raise SessionDataManagerErr('Bad path value %s' % path)
+        self._v_container = None
             
     security.declareProtected(MGMT_SCREEN_PERM, 'getContainerPath')
     def getContainerPath(self):
@@ -211,12 +213,20 @@ class SessionDataManager(Item, Implicit, Persistent, RoleManager, Owned, Tabs):
             return ob.__of__(self)
 
     def _getSessionDataContainer(self):
-        """ Do not cache the results of this call.  Doing so breaks the
-        transactions for mounted storages. """
+        """ Do not cache the results of this call beyond the current
+        transaction.  Doing so breaks the transactions for mounted
+        storages, whose connections are only valid for the transaction
+        of the connection they were opened from. """
         if self.obpath is None:
             err = 'Session data container is unspecified in %s' % self.getId()
             LOG.warn(err)
             raise SessionIdManagerErr(err)
+        # _v_ attributes are private to the connection this object was
+        # loaded from; the transaction and the path must match as well.
+        key = (self._p_jar, transaction.get(), self.obpath)
+        cached = getattr(self, '_v_container', None)
+        if cached is not None and cached.key == key:
+            return cached.container
         try:
             # This should arguably use restrictedTraverse, but it
             # currently fails for mounted storages.  This might
@@ -227,7 +237,7 @@ class SessionDataManager(Item, Implicit, Persistent, RoleManager, Owned, Tabs):
                 args = '/'.join(self.obpath)
                 LOG.debug('External data container at %s in use' % args)
                 self._v_wrote_dc_type = 1
-            return self.unrestrictedTraverse(self.obpath)
+            container = self.unrestrictedTraverse(self.obpath)
         except ConflictError:
             raise
         except:
@@ -235,6 +245,12 @@ class SessionDataManager(Item, Implicit, Persistent, RoleManager, Owned, Tabs):
                 "External session data container '%s' not found." %
                 '/'.join(self.obpath)
                 )
+        if self.obpath[0] == '':
+            # only absolute paths resolve independently of the
+            # acquisition context this object was reached through
+            self._v_container = ContainerCache(
+                (key[0], key[1], list(self.obpath)), container)
+        return container
 
     security.declareProtected(MGMT_SCREEN_PERM, 'getRequestName')
     def getRequestName(self):
@@ -267,6 +283,29 @@ class SessionDataManager(Item, Implicit, Persistent, RoleManager, Owned, Tabs):
 
 InitializeClass(SessionDataManager)
 
+class ContainerCache:
+    """ Remembers the session data container of a session data manager
+    until the end of the current transaction.  The container's acquisition
+    chain refers to the request, so neither are kept alive afterwards, even
+    if the connection isn't used again for a long time. """
+
+    def __init__(self, key, container):
+        self.key = key
+        self.container = container
+        # the transaction manager keeps a weak reference only
+        transaction.manager.registerSynch(self)
+
+    def beforeCompletion(self, txn):
+        pass
+
+    def afterCompletion(self, txn):
+        self.key = self.container = None
+        transaction.manager.unregisterSynch(self)
+
+    def newTransaction(self, txn):
+        pass
+
+
 class SessionDataManagerTraverser(Persistent):
     def __init__(self, requestSessionName, sessionDataManagerName):
         self._requestSessionName = requestSessionName
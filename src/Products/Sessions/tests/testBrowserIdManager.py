@@ -13,6 +13,7 @@
 """
 Test suite for session id manager.
 """
+import time
 import unittest
 
 class TestBrowserIdManager(unittest.TestCase):
@@ -106,6 +107,55 @@ class TestBrowserIdManager(unittest.TestCase):
         self.assertEqual(request.browser_id_ns_, None)
         self.assertEqual(response.cookies['bid'], {'path': '/', 'value': bid})
 
+    def test_getBrowserId_signed_w_create(self):
+        from Products.Sessions.BrowserIdManager import isAValidSignedBrowserId
+        request = DummyRequest()
+        mgr = self._makeOne(request)
+        mgr.setBrowserIdNamespaces(())
+        mgr.setSignedIds(True)
+        bid = mgr.getBrowserId()
+        self.assertEqual(len(bid), 35)
+        self.assertTrue(isAValidSignedBrowserId(bid, mgr._secret))
+        self.assertEqual(request.browser_id_, bid)
+
+    def test_getBrowserId_signed_namespace_hit(self):
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        mgr = self._makeOne()
+        mgr.setSignedIds(True)
+        bid = getNewSignedBrowserId(mgr._secret)
+        request = DummyRequest(cookies={'bid': bid})
+        mgr.REQUEST = request
+        mgr.setBrowserIdName('bid')
+        self.assertEqual(mgr.getBrowserId(create=False), bid)
+        self.assertEqual(request.browser_id_ns_, 'cookies')
+
+    def test_getBrowserId_signed_rejects_unsigned_and_forged(self):
+        from Products.Sessions.BrowserIdManager import getNewBrowserId
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        mgr = self._makeOne()
+        mgr.setBrowserIdName('bid')
+        mgr.setSignedIds(True)
+        for bid in (getNewBrowserId(), getNewSignedBrowserId('other')):
+            request = DummyRequest(cookies={'bid': bid})
+            mgr.REQUEST = request
+            self.assertEqual(mgr.getBrowserId(create=False), None)
+            self.assertFalse(mgr.hasBrowserId())
+
+    def test_getBrowserId_signed_rejects_expired(self):
+        from Products.Sessions.BrowserIdManager import getB64TStamp
+        from Products.Sessions.BrowserIdManager import getBrowserIdSignature
+        mgr = self._makeOne()
+        mgr.setBrowserIdName('bid')
+        mgr.setSignedIds(True)
+        created = time.time() - 2 * 86400
+        bid = '%08i%s' % (1, getB64TStamp(time=lambda: created))
+        bid = bid + getBrowserIdSignature(bid, mgr._secret)
+        mgr.REQUEST = DummyRequest(cookies={'bid': bid})
+        self.assertEqual(mgr.getBrowserId(create=False), bid)
+        mgr.setIdMaxAgeDays(1)
+        mgr.REQUEST = DummyRequest(cookies={'bid': bid})
+        self.assertEqual(mgr.getBrowserId(create=False), None)
+
     def test_isBrowserIdNew_nonesuch_raises(self):
         request = DummyRequest()
         mgr = self._makeOne(request)
@@ -366,6 +416,28 @@ class TestBrowserIdManager(unittest.TestCase):
         mgr.setAutoUrlEncoding(False)
         self.assertFalse(mgr.getAutoUrlEncoding())
 
+    def test_setSignedIds_creates_secret_once(self):
+        mgr = self._makeOne()
+        self.assertFalse(mgr.getSignedIds())
+        self.assertEqual(mgr._secret, None)
+        mgr.setSignedIds(1)
+        self.assertTrue(mgr.getSignedIds())
+        secret = mgr._secret
+        self.assertEqual(len(secret), 40)
+        mgr.setSignedIds(0)
+        mgr.setSignedIds(1)
+        self.assertEqual(mgr._secret, secret)
+
+    def test_setIdMaxAgeDays_invalid_raises(self):
+        mgr = self._makeOne()
+        self.assertRaises(ValueError, mgr.setIdMaxAgeDays, '')
+        self.assertRaises(ValueError, mgr.setIdMaxAgeDays, -1)
+
+    def test_setIdMaxAgeDays_normal(self):
+        mgr = self._makeOne()
+        mgr.setIdMaxAgeDays(7)
+        self.assertEqual(mgr.getIdMaxAgeDays(), 7)
+
     def test_isUrlInBidNamespaces(self):
         mgr = self._makeOne()
         mgr.setBrowserIdNamespaces(('cookies', 'url', 'form'))
@@ -641,6 +713,53 @@ class TestBrowserIdManagerTraverser(unittest.TestCase):
         self.assertEqual(request._script[0], 'bid')
         self.assertEqual(request._script[1], bid)
 
+    def test___call___w_mgr_request_has_stack_w_invalid_signed_bid(self):
+        from Products.Sessions.BrowserIdManager import getNewBrowserId
+        bid = getNewBrowserId()
+        traverser = self._makeOne()
+        mgr = DummyBrowserIdManager(signed=True)
+        container = DummyObject(browser_id_manager=mgr)
+        request = DummyRequest(
+                    TraversalRequestNameStack=[bid, 'bid'])
+        traverser(container, request)
+        self.assertEqual(getattr(request, 'browser_id_', None), None)
+        self.assertEqual(len(request.TraversalRequestNameStack), 2)
+
+
+class SignedBrowserIdTests(unittest.TestCase):
+
+    def _callFUT(self, bid, secret='secret', max_age=0, now=None):
+        from Products.Sessions.BrowserIdManager import isAValidSignedBrowserId
+        if now is None:
+            return isAValidSignedBrowserId(bid, secret, max_age)
+        return isAValidSignedBrowserId(bid, secret, max_age, lambda: now)
+
+    def test_valid(self):
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        from Products.Sessions.BrowserIdManager import isAWellFormedBrowserId
+        bid = getNewSignedBrowserId('secret')
+        self.assertEqual(self._callFUT(bid), bid)
+        self.assertTrue(isAWellFormedBrowserId(bid))
+
+    def test_invalid(self):
+        from Products.Sessions.BrowserIdManager import getNewBrowserId
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        bid = getNewSignedBrowserId('secret')
+        self.assertEqual(self._callFUT(bid, 'other'), None)
+        self.assertEqual(self._callFUT(getNewBrowserId()), None)
+        self.assertEqual(self._callFUT('0' + bid[1:]), None)
+        self.assertEqual(self._callFUT(bid[:-1] + '!'), None)
+        self.assertEqual(self._callFUT(None), None)
+        self.assertEqual(self._callFUT('x' * 35), None)
+
+    def test_max_age(self):
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        bid = getNewSignedBrowserId('secret')
+        now = time.time()
+        self.assertEqual(self._callFUT(bid, max_age=60, now=now + 30), bid)
+        self.assertEqual(self._callFUT(bid, max_age=60, now=now + 90), None)
+        self.assertEqual(self._callFUT(bid, now=now + 90), bid)
+
 
 class DummyObject:
     def __init__(self, **kw):
@@ -656,15 +775,26 @@ class DummyRequest(DummyObject):
         return getattr(self, key, default)
 
 class DummyBrowserIdManager:
-    def __init__(self, auto=False):
+    def __init__(self, auto=False, signed=False):
         self._auto = auto
+        self._signed = signed
     def getBrowserIdName(self):
         return 'bid'
     def getAutoUrlEncoding(self):
         return self._auto
+    def _getNewBrowserId(self):
+        from Products.Sessions.BrowserIdManager import getNewBrowserId
+        return getNewBrowserId()
+    def _isAValidBrowserId(self, bid):
+        from Products.Sessions.BrowserIdManager import isAWellFormedBrowserId
+        from Products.Sessions.BrowserIdManager import isAValidSignedBrowserId
+        if self._signed:
+            return isAValidSignedBrowserId(bid, 'secret')
+        return isAWellFormedBrowserId(bid)
 
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestBrowserIdManager),
         unittest.makeSuite(TestBrowserIdManagerTraverser),
+        unittest.makeSuite(SignedBrowserIdTests),
     ))
@@ -204,6 +204,50 @@ class TestSessionManager(unittest.TestCase):
         transaction.savepoint(optimistic=True)
         self.assertFalse(sd['dp']._p_jar is None)
 
+    def testContainerCachedPerTransaction(self):
+        import transaction
+        sdm = self.app.session_data_manager
+        container = sdm._getSessionDataContainer()
+        self.assertTrue(sdm._getSessionDataContainer() is container)
+        transaction.commit()
+        self.assertFalse(sdm._getSessionDataContainer() is container)
+
+    def testContainerCacheClearedAtTransactionEnd(self):
+        import transaction
+        sdm = self.app.session_data_manager
+        for end in transaction.commit, transaction.abort:
+            sdm._getSessionDataContainer()
+            cached = sdm._v_container
+            self.assertFalse(cached.container is None)
+            end()
+            self.assertTrue(cached.key is None)
+            self.assertTrue(cached.container is None)
+            self.assertFalse(cached in transaction.manager._synchs)
+
+    def testContainerCacheDroppedOnPathChange(self):
+        sdm = self.app.session_data_manager
+        container = sdm._getSessionDataContainer()
+        sdm.setContainerPath('/' + tf_name)
+        self.assertEqual(sdm._getSessionDataContainer().getId(), tf_name)
+        sdm.setContainerPath('/%s/%s' % (tf_name, toc_name))
+        self.assertFalse(sdm._getSessionDataContainer() is container)
+
+    def testRelativeContainerPathNotCached(self):
+        sdm = self.app.session_data_manager
+        sdm.setContainerPath('%s/%s' % (tf_name, toc_name))
+        container = sdm._getSessionDataContainer()
+        self.assertEqual(container.getId(), toc_name)
+        self.assertFalse(sdm._getSessionDataContainer() is container)
+
+    def testForgedSignedBrowserIdNeedsNoContainer(self):
+        from Products.Sessions.BrowserIdManager import getNewSignedBrowserId
+        self.app.browser_id_manager.setSignedIds(True)
+        self.app.REQUEST.cookies['_ZopeId'] = getNewSignedBrowserId('forged')
+        sdm = self.app.session_data_manager
+        sdm.setContainerPath('/nonesuch')
+        self.assertFalse(sdm.hasSessionData())
+        self.assertEqual(sdm.getSessionData(create=0), None)
+
     def testForeignObject(self):
         from ZODB.POSException import InvalidObjectReference
         self.assertRaises(InvalidObjectReference, self._foreignAdd)
@@ -0,0 +1,117 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""
+Out of band housekeeping of transient object containers.
+
+A HousekeepingThread calls the housekeep method of transient object
+containers on schedule, each in a transaction of its own, using its own
+database connection.  Requests then no longer pay for finalizing expired
+items, replentishing buckets and collecting garbage, if inband
+housekeeping is disabled (see the 'session-inband-housekeeping'
+directive).  The thread is configured by the 'transience-housekeeping'
+section of zope.conf and started when the Zope process starts.
+"""
+
+from logging import getLogger
+import threading
+import time
+
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+from App.config import getConfiguration
+from ZODB.POSException import ConflictError
+import transaction
+
+LOG = getLogger('Transience')
+
+# the HousekeepingThread started at startup
+housekeeper = None
+
+
+class HousekeepingThread(threading.Thread):
+    """ Thread housekeeping transient object containers every 'interval'
+    seconds """
+
+    def __init__(self, db, paths, interval=20):
+        threading.Thread.__init__(self, name='Transience housekeeping')
+        self.setDaemon(True)
+        self.db = db
+        self.paths = paths
+        self.interval = interval
+        # path -> report of the last run (None if it failed)
+        self.reports = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.isSet():
+                break
+            try:
+                self.housekeep()
+            except Exception:
+                LOG.error('Housekeeping failed', exc_info=True)
+
+    def stop(self):
+        self._stopped.set()
+
+    def housekeep(self):
+        """ Housekeep each container once, return the reports by path """
+        conn = self.db.open()
+        newSecurityManager(None, system)
+        try:
+            app = conn.root()['Application']
+            for path in self.paths:
+                self.reports[path] = self._housekeep(app, path)
+        finally:
+            noSecurityManager()
+            transaction.abort()
+            conn.close()
+        return self.reports
+
+    def _housekeep(self, app, path):
+        start = time.time()
+        transaction.begin()
+        try:
+            report = app.unrestrictedTraverse(path).housekeep()
+            transaction.commit()
+        except ConflictError:
+            # try again next time
+            transaction.abort()
+            LOG.info('Conflict during housekeeping of %s' % path)
+            return None
+        except Exception:
+            transaction.abort()
+            LOG.error('Housekeeping of %s failed' % path, exc_info=True)
+            return None
+
+        report = report or {}
+        work = ['%s %s' % (kind, count)
+                for kind, count in sorted(report.items()) if count]
+        if work:
+            LOG.info('Housekeeping of %s: %s (%.3f seconds)' %
+                     (path, ', '.join(work), time.time() - start))
+        return report
+
+
+def startHousekeeping(event):
+    """ Start the housekeeping thread if zope.conf configures it """
+    global housekeeper
+    section = getattr(getConfiguration(), 'transience_housekeeping', None)
+    if section is None or housekeeper is not None:
+        return
+    import Zope2
+    housekeeper = HousekeepingThread(Zope2.DB, section.containers,
+                                     section.interval)
+    housekeeper.start()
@@ -0,0 +1,461 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""
+Transient Object Container keeping its items in memory.
+
+The items live in a hash table of the Zope process instead of timeslice
+buckets in the ZODB, so reading, touching and expiring them never writes
+to the database and never causes conflict errors.  The container itself
+is persistent and only holds the settings.  The price is that the items
+are not transactional (changes made by a request that is aborted or
+retried are kept), are private to one process, and are lost when the
+process stops, unless write-behind is enabled: then a copy of the items
+that changed is saved in the container during housekeeping, at most once
+per timeout resolution period, and loaded again after a restart.
+
+Like the items of a container in a temporary folder, the items must not
+refer to persistent objects.
+"""
+
+from cPickle import dumps
+from cPickle import loads
+from cPickle import HIGHEST_PROTOCOL
+from thread import allocate_lock
+import time
+
+from AccessControl.class_init import InitializeClass
+from AccessControl.SecurityInfo import ClassSecurityInfo
+from App.special_dtml import HTMLFile
+from BTrees.OOBTree import OOBTree
+import transaction
+
+from Products.Transience.Transience import ACCESS_TRANSIENTS_PERM
+from Products.Transience.Transience import LOG
+from Products.Transience.Transience import MANAGE_CONTAINER_PERM
+from Products.Transience.Transience import MGMT_SCREEN_PERM
+from Products.Transience.Transience import MaxTransientObjectsExceeded
+from Products.Transience.Transience import TransientObjectContainer
+
+_marker = []
+
+# storeid -> TransientStore
+stores = {}
+
+constructMemoryTransientObjectContainerForm = HTMLFile(
+    'dtml/addMemoryTransientObjectContainer', globals())
+
+def constructMemoryTransientObjectContainer(self, id, title='',
+    timeout_mins=20, addNotification=None, delNotification=None, limit=0,
+    period_secs=20, write_behind=False, REQUEST=None):
+    """ """
+    ob = MemoryTransientObjectContainer(id, title, timeout_mins,
+        addNotification, delNotification, limit=limit,
+        period_secs=period_secs, write_behind=write_behind)
+    self._setObject(id, ob)
+    if REQUEST is not None:
+        return self.manage_main(self, REQUEST, update_menu=1)
+
+
+def detach(item):
+    """ Return a copy of an item that shares no objects with it """
+    return loads(dumps(item, HIGHEST_PROTOCOL))
+
+
+class TransientStore:
+    """ Hash table holding the items of a memory transient object container
+
+    The table is split into stripes, each guarded by a lock of its own, so
+    that threads using different keys rarely wait for each other.  The
+    entries are lists of an item, the time it was last accessed and the
+    time it was last saved to the database (None if it has to be saved).
+    """
+
+    stripes = 16
+
+    def __init__(self):
+        self._stripes = [({}, allocate_lock()) for i in range(self.stripes)]
+        self.housekeeping_lock = allocate_lock()
+        self.last_housekeeping = None
+        self.write_behind = False
+        # key -> time of deletion, of the items deleted since they were
+        # saved last (only tracked with write-behind)
+        self._deleted = {}
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _delete(self, data, key, now):
+        # must be called with the lock of the stripe held
+        entry = data.pop(key)
+        if self.write_behind:
+            self._deleted[key] = now
+        return entry[0]
+
+    def lookup(self, key, now, deadline=None):
+        """ Return the item for key and its expired item
+
+        The item is marked as accessed at 'now'.  An item last accessed
+        before 'deadline' is removed and returned as the expired item.
+        Returns (None, None) if there is no item.
+        """
+        data, lock = self._stripe(key)
+        lock.acquire()
+        try:
+            entry = data.get(key)
+            if entry is None:
+                return None, None
+            if deadline is not None and entry[1] < deadline:
+                return None, self._delete(data, key, now)
+            entry[1] = now
+            return entry[0], None
+        finally:
+            lock.release()
+
+    def has_key(self, key):
+        data, lock = self._stripe(key)
+        return key in data
+
+    def store(self, key, item, now, saved=None):
+        data, lock = self._stripe(key)
+        lock.acquire()
+        try:
+            data[key] = [item, now, saved]
+        finally:
+            lock.release()
+
+    def remove(self, key, now):
+        """ Remove the item for key and return it, KeyError if missing """
+        data, lock = self._stripe(key)
+        lock.acquire()
+        try:
+            return self._delete(data, key, now)
+        finally:
+            lock.release()
+
+    def expire(self, now, deadline):
+        """ Remove the items last accessed before deadline and return them
+        """
+        expired = []
+        for data, lock in self._stripes:
+            lock.acquire()
+            try:
+                for key, entry in data.items():
+                    if entry[1] < deadline:
+                        expired.append(self._delete(data, key, now))
+            finally:
+                lock.release()
+        return expired
+
+    def items(self, deadline=None):
+        """ Return the keys and items that are not expired """
+        result = []
+        for data, lock in self._stripes:
+            lock.acquire()
+            try:
+                for key, entry in data.items():
+                    if deadline is None or entry[1] >= deadline:
+                        result.append((key, entry[0]))
+            finally:
+                lock.release()
+        return result
+
+    def clear(self):
+        for data, lock in self._stripes:
+            lock.acquire()
+            try:
+                data.clear()
+            finally:
+                lock.release()
+        self._deleted.clear()
+
+    def __len__(self):
+        length = 0
+        for data, lock in self._stripes:
+            length = length + len(data)
+        return length
+
+    # write-behind
+
+    def setWriteBehind(self, write_behind):
+        """ Turn tracking changes on or off, everything is unsaved """
+        for data, lock in self._stripes:
+            lock.acquire()
+            try:
+                for entry in data.values():
+                    entry[2] = None
+            finally:
+                lock.release()
+        self._deleted.clear()
+        self.write_behind = write_behind
+
+    def changes(self):
+        """ Return the entries to save and the keys deleted since """
+        changed = []
+        for data, lock in self._stripes:
+            lock.acquire()
+            try:
+                for key, entry in data.items():
+                    saved = entry[2]
+                    if saved is None:
+                        changed.append((key, entry))
+                        continue
+                    modified = getattr(entry[0], 'getLastModified', None)
+                    if modified is not None and modified() >= saved:
+                        changed.append((key, entry))
+            finally:
+                lock.release()
+        return changed, self._deleted.items()
+
+    def saved(self, changed, deleted, now):
+        """ Record that the changes returned by 'changes' were committed
+        """
+        for key, entry in changed:
+            entry[2] = now
+        for key, when in deleted:
+            if self._deleted.get(key) == when:
+                del self._deleted[key]
+
+
+def _saved(status, store, changed, deleted, now):
+    # after commit hook of a transaction saving changes
+    if status:
+        store.saved(changed, deleted, now)
+
+
+class MemoryTransientObjectContainer(TransientObjectContainer):
+    """ Transient object container keeping its items in memory, so that
+    using them doesn't write to the database """
+
+    meta_type = "Memory Transient Object Container"
+
+    security = ClassSecurityInfo()
+    security.setDefaultAccess('deny')
+
+    # mapping of keys to copies of the items, if write-behind is enabled
+    _saved = None
+
+    def __init__(self, id, title='', timeout_mins=20, addNotification=None,
+                 delNotification=None, limit=0, period_secs=20,
+                 write_behind=False):
+        TransientObjectContainer.__init__(self, id, title, timeout_mins,
+            addNotification, delNotification, limit, period_secs)
+        self.setWriteBehind(write_behind)
+
+    # helpers
+
+    def _reset(self):
+        """ Reset ourselves to a sane state (deletes all content) """
+        self._remove_data()
+        self._resetStoreId()
+        if self._saved is not None:
+            self._saved = OOBTree()
+
+    def _resetStoreId(self):
+        self.__storeid = '%s_%f' % (id(self), time.time())
+
+    def _remove_data(self):
+        storeid = getattr(self, '_MemoryTransientObjectContainer__storeid',
+                          None)
+        store = stores.pop(storeid, None)
+        if store is not None:
+            store.clear()
+
+    def _getStore(self):
+        storeid = self.__storeid
+        try:
+            return stores[storeid]
+        except KeyError:
+            store = TransientStore()
+            if self._saved is not None:
+                store.setWriteBehind(True)
+                self._restore(store)
+            return stores.setdefault(storeid, store)
+
+    def _restore(self, store):
+        # Load the items saved before this process started.  Accesses
+        # aren't saved, so the items get the full timeout again.
+        now = time.time()
+        for key, item in self._saved.items():
+            store.store(key, detach(item), now, now)
+
+    def _getDeadline(self, now):
+        # items last accessed before the deadline are expired
+        if not self._timeout_secs:
+            return None
+        return now - self._timeout_secs
+
+    def _lookup(self, k, default=None):
+        now = time.time()
+        store = self._getStore()
+        if self.isInbandHousekeepingEnabled():
+            self._housekeep(now, store)
+        item, expired = store.lookup(k, now, self._getDeadline(now))
+        if expired is not None:
+            self.notifyDel(expired)
+        if item is None:
+            return default
+        if getattr(item, 'setLastAccessed', None):
+            item.setLastAccessed()
+        return item
+
+    def _all(self):
+        now = time.time()
+        store = self._getStore()
+        if self.isInbandHousekeepingEnabled():
+            self._housekeep(now, store)
+        d = {}
+        for k, v in store.items(self._getDeadline(now)):
+            d[k] = self._wrap(v)
+        return d
+
+    def raw(self, current_ts):
+        # for debugging and unit testing
+        return self._all()
+
+    def __getitem__(self, k):
+        item = self._lookup(k, _marker)
+        if item is _marker:
+            raise KeyError, k
+        return self._wrap(item)
+
+    def __setitem__(self, k, v):
+        now = time.time()
+        store = self._getStore()
+        if self.isInbandHousekeepingEnabled():
+            self._housekeep(now, store)
+        if self._limit and not store.has_key(k):
+            length = len(store)
+            if length >= self._limit:
+                LOG.warn('Transient object container %s max subobjects '
+                         'reached' % self.getId())
+                raise MaxTransientObjectsExceeded, (
+                 "%s exceeds maximum number of subobjects %s" %
+                 (length, self._limit))
+        store.store(k, v, now)
+        self.notifyAdd(v)
+        # change the TO's last accessed time
+        # dont use hasattr here (it hides conflict errors)
+        if getattr(v, 'setLastAccessed', None):
+            v.setLastAccessed()
+
+    def __delitem__(self, k):
+        now = time.time()
+        return now, self._getStore().remove(k, now)
+
+    def __len__(self):
+        now = time.time()
+        store = self._getStore()
+        if self.isInbandHousekeepingEnabled():
+            self._housekeep(now, store)
+        return len(store)
+
+    getLen = __len__
+
+    security.declareProtected(ACCESS_TRANSIENTS_PERM, 'get')
+    def get(self, k, default=None):
+        item = self._lookup(k, _marker)
+        if item is _marker:
+            return default
+        return self._wrap(item)
+
+    security.declareProtected(ACCESS_TRANSIENTS_PERM, 'has_key')
+    def has_key(self, k):
+        return self._lookup(k, _marker) is not _marker
+
+    # housekeeping
+
+    security.declareProtected('View', 'housekeep')
+    def housekeep(self):
+        """ Call this from a scheduler to expire items and save changes
+        (with write-behind) if inband housekeeping is disabled.  Returns a
+        mapping of the kinds of work done to the number of items handled.
+        """
+        return self._housekeep(time.time())
+
+    def _housekeep(self, now, store=None):
+        # Expire the items and save the changes at most once per period;
+        # only one thread at a time does it.
+        report = {'expired': 0, 'saved': 0}
+        if store is None:
+            store = self._getStore()
+        last = store.last_housekeeping
+        if last is not None and now - last < self._period:
+            return report
+        if not store.housekeeping_lock.acquire(0):
+            return report
+        try:
+            store.last_housekeeping = now
+            deadline = self._getDeadline(now)
+            if deadline is not None:
+                expired = store.expire(now, deadline)
+                self._notifyExpired(expired)
+                report['expired'] = len(expired)
+            if self._saved is not None:
+                report['saved'] = self._save(store, now)
+        finally:
+            store.housekeeping_lock.release()
+        return report
+
+    def _save(self, store, now):
+        # Copy the changed items to the database and return their number.
+        # The store learns that they were saved when the transaction
+        # commits.
+        changed, deleted = store.changes()
+        if not (changed or deleted):
+            return 0
+        saved = self._saved
+        for key, entry in changed:
+            saved[key] = detach(entry[0])
+        for key, when in deleted:
+            if saved.has_key(key):
+                del saved[key]
+        transaction.get().addAfterCommitHook(
+            _saved, (store, changed, deleted, now))
+        return len(changed)
+
+    # write-behind
+
+    security.declareProtected(MANAGE_CONTAINER_PERM, 'setWriteBehind')
+    def setWriteBehind(self, write_behind):
+        """ Turn saving copies of the items in the database on or off """
+        write_behind = bool(write_behind)
+        if write_behind == self.isWriteBehindEnabled():
+            return
+        if write_behind:
+            self._saved = OOBTree()
+        else:
+            self._saved = None
+        self._getStore().setWriteBehind(write_behind)
+
+    security.declareProtected(MGMT_SCREEN_PERM, 'isWriteBehindEnabled')
+    def isWriteBehindEnabled(self):
+        """ Report if copies of the items are saved in the database """
+        return self._saved is not None
+
+    security.declareProtected(MANAGE_CONTAINER_PERM,
+        'manage_changeTransientObjectContainer')
+    def manage_changeTransientObjectContainer(
+        self, title='', timeout_mins=20, addNotification=None,
+        delNotification=None, limit=0, period_secs=20, write_behind=False,
+        REQUEST=None
+        ):
+        """ Change an existing memory transient object container. """
+        self.setWriteBehind(write_behind)
+        return TransientObjectContainer.manage_changeTransientObjectContainer(
+            self, title, timeout_mins, addNotification, delNotification,
+            limit, period_secs, REQUEST)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+InitializeClass(MemoryTransientObjectContainer)
@@ -32,10 +32,12 @@ from AccessControl.SpecialUsers import nobody
 from App.special_dtml import HTMLFile
 from BTrees.Length import Length as BTreesLength
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from BTrees.IOBTree import IOBTree
 from OFS.SimpleItem import SimpleItem
 from Persistence import Persistent
 from zope.interface import implements
+import transaction
 
 from Products.Transience.TransienceInterfaces import DictionaryLike
 from Products.Transience.TransienceInterfaces \
@@ -62,9 +64,19 @@ BUCKET_CLASS = OOBTree # constructor for buckets
 DATA_CLASS = IOBTree # const for main data structure (timeslice->"bucket")
 STRICT = os.environ.get('Z_TOC_STRICT', '')
 DEBUG = int(os.environ.get('Z_TOC_DEBUG', 0))
+# number of expired items handed to the delete notification target at a
+# time; a savepoint is taken after each batch
+NOTIFY_BATCH_SIZE = 500
+# default for containers on which inband housekeeping was neither enabled
+# nor disabled (see the 'session-inband-housekeeping' zope.conf directive)
+INBAND_HOUSEKEEPING = True
 
 _marker = []
 LOG = getLogger('Transience')
+# unpatched by the unit tests, for measuring durations
+_timer = time.time
+# physical path -> ExpiryStatistics of the containers of this process
+_expiry_statistics = {}
 
 def setStrict(on=''):
     """ Turn on assertions (which may cause conflicts) """
@@ -133,17 +145,21 @@ class TransientObjectContainer(SimpleItem):
 
     _limit = 0
     _data = None
-    _inband_housekeeping = True
+    _inband_housekeeping = None # use INBAND_HOUSEKEEPING
+    _delBatchCallback = None
+    # an AccessLog if access tracking is enabled
+    _access_log = None
 
     security.setDefaultAccess('deny')
 
-    # intitialize locks used for finalization, replentishing, and
-    # garbage collection (used in _finalize, _replentish, and _gc
-    # respectively)
+    # intitialize locks used for finalization, replentishing, garbage
+    # collection and relocation (used in _finalize, _replentish, _gc and
+    # _relocate respectively)
 
     finalize_lock = thread.allocate_lock()
     replentish_lock =  thread.allocate_lock()
     gc_lock = thread.allocate_lock()
+    relocate_lock = thread.allocate_lock()
 
     def __init__(self, id, title='', timeout_mins=20, addNotification=None,
                  delNotification=None, limit=0, period_secs=20):
@@ -253,6 +269,10 @@ class TransientObjectContainer(SimpleItem):
         except AttributeError:
             self._length = self.getLen = Length2()
 
+        # the access log refers to items of the old _data
+        if self._access_log is not None:
+            self._access_log = AccessLog()
+
     def _getCurrentSlices(self, now):
         if self._timeout_slices:
             begin = now - (self._period * self._timeout_slices)
@@ -274,13 +294,16 @@ class TransientObjectContainer(SimpleItem):
         DEBUG and TLOG('_getCurrentSlices, result = %s' % result)
         return result
 
-    def _move_item(self, k, current_ts, default=None):
+    def _move_item(self, k, current_ts, default=None, track=True):
+        # Find the item for k and move it to the current bucket.  If access
+        # tracking is enabled and 'track' is true, the access is recorded in
+        # the access log instead, and the item is moved during housekeeping.
         if not self._timeout_slices:
             # special case for no timeout value
             bucket = self._data.get(0)
             return bucket.get(k, default)
 
-        if self._inband_housekeeping:
+        if self.isInbandHousekeepingEnabled():
             self._housekeep(current_ts)
 
         else:
@@ -314,12 +337,28 @@ class TransientObjectContainer(SimpleItem):
                 found_ts = ts
                 break
 
+        if found_ts is None and self._access_log is not None:
+            # the item may have been accessed in time, but not have been
+            # relocated yet because housekeeping didn't run since
+            found_ts = self._find_logged_item(k, current_slices[-1])
+
         DEBUG and TLOG('_move_item: found_ts is %s' % found_ts)
 
         if found_ts is None:
             DEBUG and TLOG('_move_item: returning default of %s' % default)
             return default
 
+        # items older than the current slices are moved right away
+        if (found_ts != current_ts and found_ts >= current_slices[-1] and
+            track and self._access_log is not None):
+            DEBUG and TLOG('_move_item: current_ts (%s) != found_ts (%s), '
+                           'logging access' % (current_ts, found_ts))
+            self._access_log.record(k, current_ts)
+            item = self._data[found_ts][k]
+            if getattr(item, 'setLastAccessed', None):
+                item.setLastAccessed()
+            return item
+
         if found_ts != current_ts:
 
             DEBUG and TLOG('_move_item: current_ts (%s) != found_ts (%s), '
@@ -353,13 +392,26 @@ class TransientObjectContainer(SimpleItem):
                        % (k, current_ts))
         return self._data[current_ts][k]
 
+    def _find_logged_item(self, k, begin):
+        # Return the timeslice of the bucket holding k if it lies before
+        # begin and the access log has an access of k since, else None.
+        if self._access_log.lastAccess(k, begin) is None:
+            return None
+        min_ts = self._last_finalized_timeslice() + 1
+        candidates = list(self._data.keys(min_ts, begin - 1))
+        candidates.reverse()
+        for ts in candidates:
+            if self._data[ts].get(k, None) is not None:
+                return ts
+        return None
+
     def _all(self):
         if self._timeout_slices:
             current_ts = getCurrentTimeslice(self._period)
         else:
             current_ts = 0
 
-        if self._inband_housekeeping:
+        if self.isInbandHousekeepingEnabled():
             self._housekeep(current_ts)
 
         elif self._in_emergency_bucket_shortage(current_ts):
@@ -431,7 +483,7 @@ class TransientObjectContainer(SimpleItem):
             current_ts = getCurrentTimeslice(self._period)
         else:
             current_ts = 0
-        item = self._move_item(k, current_ts, _marker)
+        item = self._move_item(k, current_ts, _marker, track=False)
         STRICT and _assert(self._data.has_key(current_ts))
         if item is _marker:
             # the key didnt already exist, this is a new item
@@ -467,7 +519,7 @@ class TransientObjectContainer(SimpleItem):
             current_ts = getCurrentTimeslice(self._period)
         else:
             current_ts = 0
-        item = self._move_item(k, current_ts)
+        item = self._move_item(k, current_ts, track=False)
         STRICT and _assert(self._data.has_key(current_ts))
         bucket = self._data[current_ts]
         del bucket[k]
@@ -525,10 +577,11 @@ class TransientObjectContainer(SimpleItem):
         return required
 
     def _finalize(self, now):
-        """ Call finalization handlers for the data in each stale bucket """
+        """ Call finalization handlers for the data in each stale bucket,
+        return the number of finalized items """
         if not self._timeout_slices:
             DEBUG and TLOG('_finalize: doing nothing (no timeout)')
-            return # don't do any finalization if there is no timeout
+            return 0 # don't do any finalization if there is no timeout
 
         # The nature of sessioning is that when the timeslice rolls
         # over, all active threads will try to do a lot of work during
@@ -543,7 +596,7 @@ class TransientObjectContainer(SimpleItem):
 
         if not self.finalize_lock.acquire(0):
             DEBUG and TLOG('_finalize: could not acquire lock, returning')
-            return
+            return 0
 
         try:
             DEBUG and TLOG('_finalize: lock acquired successfully')
@@ -561,7 +614,7 @@ class TransientObjectContainer(SimpleItem):
                 DEBUG and TLOG(
                     '_finalize: start_finalize (%s) >= max_ts (%s), '
                     'doing nothing' % (start_finalize, max_ts))
-                return
+                return 0
             else:
                 DEBUG and TLOG(
                     '_finalize: start_finalize (%s) <= max_ts (%s), '
@@ -570,7 +623,7 @@ class TransientObjectContainer(SimpleItem):
                 # dance (ala _replentish and _gc) because it's important that
                 # buckets are finalized as soon as possible after they've
                 # expired in order to call the delete notifier "on time".
-                self._do_finalize_work(now, max_ts, start_finalize)
+                return self._do_finalize_work(now, max_ts, start_finalize)
 
         finally:
             self.finalize_lock.release()
@@ -587,7 +640,7 @@ class TransientObjectContainer(SimpleItem):
         to_finalize = list(self._data.keys(start_finalize, max_ts))
         DEBUG and TLOG('_do_finalize_work: to_finalize is %s' % `to_finalize`)
 
-        delta = 0
+        expired = []
 
         for key in to_finalize:
 
@@ -598,11 +651,11 @@ class TransientObjectContainer(SimpleItem):
             DEBUG and TLOG('_do_finalize_work: values to notify from ts %s '
                            'are %s' % (key, `list(values)`))
 
-            delta += len(values)
+            expired.extend(values)
 
-            for v in values:
-                self.notifyDel(v)
+        self._notifyExpired(expired)
 
+        delta = len(expired)
         if delta:
             self._length.decrement(delta)
 
@@ -610,6 +663,66 @@ class TransientObjectContainer(SimpleItem):
                        'to max_ts of %s' % max_ts)
 
         self._last_finalized_timeslice.set(max_ts)
+        return delta
+
+    def _relocate(self, now):
+        """ Move the items accessed since the last relocation to the
+        buckets of their last access (only with access tracking), return
+        the number of moved items """
+        if self._access_log is None or not self._timeout_slices:
+            return 0
+
+        # Relocation is required before finalization, but only once per
+        # timeslice; we don't wait for another thread doing it.
+        if self._access_log.relocated >= now:
+            return 0
+
+        if not self.relocate_lock.acquire(0):
+            DEBUG and TLOG('_relocate: could not acquire lock, returning')
+            return 0
+
+        try:
+            return self._do_relocate_work(now)
+        finally:
+            self.relocate_lock.release()
+
+    def _do_relocate_work(self, now):
+        # this is only separated from _relocate for readability; it
+        # should generally not be called by anything but _relocate
+        log = self._access_log
+        entries = log.items(now)
+        DEBUG and TLOG('_do_relocate_work: %s entries' % len(entries))
+
+        # items in finalized buckets are gone already
+        min_ts = self._last_finalized_timeslice() + 1
+        moved = 0
+
+        for k, ts in entries:
+            found_ts = None
+            candidates = list(self._data.keys(min_ts, ts))
+            candidates.reverse()
+            for candidate in candidates:
+                if self._data[candidate].get(k, None) is not None:
+                    found_ts = candidate
+                    break
+            # the item may have been moved, replaced or deleted since
+            if (found_ts is not None and found_ts < ts
+                and self._data.has_key(ts)):
+                self._data[ts][k] = self._data[found_ts][k]
+                del self._data[found_ts][k]
+                if not issubclass(BUCKET_CLASS, Persistent):
+                    # tickle persistence machinery
+                    self._data[ts] = self._data[ts]
+                    self._data[found_ts] = self._data[found_ts]
+                DEBUG and TLOG('_do_relocate_work: moved item %s from %s '
+                               'to %s' % (k, found_ts, ts))
+                moved += 1
+
+        # Requests that started in the previous timeslice may still
+        # record accesses in it; keep it until the next relocation.
+        log.discard(now - self._period)
+        log.relocated = now
+        return moved
 
     def _invoke_finalize_and_gc(self):
         # for unit testing purposes only!
@@ -621,10 +734,11 @@ class TransientObjectContainer(SimpleItem):
         self._do_gc_work(now)
 
     def _replentish(self, now):
-        """ Add 'fresh' future or current buckets """
+        """ Add 'fresh' future or current buckets, return the number of
+        added buckets """
         if not self._timeout_slices:
             DEBUG and TLOG('_replentish: no timeout, doing nothing')
-            return
+            return 0
         
         # the difference between high and low naturally diminishes to
         # zero as now approaches self._max_timeslice() during normal
@@ -646,7 +760,7 @@ class TransientObjectContainer(SimpleItem):
                 else:
                     DEBUG and TLOG('_replentish: required, lock NOT acquired)')
                 max_ts = self._max_timeslice()
-                self._do_replentish_work(now, max_ts)
+                return self._do_replentish_work(now, max_ts)
 
             elif lock_acquired:
                 # If replentish is optional, minimize the chance that
@@ -659,19 +773,20 @@ class TransientObjectContainer(SimpleItem):
                 low = now/self._period
                 high = max_ts/self._period
                 if roll(low, high, 'optional replentish'):
-                    self._do_replentish_work(now, max_ts)
+                    return self._do_replentish_work(now, max_ts)
 
             else:
                 # This is an optional replentish and we can't acquire
                 # the lock, bail.
                 DEBUG and TLOG('_optional replentish attempt aborted, could '
                                'not acquire lock.')
-                return
 
         finally:
             if lock_acquired:
                 self.replentish_lock.release()
 
+        return 0
+
     def _do_replentish_work(self, now, max_ts):
         DEBUG and TLOG('_do_replentish_work: entering')
         # this is only separated from _replentish for readability; it
@@ -690,7 +805,7 @@ class TransientObjectContainer(SimpleItem):
                            'SPARE_BUCKETS (%s), doing '
                            'nothing'% (available_spares,
                                        SPARE_BUCKETS))
-            return
+            return 0
 
         if max_ts < now:
             # the newest bucket in self._data is older than now!
@@ -718,21 +833,22 @@ class TransientObjectContainer(SimpleItem):
             self._data[k] = BUCKET_CLASS() # XXX ReadConflictError hotspot
 
         self._max_timeslice.set(max(new_buckets))
+        return len(new_buckets)
 
     def _gc(self, now=None):
-        """ Remove stale buckets """
+        """ Remove stale buckets, return the number of removed buckets """
         if not self._timeout_slices:
-            return # dont do gc if there is no timeout
+            return 0 # dont do gc if there is no timeout
 
         # give callers a good chance to do nothing (gc isn't as important
         # as replentishment or finalization)
         if not roll(0, 5, 'gc'):
             DEBUG and TLOG('_gc: lost roll, doing nothing')
-            return
+            return 0
 
         if not self.gc_lock.acquire(0):
             DEBUG and TLOG('_gc: couldnt acquire lock')
-            return
+            return 0
 
         try: 
             if now is None:
@@ -744,12 +860,12 @@ class TransientObjectContainer(SimpleItem):
             if (now - last_gc) < gc_every:
                 DEBUG and TLOG('_gc: gc attempt not yet required '
                                '( (%s - %s) < %s )' % (now, last_gc, gc_every))
-                return
+                return 0
             else:
                 DEBUG and TLOG(
                     '_gc:  (%s -%s) > %s, gc invoked' % (now, last_gc,
                                                           gc_every))
-                self._do_gc_work(now)
+                return self._do_gc_work(now)
 
         finally:
             self.gc_lock.release()
@@ -776,6 +892,7 @@ class TransientObjectContainer(SimpleItem):
 
         DEBUG and TLOG('_do_gc_work: setting last_gc_timeslice to %s' % now)
         self._last_gc_timeslice.set(now)
+        return len(to_gc)
 
     def notifyAdd(self, item):
         DEBUG and TLOG('notifyAdd with %s' % item)
@@ -791,6 +908,41 @@ class TransientObjectContainer(SimpleItem):
             return
         self._notify(item, callback, 'notifyDel' )
 
+    def notifyDelBatch(self, items):
+        """ Notify the delete notification targets of a list of items
+        """
+        DEBUG and TLOG('notifyDelBatch with %s items' % len(items))
+        callback = self._getCallback(self._delBatchCallback)
+        if callback is not None:
+            self._notify(items, callback, 'notifyDelBatch')
+        callback = self._getCallback(self._delCallback)
+        if callback is not None:
+            self._notifyEach(items, callback, 'notifyDel')
+
+    def _notifyExpired(self, items):
+        # Hand expired items to the delete notification targets in batches
+        # of NOTIFY_BATCH_SIZE, resolving the targets once per batch.  A
+        # savepoint after each batch keeps the changes made by the targets
+        # from piling up in memory.
+        start = _timer()
+        batches = 0
+        if self._delCallback or self._delBatchCallback:
+            for i in range(0, len(items), NOTIFY_BATCH_SIZE):
+                if batches:
+                    transaction.savepoint(optimistic=True)
+                self.notifyDelBatch(items[i:i + NOTIFY_BATCH_SIZE])
+                batches += 1
+        if items:
+            self._getExpiryStatistics().record(
+                len(items), batches, _timer() - start)
+
+    def _getExpiryStatistics(self):
+        path = '/'.join(self.getPhysicalPath())
+        stats = _expiry_statistics.get(path)
+        if stats is None:
+            stats = _expiry_statistics.setdefault(path, ExpiryStatistics())
+        return stats
+
     def _getCallback(self, callback):
         if not callback:
             return None
@@ -808,19 +960,23 @@ class TransientObjectContainer(SimpleItem):
         return method
 
     def _notify(self, item, callback, name):
+        self._notifyEach([item], callback, name)
+
+    def _notifyEach(self, items, callback, name):
         if callable(callback):
             sm = getSecurityManager()
             try:
                 user = sm.getUser()
-                try:
-                    newSecurityManager(None, nobody)
-                    callback(item, self)
-                except:
-                    # dont raise, just log
-                    path = self.getPhysicalPath()
-                    LOG.warn('%s failed when calling %s in %s' % (name,callback,
-                                                                 '/'.join(path)),
-                             exc_info=sys.exc_info())
+                newSecurityManager(None, nobody)
+                for item in items:
+                    try:
+                        callback(item, self)
+                    except:
+                        # dont raise, just log
+                        path = self.getPhysicalPath()
+                        LOG.warn('%s failed when calling %s in %s' % (
+                            name, callback, '/'.join(path)),
+                            exc_info=sys.exc_info())
             finally:
                 setSecurityManager(sm)
         else:
@@ -903,6 +1059,25 @@ class TransientObjectContainer(SimpleItem):
     def setDelNotificationTarget(self, f):
         self._delCallback = f
 
+    security.declareProtected(MGMT_SCREEN_PERM,
+                              'getBatchDelNotificationTarget')
+    def getBatchDelNotificationTarget(self):
+        return self._delBatchCallback or ''
+
+    security.declareProtected(MANAGE_CONTAINER_PERM,
+                              'setBatchDelNotificationTarget')
+    def setBatchDelNotificationTarget(self, f):
+        """ Set the target called with lists of expired items and the
+        container, in addition to the delete notification target """
+        self._delBatchCallback = f or None
+
+    security.declareProtected(MGMT_SCREEN_PERM, 'getExpiryStatistics')
+    def getExpiryStatistics(self):
+        """ Return the number of items expired by this process, the
+        number of notification batches, the seconds spent notifying and
+        the resulting rate of items per second """
+        return self._getExpiryStatistics().getStatistics()
+
     security.declareProtected(MGMT_SCREEN_PERM, 'disableInbandHousekeeping')
     def disableInbandHousekeeping(self):
         """ No longer perform inband housekeeping """
@@ -916,23 +1091,50 @@ class TransientObjectContainer(SimpleItem):
     security.declareProtected(MGMT_SCREEN_PERM, 'isInbandHousekeepingEnabled')
     def isInbandHousekeepingEnabled(self):
         """ Report if inband housekeeping is enabled """
+        if self._inband_housekeeping is None:
+            return INBAND_HOUSEKEEPING
         return self._inband_housekeeping
 
+    security.declareProtected(MGMT_SCREEN_PERM, 'enableAccessTracking')
+    def enableAccessTracking(self):
+        """ Record accesses in a log instead of moving the items to the
+        current bucket, move them during housekeeping """
+        if self._access_log is None:
+            self._access_log = AccessLog()
+
+    security.declareProtected(MGMT_SCREEN_PERM, 'disableAccessTracking')
+    def disableAccessTracking(self):
+        """ Move items to the current bucket when they are accessed """
+        if self._access_log is not None:
+            if self._timeout_slices:
+                self._do_relocate_work(getCurrentTimeslice(self._period))
+            self._access_log = None
+
+    security.declareProtected(MGMT_SCREEN_PERM, 'isAccessTrackingEnabled')
+    def isAccessTrackingEnabled(self):
+        """ Report if access tracking is enabled """
+        return self._access_log is not None
+
     security.declareProtected('View', 'housekeep')
     def housekeep(self):
         """ Call this from a scheduler at least every
         self._period * (SPARE_BUCKETS - 1) seconds to perform out of band
-        housekeeping """
+        housekeeping.  Returns a mapping of the kinds of work done to the
+        number of items or buckets handled. """
         # we can protect this method from being called too often by
         # anonymous users as necessary in the future; we already have a lot
         # of protection as-is though so no need to make it more complicated
         # than necessary at the moment
-        self._housekeep(getCurrentTimeslice(self._period))
+        return self._housekeep(getCurrentTimeslice(self._period))
 
     def _housekeep(self, now):
-        self._finalize(now)
-        self._replentish(now)
-        self._gc(now)
+        # returns a mapping of the kinds of work done to their amount
+        report = {}
+        report['relocated'] = self._relocate(now)
+        report['finalized'] = self._finalize(now)
+        report['replentished'] = self._replentish(now)
+        report['collected'] = self._gc(now)
+        return report
 
     security.declareProtected(MANAGE_CONTAINER_PERM,
         'manage_changeTransientObjectContainer')
@@ -1118,5 +1320,83 @@ class Length2(Persistent):
         new['value'] = new['ceiling'] - new['floor']
         return new
 
+
+class ExpiryStatistics:
+    """ Counters of the items a container expired in this process """
+
+    def __init__(self):
+        self.lock = thread.allocate_lock()
+        self.items = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def record(self, items, batches, seconds):
+        self.lock.acquire()
+        try:
+            self.items += items
+            self.batches += batches
+            self.seconds += seconds
+        finally:
+            self.lock.release()
+
+    def getStatistics(self):
+        rate = 0.0
+        if self.seconds:
+            rate = self.items / self.seconds
+        return {'items': self.items,
+                'batches': self.batches,
+                'seconds': self.seconds,
+                'rate': rate,
+               }
+
+
+class AccessLog(Persistent):
+    """
+    A persistent object recording the timeslices in which transient objects
+    were last accessed, until housekeeping moves them to the buckets of
+    those timeslices.
+
+    The keys accessed in a timeslice are kept in a tree set of their own,
+    so that recording an access writes a single bucket of that set, and
+    the conflict resolution of the set merges the accesses recorded by
+    concurrent transactions.
+    """
+    relocated = 0
+
+    def __init__(self):
+        self._log = IOBTree() # timeslice -> OOTreeSet of keys
+
+    def record(self, k, ts):
+        # only write once per key and timeslice
+        keys = self._log.get(ts, None)
+        if keys is None:
+            keys = self._log[ts] = OOTreeSet()
+        if not keys.has_key(k):
+            keys.insert(k)
+
+    def items(self, max_ts=None):
+        """ Return (key, timeslice) pairs with the last timeslice up to
+        max_ts in which each key was accessed """
+        last = {}
+        for ts, keys in self._log.items(max=max_ts):
+            for k in keys:
+                last[k] = ts
+        return last.items()
+
+    def lastAccess(self, k, min_ts):
+        """ Return the last timeslice from min_ts on in which k was
+        accessed, or None """
+        timeslices = list(self._log.keys(min=min_ts))
+        timeslices.reverse()
+        for ts in timeslices:
+            if self._log[ts].has_key(k):
+                return ts
+        return None
+
+    def discard(self, max_ts):
+        """ Forget the accesses recorded in timeslices before max_ts """
+        for ts in list(self._log.keys(max=max_ts, excludemax=True)):
+            del self._log[ts]
+
 InitializeClass(TransientObjectContainer)
 
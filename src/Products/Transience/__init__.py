@@ -16,6 +16,7 @@ Transience initialization routines
 
 import ZODB # this is to help out testrunner, don't remove.
 import Transience
+import MemoryTransience
 # import of MaxTransientObjectsExceeded for easy import from scripts,
 # this is protected by a module security info declaration in the
 # Sessions package.
@@ -28,3 +29,10 @@ def initialize(context):
         constructors=(Transience.constructTransientObjectContainerForm,
                       Transience.constructTransientObjectContainer)
         )
+    context.registerClass(
+        MemoryTransience.MemoryTransientObjectContainer,
+        permission=Transience.ADD_CONTAINER_PERM,
+        constructors=(
+            MemoryTransience.constructMemoryTransientObjectContainerForm,
+            MemoryTransience.constructMemoryTransientObjectContainer)
+        )
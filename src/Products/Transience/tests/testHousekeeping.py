@@ -0,0 +1,115 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import time as oldtime
+import unittest
+
+import transaction
+import ZODB
+from ZODB.DemoStorage import DemoStorage
+from OFS.Application import Application
+
+from Products.Transience.Transience import TransientObjectContainer
+import Products.Transience.Transience
+import Products.Transience.TransientObject
+
+
+deleted = []
+
+def delNotificationTarget(item, container):
+    deleted.append(item.getContainerKey())
+
+
+class Clock:
+    """ Time module replacement that only moves when told to """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now = self.now + duration
+
+
+class HousekeepingThreadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        Products.Transience.Transience.time = self.clock
+        Products.Transience.TransientObject.time = self.clock
+        self.db = ZODB.DB(DemoStorage())
+        conn = self.db.open()
+        app = Application()
+        conn.root()['Application'] = app
+        sdc = TransientObjectContainer('sdc', timeout_mins=1)
+        sdc.setDelNotificationTarget(delNotificationTarget)
+        sdc.disableInbandHousekeeping()
+        app._setObject('sdc', sdc)
+        app.sdc.new('a')
+        transaction.commit()
+        conn.close()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+        del deleted[:]
+        Products.Transience.Transience.time = oldtime
+        Products.Transience.TransientObject.time = oldtime
+
+    def _makeOne(self, paths=('/sdc',)):
+        from Products.Transience.Housekeeping import HousekeepingThread
+        return HousekeepingThread(self.db, list(paths))
+
+    def test_housekeep(self):
+        thread = self._makeOne()
+        self.clock.sleep(120)
+        reports = thread.housekeep()
+        self.assertEqual(reports['/sdc']['finalized'], 1)
+        self.assertEqual(sorted(reports['/sdc']),
+                         ['collected', 'finalized', 'relocated',
+                          'replentished'])
+        self.assertEqual(deleted, ['a'])
+
+        conn = self.db.open()
+        try:
+            sdc = conn.root()['Application'].sdc
+            self.assertEqual(len(sdc), 0)
+        finally:
+            conn.close()
+
+    def test_housekeep_bad_path(self):
+        thread = self._makeOne(('/nonesuch', '/sdc'))
+        self.clock.sleep(120)
+        reports = thread.housekeep()
+        self.assertEqual(reports['/nonesuch'], None)
+        self.assertEqual(reports['/sdc']['finalized'], 1)
+
+    def test_start_and_stop(self):
+        thread = self._makeOne()
+        thread.interval = 0.01
+        thread.start()
+        thread.stop()
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+
+    def test_startHousekeeping_unconfigured(self):
+        from Products.Transience import Housekeeping
+        Housekeeping.startHousekeeping(None)
+        self.assertEqual(Housekeeping.housekeeper, None)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(HousekeepingThreadTests),
+        ))
@@ -0,0 +1,293 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import time as oldtime
+import unittest
+
+import transaction
+import ZODB
+from ZODB.DemoStorage import DemoStorage
+
+from Products.Transience.Transience import MaxTransientObjectsExceeded
+import Products.Transience.MemoryTransience
+import Products.Transience.TransientObject
+
+
+class Clock:
+    """ Time module replacement that only moves when told to """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now = self.now + duration
+
+
+class TransientStoreTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from Products.Transience.MemoryTransience import TransientStore
+        return TransientStore()
+
+    def test_lookup(self):
+        store = self._makeOne()
+        self.assertEqual(store.lookup('a', 10), (None, None))
+        store.store('a', 1, 10)
+        self.assertEqual(store.lookup('a', 20, 5), (1, None))
+        self.assertEqual(store.lookup('a', 30, 25), (None, 1))
+        self.assertFalse(store.has_key('a'))
+
+    def test_expire(self):
+        store = self._makeOne()
+        for i in range(100):
+            store.store(i, i, i)
+        self.assertEqual(len(store), 100)
+        self.assertEqual(sorted(store.expire(200, 50)), range(50))
+        self.assertEqual(len(store), 50)
+        self.assertEqual(sorted(store.items(60)),
+                         [(i, i) for i in range(60, 100)])
+
+    def test_remove(self):
+        store = self._makeOne()
+        store.store('a', 1, 10)
+        self.assertEqual(store.remove('a', 20), 1)
+        self.assertRaises(KeyError, store.remove, 'a', 20)
+
+    def test_changes(self):
+        store = self._makeOne()
+        store.setWriteBehind(True)
+        store.store('a', 1, 10)
+        changed, deleted = store.changes()
+        self.assertEqual([key for key, entry in changed], ['a'])
+        store.saved(changed, deleted, 10)
+        store.store('b', 2, 10)
+        store.remove('a', 20)
+        changed, deleted = store.changes()
+        self.assertEqual([key for key, entry in changed], ['b'])
+        self.assertEqual(deleted, [('a', 20)])
+        store.saved(changed, deleted, 30)
+        self.assertEqual(store.changes(), ([], []))
+
+
+class TestMemoryTransientObjectContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        Products.Transience.MemoryTransience.time = self.clock
+        Products.Transience.TransientObject.time = self.clock
+        self.t = self._makeOne()
+
+    def tearDown(self):
+        self.t._remove_data()
+        transaction.abort()
+        Products.Transience.MemoryTransience.time = oldtime
+        Products.Transience.TransientObject.time = oldtime
+
+    def _makeOne(self, **kw):
+        from Products.Transience.MemoryTransience import \
+             MemoryTransientObjectContainer
+        return MemoryTransientObjectContainer('sdc', timeout_mins=1,
+                                              period_secs=20, **kw)
+
+    def test_interfaces(self):
+        from zope.interface.verify import verifyObject
+        from Products.Transience.TransienceInterfaces import \
+             TransientItemContainer
+        self.assertTrue(verifyObject(TransientItemContainer, self.t))
+
+    def test_getitem_setitem_delitem(self):
+        self.assertRaises(KeyError, self.t.__getitem__, 'a')
+        self.assertEqual(self.t.get('a', 'default'), 'default')
+        self.t['a'] = 1
+        self.assertEqual(self.t['a'], 1)
+        self.assertTrue(self.t.has_key('a'))
+        self.t['a'] = 2
+        self.assertEqual(self.t.get('a'), 2)
+        self.assertEqual(len(self.t), 1)
+        del self.t['a']
+        self.assertFalse(self.t.has_key('a'))
+        self.assertEqual(self.t.getLen(), 0)
+        self.assertRaises(KeyError, self.t.__delitem__, 'a')
+
+    def test_keys_values_items(self):
+        for i in range(10):
+            self.t[i] = i * 2
+        self.assertEqual(sorted(self.t.keys()), range(10))
+        self.assertEqual(sorted(self.t.values()), range(0, 20, 2))
+        self.assertEqual(sorted(self.t.items())[3], (3, 6))
+
+    def test_limit(self):
+        self.t.setSubobjectLimit(2)
+        self.t['a'] = 1
+        self.t['b'] = 2
+        self.t['b'] = 3
+        self.assertRaises(MaxTransientObjectsExceeded,
+                          self.t.__setitem__, 'c', 4)
+
+    def test_expiry(self):
+        self.t['a'] = 1
+        self.t['b'] = 2
+        self.clock.sleep(50)
+        self.assertEqual(self.t['a'], 1)
+        self.clock.sleep(50)
+        self.assertEqual(self.t.get('a'), 1)
+        self.assertEqual(self.t.get('b'), None)
+        self.clock.sleep(61)
+        self.assertEqual(len(self.t), 0)
+
+    def test_no_expiry(self):
+        self.t.setTimeoutMinutes(0)
+        self.t['a'] = 1
+        self.clock.sleep(1000000)
+        self.assertEqual(self.t['a'], 1)
+
+    def test_notifications(self):
+        added = []
+        deleted = []
+        self.t.getPhysicalPath = lambda: ('', 'sdc')
+        self.t.setAddNotificationTarget(lambda item, c: added.append(item))
+        self.t.setDelNotificationTarget(lambda item, c: deleted.append(item))
+        self.t['a'] = 1
+        self.t['b'] = 2
+        self.assertEqual(added, [1, 2])
+        self.clock.sleep(61)
+        self.assertEqual(self.t.get('a'), None)
+        self.assertEqual(sorted(deleted), [1, 2])
+
+    def test_out_of_band_housekeeping(self):
+        deleted = []
+        self.t.getPhysicalPath = lambda: ('', 'sdc')
+        self.t.setDelNotificationTarget(lambda item, c: deleted.append(item))
+        self.t.disableInbandHousekeeping()
+        self.t['a'] = 1
+        self.clock.sleep(61)
+        self.assertEqual(len(self.t), 1)
+        self.t.housekeep()
+        self.assertEqual(deleted, [1])
+        self.assertEqual(len(self.t), 0)
+
+    def test_new_or_existing_and_invalidate(self):
+        item = self.t.new_or_existing('a')
+        item['x'] = 1
+        self.assertTrue(self.t.new_or_existing('a').aq_base is item.aq_base)
+        self.assertEqual(self.t['a']['x'], 1)
+        self.t['a'].invalidate()
+        self.assertFalse(self.t.has_key('a'))
+
+    def test_copies_have_their_own_store(self):
+        from Products.Transience.subscribers import cloned
+        self.t['a'] = 1
+        other = self._makeOne()
+        self.assertEqual(other.get('a'), None)
+        other.__dict__.update(self.t.__dict__)
+        self.assertEqual(other.get('a'), 1)
+        cloned(other, None)
+        self.assertEqual(other.get('a'), None)
+        self.assertEqual(self.t.get('a'), 1)
+
+
+class TestMemoryTransientObjectContainerInZODB(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        Products.Transience.MemoryTransience.time = self.clock
+        Products.Transience.TransientObject.time = self.clock
+        self.db = ZODB.DB(DemoStorage())
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+        Products.Transience.MemoryTransience.stores.clear()
+        Products.Transience.MemoryTransience.time = oldtime
+        Products.Transience.TransientObject.time = oldtime
+
+    def _addOne(self, **kw):
+        from Products.Transience.MemoryTransience import \
+             MemoryTransientObjectContainer
+        t = MemoryTransientObjectContainer('sdc', timeout_mins=1,
+                                           period_secs=20, **kw)
+        self.root['sdc'] = t
+        transaction.commit()
+        return t
+
+    def _restart(self, t):
+        # forget the items kept in memory, as after a restart
+        t._remove_data()
+        self.conn.close()
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        return self.root['sdc']
+
+    def test_no_writes(self):
+        t = self._addOne()
+        item = t.new_or_existing('a')
+        item['x'] = 1
+        self.clock.sleep(50)
+        t.housekeep()
+        t['a']['x'] = 2
+        self.assertEqual(self.conn._registered_objects, [])
+        self.assertEqual(self._restart(t).get('a'), None)
+
+    def test_write_behind(self):
+        t = self._addOne(write_behind=True)
+        self.assertTrue(t.isWriteBehindEnabled())
+        t.new_or_existing('a')['x'] = 1
+        t.new_or_existing('b')['x'] = 2
+        self.assertEqual(self.conn._registered_objects, [])
+        self.clock.sleep(20)
+        t.housekeep()
+        transaction.commit()
+        self.clock.sleep(20)
+        t['a']['x'] = 3
+        del t['b']
+        self.clock.sleep(20)
+        t.housekeep()
+        transaction.commit()
+        t = self._restart(t)
+        self.assertEqual(t['a']['x'], 3)
+        self.assertEqual(t.get('b'), None)
+
+    def test_write_behind_aborted(self):
+        t = self._addOne(write_behind=True)
+        t['a'] = 1
+        self.clock.sleep(20)
+        t.housekeep()
+        transaction.abort()
+        self.clock.sleep(20)
+        t.housekeep()
+        transaction.commit()
+        self.assertEqual(self._restart(t)['a'], 1)
+
+    def test_write_behind_off(self):
+        t = self._addOne(write_behind=True)
+        t.manage_changeTransientObjectContainer(timeout_mins=1,
+                                                period_secs=20)
+        self.assertFalse(t.isWriteBehindEnabled())
+        transaction.commit()
+        t['a'] = 1
+        self.clock.sleep(20)
+        t.housekeep()
+        self.assertEqual(self.conn._registered_objects, [])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(TransientStoreTests),
+        unittest.makeSuite(TestMemoryTransientObjectContainer),
+        unittest.makeSuite(TestMemoryTransientObjectContainerInZODB),
+        ))
@@ -336,6 +336,16 @@ class TestTransientObjectContainer(TestCase):
         for k in keys:
             self.assert_(k > max_ts, "k %s < max_ts %s" % (k, max_ts))
 
+    def testInbandHousekeepingDefault(self):
+        self.assertTrue(self.t.isInbandHousekeepingEnabled())
+        Products.Transience.Transience.INBAND_HOUSEKEEPING = False
+        try:
+            self.assertFalse(self.t.isInbandHousekeepingEnabled())
+            self.t.enableInbandHousekeeping()
+            self.assertTrue(self.t.isInbandHousekeepingEnabled())
+        finally:
+            Products.Transience.Transience.INBAND_HOUSEKEEPING = True
+
     def _maxOut(self):
         for x in range(11):
             self.t.new(str(x))
@@ -414,6 +424,239 @@ class TestSlowTransientObjectContainer(TestCase):
             else: assert 1 == 2, x
 
 
+class Clock:
+    """ Time module replacement that only moves when told to """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now = self.now + duration
+
+
+class TestAccessTracking(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        Products.Transience.Transience.time = self.clock
+        Products.Transience.TransientObject.time = self.clock
+        Products.Transience.Transience.setStrict(1)
+        self.period = 20
+        self.t = TransientObjectContainer('sdc', timeout_mins=1,
+                                          period_secs=self.period)
+        self.t.enableAccessTracking()
+
+    def tearDown(self):
+        self.t = None
+        Products.Transience.Transience.time = oldtime
+        Products.Transience.TransientObject.time = oldtime
+        Products.Transience.Transience.setStrict(0)
+
+    def _bucketOf(self, k):
+        for ts, bucket in self.t._data.items():
+            if bucket.has_key(k):
+                return ts
+
+    def testReadLogsAccess(self):
+        self.t['a'] = 1
+        created = self._bucketOf('a')
+        self.clock.sleep(self.period)
+        self.assertEqual(self.t['a'], 1)
+        self.assertEqual(self._bucketOf('a'), created)
+        self.assertEqual(self.t._access_log.items(),
+                         [('a', created + self.period)])
+
+    def testHousekeepingRelocates(self):
+        self.t.disableInbandHousekeeping()
+        self.t['a'] = 1
+        created = self._bucketOf('a')
+        self.clock.sleep(self.period)
+        self.assertEqual(self.t.get('a'), 1)
+        self.clock.sleep(self.period)
+        self.t.housekeep()
+        self.assertEqual(self._bucketOf('a'), created + self.period)
+        # accesses of the previous timeslice are kept for one more
+        self.assertEqual(self.t._access_log.items(),
+                         [('a', created + self.period)])
+        self.clock.sleep(self.period)
+        self.t.housekeep()
+        self.assertEqual(self._bucketOf('a'), created + self.period)
+        self.assertEqual(self.t._access_log.items(), [])
+
+    def testLoggedItemVisibleAfterSliceRoll(self):
+        # without housekeeping, an item accessed in the oldest of the
+        # current slices is found after the slices roll
+        self.t.disableInbandHousekeeping()
+        self.t['a'] = {'x': 1}
+        created = self._bucketOf('a')
+        self.clock.sleep(self.period * self.t._timeout_slices)
+        self.assertEqual(self.t.get('a'), {'x': 1})
+        self.assertEqual(self._bucketOf('a'), created)
+        self.clock.sleep(self.period)
+        self.assertEqual(self.t.new_or_existing('a'), {'x': 1})
+        self.assertNotEqual(self._bucketOf('a'), created)
+        self.t.housekeep()
+        self.assertEqual(len(self.t), 1)
+        self.assertEqual(self.t.get('a'), {'x': 1})
+        self.assertEqual(len([ts for ts, bucket in self.t._data.items()
+                              if bucket.has_key('a')]), 1)
+
+    def testUnloggedItemExpiresAfterSliceRoll(self):
+        self.t.disableInbandHousekeeping()
+        self.t['a'] = 1
+        self.clock.sleep(self.period * (self.t._timeout_slices + 1))
+        self.assertEqual(self.t.get('a'), None)
+
+    def testAccessedItemsDontExpire(self):
+        self.t['a'] = 1
+        self.t['b'] = 2
+        for i in range(10):
+            self.clock.sleep(self.period)
+            self.assertEqual(self.t['a'], 1)
+        self.assertEqual(self.t.get('b'), None)
+        self.assertEqual(len(self.t), 1)
+
+    def testSetAndDeleteLoggedItem(self):
+        self.t['a'] = 1
+        self.clock.sleep(self.period)
+        self.assertTrue(self.t.has_key('a'))
+        self.t['a'] = 2
+        self.assertEqual(self.t['a'], 2)
+        del self.t['a']
+        self.assertFalse(self.t.has_key('a'))
+        self.clock.sleep(self.period)
+        self.t.housekeep()
+        self.assertEqual(self._bucketOf('a'), None)
+        self.assertEqual(len(self.t), 0)
+
+    def testDisableRelocates(self):
+        self.t['a'] = 1
+        self.clock.sleep(self.period)
+        self.t.get('a')
+        self.t.disableAccessTracking()
+        self.assertFalse(self.t.isAccessTrackingEnabled())
+        self.assertEqual(self._bucketOf('a'), self.clock.now -
+                         self.clock.now % self.period)
+
+
+class TestExpiryNotification(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        Products.Transience.Transience.time = self.clock
+        Products.Transience.TransientObject.time = self.clock
+        Products.Transience.Transience.NOTIFY_BATCH_SIZE = 3
+        Products.Transience.Transience._expiry_statistics.clear()
+        self.t = TransientObjectContainer('sdc', timeout_mins=1,
+                                          period_secs=20)
+
+    def tearDown(self):
+        self.t = None
+        Products.Transience.Transience.time = oldtime
+        Products.Transience.TransientObject.time = oldtime
+        Products.Transience.Transience.NOTIFY_BATCH_SIZE = 500
+        Products.Transience.Transience._expiry_statistics.clear()
+
+    def _expireAll(self, n=7):
+        for x in range(n):
+            self.t[x] = x
+        self.clock.sleep(120)
+        return self.t.housekeep()
+
+    def testBatches(self):
+        batches = []
+        self.t.setBatchDelNotificationTarget(
+            lambda items, container: batches.append(sorted(items)))
+        self.assertEqual(self._expireAll()['finalized'], 7)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual(sorted(sum(batches, [])), range(7))
+        stats = self.t.getExpiryStatistics()
+        self.assertEqual(stats['items'], 7)
+        self.assertEqual(stats['batches'], 3)
+
+    def testBatchAndItemTargets(self):
+        batches = []
+        deleted = []
+        self.t.setBatchDelNotificationTarget(
+            lambda items, container: batches.append(items))
+        self.t.setDelNotificationTarget(
+            lambda item, container: deleted.append(item))
+        self._expireAll()
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(sorted(deleted), range(7))
+
+    def testFailingItemTarget(self):
+        deleted = []
+        def delNotify(item, container):
+            if item == 3:
+                raise ValueError(item)
+            deleted.append(item)
+        self.t.setDelNotificationTarget(delNotify)
+        self._expireAll()
+        self.assertEqual(sorted(deleted), [0, 1, 2, 4, 5, 6])
+
+    def testNoTargets(self):
+        self._expireAll()
+        stats = self.t.getExpiryStatistics()
+        self.assertEqual(stats['items'], 7)
+        self.assertEqual(stats['batches'], 0)
+
+
+class TestAccessLog(TestCase):
+
+    def _makeOne(self):
+        from Products.Transience.Transience import AccessLog
+        return AccessLog()
+
+    def testRecord(self):
+        log = self._makeOne()
+        log.record('a', 20)
+        log.record('a', 40)
+        log.record('a', 20)
+        log.record('b', 20)
+        self.assertEqual(sorted(log.items()), [('a', 40), ('b', 20)])
+        self.assertEqual(sorted(log.items(20)), [('a', 20), ('b', 20)])
+        log.discard(40)
+        self.assertEqual(log.items(), [('a', 40)])
+        log.discard(60)
+        self.assertEqual(log.items(), [])
+
+    def testLastAccess(self):
+        log = self._makeOne()
+        log.record('a', 20)
+        log.record('a', 40)
+        log.record('b', 40)
+        log.record('b', 60)
+        self.assertEqual(log.lastAccess('a', 0), 40)
+        self.assertEqual(log.lastAccess('a', 60), None)
+        self.assertEqual(log.lastAccess('b', 20), 60)
+        self.assertEqual(log.lastAccess('c', 0), None)
+
+    def testRecordWritesTimesliceOnly(self):
+        import transaction
+        from ZODB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            log = conn.root()['log'] = self._makeOne()
+            log.record('a', 20)
+            transaction.commit()
+            log.record('a', 20)
+            log.record('b', 20)
+            keys = log._log[20]
+            self.assertEqual(log._p_changed, False)
+            self.assertEqual(log._log._p_changed, False)
+            self.assertEqual(keys._p_changed, True)
+            transaction.abort()
+        finally:
+            transaction.abort()
+            db.close()
+
+
 def lsubtract(l1, l2):
     l1=list(l1)
     l2=list(l2)
@@ -426,4 +669,7 @@ def test_suite():
     suite = TestSuite()
     suite.addTest(makeSuite(TestTransientObjectContainer))
     suite.addTest(makeSuite(TestSlowTransientObjectContainer))
+    suite.addTest(makeSuite(TestAccessTracking))
+    suite.addTest(makeSuite(TestExpiryNotification))
+    suite.addTest(makeSuite(TestAccessLog))
     return suite
@@ -18,6 +18,9 @@ import xmlrpc
 
 from Acquisition import aq_base
 from Acquisition.interfaces import IAcquirer
+from ZPublisher import traversalcache
+from ZPublisher.lookup import lookup
+from ZPublisher.lookup import queryAdapter
 from ZPublisher.interfaces import UseTraversalDefault
 from zExceptions import Forbidden
 from zExceptions import NotFound
@@ -26,8 +29,8 @@ from zope.event import notify
 from zope.interface import implements
 from zope.interface import Interface
 from zope.location.interfaces import LocationError
-from zope.publisher.defaultview import queryDefaultViewName
 from zope.publisher.interfaces import EndRequestEvent
+from zope.publisher.interfaces import IDefaultViewName
 from zope.publisher.interfaces import IPublishTraverse
 from zope.publisher.interfaces import NotFound as ztkNotFound
 from zope.publisher.interfaces.browser import IBrowserPublisher
@@ -166,7 +169,7 @@ class DefaultPublishTraverse(object):
         # Zope 3.2 still uses IDefaultView name when it
         # registeres default views, even though it's
         # deprecated. So we handle that here:
-        default_name = queryDefaultViewName(self.context, request)
+        default_name = lookup(self.context, request, IDefaultViewName)
         if default_name is not None:
             # Adding '@@' here forces this to be a view.
             # A neater solution might be desireable.
@@ -337,7 +340,7 @@ class BaseRequest:
         if IPublishTraverse.providedBy(ob):
             ob2 = ob.publishTraverse(self, name)
         else:
-            adapter = queryMultiAdapter((ob, self), IPublishTraverse)
+            adapter = queryAdapter(ob, self, IPublishTraverse)
             if adapter is None:
                 ## Zope2 doesn't set up its own adapters in a lot of cases
                 ## so we will just use a default adapter.
@@ -427,6 +430,12 @@ class BaseRequest:
         # Set the posttraverse for duration of the traversal here
         self._post_traverse = post_traverse = []
 
+        cache = traversalcache.cache
+        if cache is not None:
+            chain = cache.start(object)
+        else:
+            chain = None
+
         entry_name = ''
         try:
             # We build parents in the wrong order, so we
@@ -462,8 +471,8 @@ class BaseRequest:
                     if IBrowserPublisher.providedBy(object):
                         adapter = object
                     else:
-                        adapter = queryMultiAdapter((object, self),
-                                                    IBrowserPublisher)
+                        adapter = queryAdapter(object, self,
+                                               IBrowserPublisher)
                         if adapter is None:
                             # Zope2 doesn't set up its own adapters in a lot
                             # of cases so we will just use a default adapter.
@@ -498,16 +507,28 @@ class BaseRequest:
                 request['URL'] = URL = '%s/%s' % (request['URL'], step)
 
                 try:
-                    subobject = self.traverseName(object, entry_name)
-                    if (hasattr(object,'__bobo_traverse__') or
-                        hasattr(object, entry_name)):
-                        check_name = entry_name
+                    if chain is not None:
+                        key = cache.key(self, chain, entry_name)
+                        found = cache.lookup(key, object)
                     else:
-                        check_name = None
-
-                    self.roles = getRoles(
-                        object, check_name, subobject,
-                        self.roles)
+                        found = None
+                    if found is not None:
+                        subobject, self.roles, chain = found
+                    else:
+                        subobject = self.traverseName(object, entry_name)
+                        if (hasattr(object,'__bobo_traverse__') or
+                            hasattr(object, entry_name)):
+                            check_name = entry_name
+                        else:
+                            check_name = None
+
+                        self.roles = getRoles(
+                            object, check_name, subobject,
+                            self.roles)
+                        if chain is not None:
+                            chain = cache.record(self, key, object,
+                                                 entry_name, subobject,
+                                                 self.roles)
                     object = subobject
                 # traverseName() might raise ZTK's NotFound
                 except (KeyError, AttributeError, ztkNotFound):
@@ -0,0 +1,170 @@
+##############################################################################
+#
+# Copyright (c) 2010 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""HTTP conditional request support.
+
+Published objects that know the version of their content describe it with
+an entity tag and a modification time, and call handleConditional before
+producing the body.  It evaluates the If-Match, If-Unmodified-Since,
+If-None-Match and If-Modified-Since headers in the order RFC 7232 asks
+for, and sets up a '304 Not Modified' or '412 Precondition Failed'
+response if the body is not to be sent.  ifRangeMatches evaluates the
+If-Range header of range requests.
+
+For an implementation example, see the File class in OFS/Image.py.
+"""
+
+from binascii import hexlify
+from hashlib import md5
+from rfc822 import mktime_tz
+from rfc822 import parsedate_tz
+
+from Acquisition import aq_base
+from DateTime.DateTime import DateTime
+
+# The suffix of the entity tags of gzip encoded variants.
+GZIP_SUFFIX = '-gzip'
+
+
+def serialETag(ob):
+    """Return a strong entity tag for the state of a persistent object.
+
+    Returns None if the object has no committed state or was changed in
+    the current transaction.
+    """
+    base = aq_base(ob)
+    if getattr(base, '_p_jar', None) is None or base._p_changed:
+        return None
+    return '"%s"' % hexlify(base._p_serial)
+
+
+def contentETag(data):
+    """Return a strong entity tag for a body, computed from its content."""
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return '"%s"' % md5(data).hexdigest()
+
+
+def gzipETag(etag):
+    """Return the entity tag of the gzip encoded variant of an entity."""
+    if etag is None:
+        return None
+    return '%s%s"' % (etag[:-1], GZIP_SUFFIX)
+
+
+def parseHTTPDate(value):
+    """Return the time stamp of an HTTP date, or None if it is invalid."""
+    value = value.split(';')[0].strip()
+    parsed = parsedate_tz(value)
+    if parsed is not None:
+        try:
+            return mktime_tz(parsed)
+        except (OverflowError, ValueError):
+            return None
+    # Some proxies seem to send invalid date strings. Dates that DateTime
+    # understands are accepted, other invalid dates are ignored, as RFC
+    # 2616 asks.
+    try:
+        return DateTime(value).timeTime()
+    except Exception:
+        return None
+
+
+def matchETag(header, etag, weak=True):
+    """Return true if etag matches the list of entity tags in header.
+
+    With the weak comparison, weak tags match as well, and the tags of
+    gzip encoded variants match the tag of the original entity.
+    """
+    header = header.strip()
+    if header == '*':
+        return True
+    if etag is None:
+        return False
+    if weak and etag.endswith(GZIP_SUFFIX + '"'):
+        etag = etag[:-len(GZIP_SUFFIX) - 1] + '"'
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if weak and tag.endswith(GZIP_SUFFIX + '"'):
+            tag = tag[:-len(GZIP_SUFFIX) - 1] + '"'
+        if tag == etag:
+            return True
+    return False
+
+
+def handleConditional(request, response, etag=None, last_modified=None):
+    """Evaluate the conditional request headers for an entity.
+
+    etag is the entity tag and last_modified the modification time of the
+    entity, either may be None if unknown.  Returns true if the status of
+    the response was set to 304 or 412, in which case no body is to be
+    sent.
+    """
+    get_header = request.get_header
+    header = get_header('If-Match', None)
+    if header is not None:
+        if not matchETag(header, etag, weak=False):
+            response.setStatus(412)
+            return True
+    elif last_modified:
+        header = get_header('If-Unmodified-Since', None)
+        if header is not None:
+            since = parseHTTPDate(header)
+            if since is not None and long(last_modified) > since:
+                response.setStatus(412)
+                return True
+
+    method = request.get('REQUEST_METHOD', 'GET')
+    header = get_header('If-None-Match', None)
+    if header is not None:
+        if matchETag(header, etag):
+            if method in ('GET', 'HEAD'):
+                response.setStatus(304)
+            else:
+                response.setStatus(412)
+            return True
+        # If-Modified-Since is to be ignored if If-None-Match is sent
+        return False
+
+    if last_modified and method in ('GET', 'HEAD'):
+        header = get_header('If-Modified-Since', None)
+        if header is not None:
+            since = parseHTTPDate(header)
+            if since is not None and long(last_modified) <= since:
+                response.setStatus(304)
+                return True
+    return False
+
+
+def ifRangeMatches(request, etag=None, last_modified=None):
+    """Return true if a range request may be served partially.
+
+    This is the case if the request has no If-Range header or if the
+    entity matches the entity tag or date given in it.  Invalid dates are
+    ignored, like invalid If-Modified-Since dates.
+    """
+    header = request.get_header('If-Range', None)
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        return matchETag(header, etag, weak=False)
+    since = parseHTTPDate(header)
+    if since is None:
+        return True
+    if not last_modified:
+        return False
+    return long(last_modified) <= since
@@ -114,6 +114,65 @@ def expandRanges(ranges, size):
 
     return expanded
 
+def coalesceRanges(ranges):
+    """Merge overlapping and adjacent expanded Range sets.
+
+    Sets that are not merged keep the order in which they were requested, a
+    merged set takes the place of the first of its sets.
+
+    """
+
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i])
+    merged = []
+    for i in order:
+        start, end = ranges[i]
+        if merged and start <= merged[-1][2]:
+            last = merged[-1]
+            merged[-1] = (min(last[0], i), last[1], max(last[2], end))
+        else:
+            merged.append((i, start, end))
+    merged.sort()
+    return [(start, end) for i, start, end in merged]
+
+class MultipartByteranges:
+    """The body of a multipart/byteranges response.
+
+    The headers of the parts are assembled upfront, so that the length of
+    the body is known before any data is read.
+
+    """
+
+    def __init__(self, ranges, size, content_type, boundary):
+        self.ranges = ranges
+        self.boundary = boundary
+        self.headers = [
+            '\r\n--%s\r\nContent-Type: %s\r\n'
+            'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                boundary, content_type, start, end - 1, size)
+            for start, end in ranges]
+        self.trailer = '\r\n--%s--\r\n' % boundary
+
+    def __len__(self):
+        length = len(self.trailer)
+        for header in self.headers:
+            length = length + len(header)
+        for start, end in self.ranges:
+            length = length + end - start
+        return length
+
+    def parts(self, read):
+        """Generate the body.
+
+        read(start, end) returns an iterable of the strings making up the
+        data from start to end.
+
+        """
+        for header, (start, end) in zip(self.headers, self.ranges):
+            yield header
+            for data in read(start, end):
+                yield data
+        yield self.trailer
+
 class HTTPRangeInterface(Interface):
     """Objects implementing this Interface support the HTTP Range header.
 
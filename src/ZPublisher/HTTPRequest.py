@@ -40,6 +40,9 @@ from AccessControl.tainted import TaintedString
 from ZPublisher.BaseRequest import BaseRequest
 from ZPublisher.BaseRequest import quote
 from ZPublisher.Converters import get_converter
+from ZPublisher.Converters import type_converters
+from ZPublisher.multipart import parseFields
+from ZPublisher.multipart import parseInputs
 
 # Flags
 SEQUENCE = 1
@@ -100,6 +103,16 @@ _marker = []
 
 trusted_proxies = []
 
+# When lazy_inputs is set, processInputs leaves the query string and
+# request body alone until the form, the body or a form variable is
+# first looked up.  Requests that may change the published method or
+# the response (form submissions, ':method' query string variables,
+# XML-RPC and SOAP requests) are still processed right away.
+# The ZConfig machinery sets this from the lazy-form-parsing directive.
+lazy_inputs = False
+
+search_method = re.compile(':(default_)?(method|action)($|[:=&])').search
+
 class NestedLoopExit(Exception):
     pass
 
@@ -163,7 +176,10 @@ class HTTPRequest(BaseRequest):
     _hacked_path = None
     args = ()
     _file = None
+    _fieldstorage = None
     _urls = ()
+    _inputs_pending = False
+    _decode_inputs = False
 
     retry_max_count = 3
 
@@ -175,8 +191,13 @@ class HTTPRequest(BaseRequest):
     def retry(self):
         self.retry_count = self.retry_count + 1
         self.stdin.seek(0)
+        environ = self._orig_env
+        if self._fieldstorage is not None:
+            # The body was parsed while it arrived and is not in stdin.
+            environ = environ.copy()
+            environ['zope.fieldstorage'] = self._fieldstorage
         r = self.__class__(stdin=self.stdin,
-                           environ=self._orig_env,
+                           environ=environ,
                            response=self.response.retry(),
                           )
         r.retry_count = self.retry_count
@@ -187,6 +208,11 @@ class HTTPRequest(BaseRequest):
         # removing tempfiles.
         self.stdin = None
         self._file = None
+        self._fieldstorage = None
+        if self._inputs_pending:
+            self._inputs_pending = False
+            self.form = {}
+            self.taintedform = {}
         self.form.clear()
         # we want to clear the lazy dict here because BaseRequests don't have
         # one.  Without this, there's the possibility of memory leaking
@@ -449,7 +475,45 @@ class HTTPRequest(BaseRequest):
         self.cookies = cookies
         self.taintedcookies = taintedcookies
 
-    def processInputs(
+    def processInputs(self):
+        """Process request inputs
+
+        We need to delay input parsing so that it is done under
+        publisher control for error handling purposes.
+        """
+        if lazy_inputs and not self._needsInputs():
+            del self.form
+            del self.taintedform
+            self._inputs_pending = True
+        else:
+            self._processInputs()
+
+    def _needsInputs(self):
+        # Do the inputs affect the traversal or the response?
+        environ = self.environ
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method in ('GET', 'HEAD'):
+            return search_method(unquote(environ.get('QUERY_STRING', '')))
+        if 'HTTP_SOAPACTION' in environ:
+            return True
+        content_type = environ.get('CONTENT_TYPE')
+        if content_type is None:
+            return method == 'POST'
+        content_type = content_type.lower()
+        return (content_type.startswith('application/x-www-form-urlencoded')
+                or content_type.startswith('multipart/')
+                or (method == 'POST' and 'text/xml' in content_type))
+
+    def _loadInputs(self):
+        # Process inputs left alone by processInputs in lazy mode.
+        self._inputs_pending = False
+        self.form = {}
+        self.taintedform = {}
+        self._processInputs()
+        if self._decode_inputs:
+            self.postProcessInputs()
+
+    def _processInputs(
         self,
         # "static" variables that we want to be local for speed
         SEQUENCE=1,
@@ -462,13 +526,7 @@ class HTTPRequest(BaseRequest):
         hasattr=hasattr,
         getattr=getattr,
         setattr=setattr,
-        search_type=re.compile('(:[a-zA-Z][-a-zA-Z0-9_]+|\\.[xy])$').search,
         ):
-        """Process request inputs
-
-        We need to delay input parsing so that it is done under
-        publisher control for error handling purposes.
-        """
         response = self.response
         environ = self.environ
         method = environ.get('REQUEST_METHOD','GET')
@@ -482,15 +540,34 @@ class HTTPRequest(BaseRequest):
         other = self.other
         taintedform = self.taintedform
 
-        # If 'QUERY_STRING' is not present in environ
-        # FieldStorage will try to get it from sys.argv[1]
-        # which is not what we need.
         if 'QUERY_STRING' not in environ:
             environ['QUERY_STRING'] = ''
 
         meth = None
-        fs = ZopeFieldStorage(fp=fp,environ=environ,keep_blank_values=1)
-        if not hasattr(fs,'list') or fs.list is None:
+        # The server may have parsed or spooled the body already, while
+        # it was arriving.
+        fs = environ.pop('zope.fieldstorage', None)
+        if fs is None:
+            fs = parseInputs(fp, environ)
+            fslist = getattr(fs, 'list', None)
+        else:
+            # It is used only once; a retried request is passed the same
+            # result again (see retry).  Leave it unchanged and read its
+            # files from the start.
+            self._orig_env.pop('zope.fieldstorage', None)
+            self._fieldstorage = fs
+            fslist = fs.list
+            if fslist is None:
+                if fs.file is not None:
+                    fs.file.seek(0)
+            else:
+                for item in fslist:
+                    if item.file is not None:
+                        item.file.seek(0)
+                if environ['QUERY_STRING']:
+                    # parseInputs does this for multipart forms, too
+                    fslist = parseFields(environ['QUERY_STRING']) + fslist
+        if fslist is None:
             if 'HTTP_SOAPACTION' in environ:
                 # Stash XML request for interpretation by a SOAP-aware view
                 other['SOAPXML'] = fs.value
@@ -509,13 +586,11 @@ class HTTPRequest(BaseRequest):
             else:
                 self._file = fs.file
         else:
-            fslist = fs.list
             tuple_items = {}
             lt = type([])
             CGI_name = isCGI_NAMEs
             defaults = {}
             tainteddefaults = {}
-            converter = None
 
             for item in fslist:
 
@@ -533,75 +608,24 @@ class HTTPRequest(BaseRequest):
                     else:
                         item = item.value
 
-                flags = 0
-                character_encoding = ''
                 # Variables for potentially unsafe values.
                 tainted = None
-                converter_type = None
-
-                # Loop through the different types and set
-                # the appropriate flags
-
-                # We'll search from the back to the front.
-                # We'll do the search in two steps.  First, we'll
-                # do a string search, and then we'll check it with
-                # a re search.
 
-
-                l = key.rfind(':')
-                if l >= 0:
-                    mo = search_type(key,l)
-                    if mo:
-                        l = mo.start(0)
-                    else:
-                        l = -1
-
-                    while l >= 0:
-                        type_name = key[l+1:]
-                        key = key[:l]
-                        c = get_converter(type_name, None)
-
-                        if c is not None:
-                            converter = c
-                            converter_type = type_name
-                            flags = flags | CONVERTED
-                        elif type_name == 'list':
-                            flags = flags | SEQUENCE
-                        elif type_name == 'tuple':
-                            tuple_items[key] = 1
-                            flags = flags | SEQUENCE
-                        elif (type_name == 'method' or type_name == 'action'):
-                            if l:
-                                meth = key
-                            else:
-                                meth = item
-                        elif (type_name == 'default_method' or type_name == \
-                              'default_action'):
-                            if not meth:
-                                if l:
-                                    meth = key
-                                else:
-                                    meth = item
-                        elif type_name == 'default':
-                            flags = flags | DEFAULT
-                        elif type_name == 'record':
-                            flags = flags | RECORD
-                        elif type_name == 'records':
-                            flags = flags | RECORDS
-                        elif type_name == 'ignore_empty':
-                            if not item:
-                                flags = flags | EMPTY
-                        elif has_codec(type_name):
-                            character_encoding = type_name
-
-                        l = key.rfind(':')
-                        if l < 0:
-                            break
-                        mo = search_type(key,l)
-                        if mo:
-                            l = mo.start(0)
+                # Split the type suffixes off the name.  Parsing them is
+                # done once per distinct name, see FieldPlanCache.
+                (key, flags, converter_type, character_encoding,
+                 tuple_keys, methods, ignore_empty) = field_plans.get(key)
+
+                for k in tuple_keys:
+                    tuple_items[k] = 1
+                for default, name in methods:
+                    if not default or not meth:
+                        if name is None:
+                            meth = item
                         else:
-                            l = -1
+                            meth = name
+                if ignore_empty and not item:
+                    flags = flags | EMPTY
 
                 # Filter out special names from form:
                 if key in CGI_name or key[:5] == 'HTTP_':
@@ -636,6 +660,9 @@ class HTTPRequest(BaseRequest):
 
                     # defer conversion
                     if flags & CONVERTED:
+                        # Plans keep the name of the converter, so that
+                        # replacing a converter takes effect at once.
+                        converter = type_converters[converter_type]
                         try:
                             if character_encoding:
                                 # We have a string with a specified character
@@ -1152,6 +1179,9 @@ class HTTPRequest(BaseRequest):
     def postProcessInputs(self):
         """Process the values in request.form to decode strings to unicode.
         """
+        if self._inputs_pending:
+            self._decode_inputs = True
+            return
         for name, value in self.form.iteritems():
             self.form[name] = _decode(value, default_encoding)
 
@@ -1316,6 +1346,9 @@ class HTTPRequest(BaseRequest):
                     self._urls = self._urls + (key,)
                 return URL
 
+            if key in ('BODY', 'BODYFILE') and self._inputs_pending:
+                self._loadInputs()
+
             if key == 'BODY' and self._file is not None:
                 p = self._file.tell()
                 self._file.seek(0)
@@ -1380,6 +1413,9 @@ class HTTPRequest(BaseRequest):
     # is discouraged and is likely to be deprecated in the future.
     # request.get(key) or request[key] should be used instead
     def __getattr__(self, key, default=_marker, returnTaints=0):
+        if key in ('form', 'taintedform') and self._inputs_pending:
+            self._loadInputs()
+            return self.__dict__[key]
         v = self.get(key, default, returnTaints=returnTaints)
         if v is _marker:
             if key == 'locale':
@@ -1571,6 +1607,123 @@ def has_codec(x):
         return 1
 
 
+search_type = re.compile('(:[a-zA-Z][-a-zA-Z0-9_]+|\\.[xy])$').search
+
+
+def compileFieldPlan(name):
+    """Parse the type suffixes of a form field name.
+
+    Returns a tuple of the base key, the flags, the name of the converter,
+    the character encoding, the keys to convert to tuples, the method
+    suffixes and whether the field is to be ignored if empty.  The method
+    suffixes are (default, name) pairs in the order they apply, with name
+    None if the method is the value of the field.
+    """
+    key = name
+    flags = 0
+    converter_type = None
+    character_encoding = ''
+    tuple_keys = []
+    methods = []
+    ignore_empty = False
+
+    # Suffixes are processed from the back to the front.
+    l = key.rfind(':')
+    if l >= 0:
+        mo = search_type(key, l)
+        if mo:
+            l = mo.start(0)
+        else:
+            l = -1
+
+        while l >= 0:
+            type_name = key[l+1:]
+            key = key[:l]
+            if get_converter(type_name, None) is not None:
+                converter_type = type_name
+                flags = flags | CONVERTED
+            elif type_name == 'list':
+                flags = flags | SEQUENCE
+            elif type_name == 'tuple':
+                tuple_keys.append(key)
+                flags = flags | SEQUENCE
+            elif type_name == 'method' or type_name == 'action':
+                methods.append((False, l and key or None))
+            elif (type_name == 'default_method' or
+                  type_name == 'default_action'):
+                methods.append((True, l and key or None))
+            elif type_name == 'default':
+                flags = flags | DEFAULT
+            elif type_name == 'record':
+                flags = flags | RECORD
+            elif type_name == 'records':
+                flags = flags | RECORDS
+            elif type_name == 'ignore_empty':
+                ignore_empty = True
+            elif has_codec(type_name):
+                character_encoding = type_name
+
+            l = key.rfind(':')
+            if l < 0:
+                break
+            mo = search_type(key, l)
+            if mo:
+                l = mo.start(0)
+            else:
+                l = -1
+
+    return (key, flags, converter_type, character_encoding,
+            tuple(tuple_keys), tuple(methods), ignore_empty)
+
+
+class FieldPlanCache(object):
+    """Bounded cache of compiled form field names.
+
+    Forms are submitted over and over with the same field names, so the
+    result of compileFieldPlan is kept per name.  The cache is emptied
+    when it is full and when converters are added to or removed from
+    ZPublisher.Converters.type_converters.  Plans refer to converters by
+    name, so replaced converters need no invalidation.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._plans = {}
+        self._converters = len(type_converters)
+        self.hits = self.misses = 0
+
+    def get(self, name):
+        if len(type_converters) != self._converters:
+            self.clear()
+        plan = self._plans.get(name)
+        if plan is not None:
+            self.hits += 1
+            return plan
+        self.misses += 1
+        plan = compileFieldPlan(name)
+        if self.max_entries:
+            if len(self._plans) >= self.max_entries:
+                self._plans = {}
+            self._plans[name] = plan
+        return plan
+
+    def clear(self):
+        self._plans = {}
+        self._converters = len(type_converters)
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._plans),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': total and float(self.hits) / total or 0.0,
+            }
+
+field_plans = FieldPlanCache()
+
+
 def sane_environment(env):
     # return an environment mapping which has been cleaned of
     # funny business such as REDIRECT_ prefixes added by Apache
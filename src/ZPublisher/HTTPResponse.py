@@ -128,11 +128,51 @@ otherTypes = os.environ.get('DONT_GZIP_MAJOR_MIME_TYPES','').lower()
 if otherTypes:
     uncompressableMimeMajorTypes += tuple(otherTypes.split(','))
 
+# Compression level and minimum size of gzip encoded responses.
+# The ZConfig machinery sets these from the http-compression-level and
+# http-compression-min-size directives.
+compression_level = 6
+compression_min_size = 0
+
 _CRLF = re.compile(r'\r[\n]?')
 
 def _scrubHeader(name, value):
     return ''.join(_CRLF.split(str(name))), ''.join(_CRLF.split(str(value)))
 
+
+class GzipEncoder(object):
+    """Incremental gzip encoding of a response body.
+
+    Data passed to compress is compressed as it comes in, so that neither
+    the uncompressed nor the compressed body have to be held in memory at
+    once.  finish returns the end of the gzip stream.
+    """
+
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            -zlib.MAX_WBITS,
+                                            zlib.DEF_MEM_LEVEL, 0)
+        self._crc = zlib.crc32('')
+        self._size = 0
+        self._header = _gzip_header
+
+    def compress(self, data, flush=False):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        data = self._compressor.compress(data)
+        if flush:
+            data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self._header:
+            data = self._header + data
+            self._header = ''
+        return data
+
+    def finish(self):
+        data = self._header + self._compressor.flush()
+        self._header = ''
+        return data + struct.pack('<LL', self._crc & 0xffffffffL,
+                                  self._size & 0xffffffffL)
+
 class HTTPResponse(BaseResponse):
     """ An object representation of an HTTP response.
 
@@ -514,36 +554,83 @@ class HTTPResponse(BaseResponse):
         self.insertBase()
 
         if self.use_HTTP_content_compression and \
-            self.headers.get('content-encoding', 'gzip') == 'gzip':
+            'content-encoding' not in self.headers:
             # use HTTP content encoding to compress body contents unless
             # this response already has another type of content encoding
-            if content_type.split('/')[0] not in uncompressableMimeMajorTypes:
+            if (content_type.split('/')[0] not in uncompressableMimeMajorTypes
+                and len(self.body) >= compression_min_size):
                 # only compress if not listed as uncompressable
                 body = self.body
-                startlen = len(body)
-                co = zlib.compressobj(6,zlib.DEFLATED,-zlib.MAX_WBITS,
-                                      zlib.DEF_MEM_LEVEL,0)
-                chunks = [_gzip_header, co.compress(body),
-                          co.flush(),
-                          struct.pack("<ll",zlib.crc32(body),startlen)]
-                z = "".join(chunks)
+                encoder = GzipEncoder(compression_level)
+                z = encoder.compress(body) + encoder.finish()
                 newlen = len(z)
-                if newlen < startlen:
+                if newlen < len(body):
                     self.body = z
                     self.setHeader('content-length', newlen)
                     self.setHeader('content-encoding','gzip')
-                    if self.use_HTTP_content_compression == 1:
-                        # use_HTTP_content_compression == 1 if force was
-                        # NOT used in enableHTTPCompression().
-                        # If we forced it, then Accept-Encoding
-                        # was ignored anyway, so cache should not
-                        # vary on it. Otherwise if not forced, cache should
-                        # respect Accept-Encoding client header
-                        vary = self.getHeader('Vary')
-                        if vary is None or 'Accept-Encoding' not in vary: 
-                            self.appendHeader('Vary', 'Accept-Encoding')
+                    self._varyOnAcceptEncoding()
         return self
 
+    def _varyOnAcceptEncoding(self):
+        if self.use_HTTP_content_compression == 1:
+            # use_HTTP_content_compression == 1 if force was
+            # NOT used in enableHTTPCompression().
+            # If we forced it, then Accept-Encoding
+            # was ignored anyway, so cache should not
+            # vary on it. Otherwise if not forced, cache should
+            # respect Accept-Encoding client header
+            vary = self.getHeader('Vary')
+            if vary is None or 'Accept-Encoding' not in vary:
+                self.appendHeader('Vary', 'Accept-Encoding')
+
+    _gzip = None
+
+    def _startCompression(self):
+        """Set up compression of streamed output.
+
+        Called before the headers of a streamed response are sent.
+        Returns true if the data passed to write is to be compressed,
+        in which case any content-length header has been removed.
+        """
+        headers = self.headers
+        if not self.use_HTTP_content_compression or \
+            'content-encoding' in headers:
+            return False
+        content_type = headers.get('content-type', '')
+        if content_type.split('/')[0] in uncompressableMimeMajorTypes:
+            return False
+        length = headers.get('content-length')
+        if length is not None:
+            try:
+                if int(length) < compression_min_size:
+                    return False
+            except ValueError:
+                pass
+            del headers['content-length']
+        self._gzip = GzipEncoder(compression_level)
+        self.setHeader('content-encoding', 'gzip')
+        self._varyOnAcceptEncoding()
+        return True
+
+    def _compressStream(self, data):
+        """Compress streamed data if compression was set up.
+
+        The compressed data is flushed, so that clients can show it
+        right away.
+        """
+        if self._gzip is None:
+            return data
+        return self._gzip.compress(data, flush=True)
+
+    def _endStream(self, data=''):
+        """Return the end of a compressed stream, preceded by data.
+        """
+        encoder = self._gzip
+        if encoder is None:
+            return data
+        self._gzip = None
+        return encoder.compress(data) + encoder.finish()
+
     def enableHTTPCompression(self, REQUEST={}, force=0, disable=0, query=0):
         """Enable HTTP Content Encoding with gzip compression if possible
 
@@ -573,7 +660,8 @@ class HTTPResponse(BaseResponse):
            has been previously requested.
 
            In setBody, the major mime type is used to determine if content
-           encoding should actually be performed.
+           encoding should actually be performed.  Output streamed with
+           write is compressed as well by ZServer and WSGI responses.
 
            By default, image types are not compressed.
            Additional major mime types can be specified by setting the
@@ -53,3 +53,55 @@ class filestream_iterator(file):
         self.seek(cur_pos, 0)
     
         return size
+
+
+class byterange_iterator(object):
+    """
+    an iterator over the multipart/byteranges body of a range request.
+
+    'body' is a ZPublisher.HTTPRangeSupport.MultipartByteranges object,
+    'read' returns the data of a range as an iterable of strings (it must
+    not read from the object database).  'close' is called when the body
+    has been read.
+    """
+
+    implements(IStreamIterator)
+
+    def __init__(self, body, read, close=None):
+        self._length = len(body)
+        self._parts = body.parts(read)
+        self._close = close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        for data in self._parts:
+            if data:
+                return data
+        self.close()
+        raise StopIteration
+
+    def __len__(self):
+        return self._length
+
+    def close(self):
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+
+
+def file_range_reader(file, streamsize=1<<16):
+    """
+    return a function reading ranges of an open file in chunks of at most
+    streamsize bytes, for byterange_iterator.
+    """
+    def read(start, end):
+        file.seek(start)
+        while start < end:
+            data = file.read(min(streamsize, end - start))
+            if not data:
+                break
+            start = start + len(data)
+            yield data
+    return read
@@ -44,12 +44,16 @@ class WSGIResponse(HTTPResponse):
     This Response object knows nothing about ZServer, but tries to be
     compatible with the ZServerHTTPResponse.
 
-    Most significantly, streaming is not (yet) supported.
+    Data passed to 'write' is streamed to the WSGI server as it is
+    produced if the response was given the server's 'start_response'
+    callable.  Otherwise it is buffered in 'stdout'.
     """
     _streaming = _chunking = 0
     _http_version = None
     _server_version = None
     _http_connection = None
+    _start_response = None
+    _wsgi_write = None
 
     # Set this value to 1 if streaming output in
     # HTTP/1.1 should use chunked encoding
@@ -124,17 +128,36 @@ class WSGIResponse(HTTPResponse):
             notify(PubBeforeStreaming(self))
             
             self._streaming = 1
+            self._startCompression()
             self.stdout.flush()
 
-        self.stdout.write(data)
+            if self._start_response is not None:
+                # Send the headers now, so that the data can go out
+                # right away instead of piling up in stdout.
+                status, headers = self.finalize()
+                self._wsgi_write = self._start_response(status, headers)
+
+        data = self._compressStream(data)
+        if self._wsgi_write is not None:
+            self._wsgi_write(data)
+        else:
+            self.stdout.write(data)
+
+    def headersSent(self):
+        """Return true if the status and headers went out already
+        """
+        return self._wsgi_write is not None
 
     def setBody(self, body, title='', is_error=0):
-        if isinstance(body, file) or IStreamIterator.providedBy(body):
+        if isinstance(body, file):
             body.seek(0, 2)
             length = body.tell()
             body.seek(0)
             self.setHeader('Content-Length', '%d' % length)
             self.body = body
+        elif IStreamIterator.providedBy(body):
+            self.setHeader('Content-Length', '%d' % len(body))
+            self.body = body
         else:
             HTTPResponse.setBody(self, body, title, is_error)
 
@@ -238,8 +261,9 @@ def publish_module(environ, start_response,
     stderr = StringIO()
     response = _response_factory(stdout=stdout, stderr=stderr)
     response._http_version = environ['SERVER_PROTOCOL'].split('/')[1]
-    response._http_connection = environ.get('CONNECTION_TYPE', 'close')
+    response._http_connection = environ.get('CONNECTION_TYPE', '').lower()
     response._server_version = environ.get('SERVER_SOFTWARE')
+    response._start_response = start_response
 
     request = _request_factory(environ['wsgi.input'], environ, response)
 
@@ -258,19 +282,27 @@ def publish_module(environ, start_response,
     except Redirect, v:
         response.redirect(v)
 
-    # Start the WSGI server response
-    status, headers = response.finalize()
-    start_response(status, headers)
-
     body = response.body
-
-    if isinstance(body, file) or IStreamIterator.providedBy(body):
-        result = body
+    if getattr(response, '_gzip', None) is not None:
+        # Streamed output was compressed, finish the stream
+        body = response._endStream(body)
+
+    if getattr(response, 'headersSent', lambda: False)():
+        # The response was streamed with response.write, the server
+        # has been sent everything but the final body.
+        result = body and (body,) or ()
     else:
-        # If somebody used response.write, that data will be in the
-        # stdout StringIO, so we put that before the body.
-        # XXX This still needs verification that it really works.
-        result = (stdout.getvalue(), response.body)
+        # Start the WSGI server response
+        status, headers = response.finalize()
+        start_response(status, headers)
+
+        if isinstance(body, file) or IStreamIterator.providedBy(body):
+            result = body
+        else:
+            # If response.write was used without streaming, that data
+            # will be in the stdout StringIO, so we put that before
+            # the body.
+            result = (stdout.getvalue(), body)
 
     if 'repoze.tm.active' not in environ:
         request.close() # this aborts the transation!
@@ -0,0 +1,58 @@
+##############################################################################
+#
+# Copyright (c) 2010 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cached adapter lookups for publishing traversal.
+
+Traversal looks up the IPublishTraverse adapter of every object on the
+path and the IBrowserPublisher adapter and default view name of the
+published object.  The results of these lookups only depend on the
+interfaces provided by the object and the request, and on the current
+site manager.  They are remembered in a volatile attribute of the
+adapter registry, which is emptied when the registry or one of its
+bases changes.
+"""
+
+from zope.component import getSiteManager
+from zope.interface import providedBy
+
+# The number of lookups remembered per registry.  0 disables the cache.
+CACHE_SIZE = 1000
+
+_marker = object()
+
+
+def lookup(ob, request, provided, name=u''):
+    """Return the component registered for ob and request, or None."""
+    adapters = getSiteManager().adapters
+    required = (providedBy(ob), providedBy(request))
+    if not CACHE_SIZE:
+        return adapters.lookup(required, provided, name)
+    generations = [r._generation for r in adapters.ro]
+    cache = getattr(adapters, '_v_publisher_lookups', None)
+    if cache is None or cache[0] != generations:
+        cache = adapters._v_publisher_lookups = (generations, {})
+    lookups = cache[1]
+    key = required + (provided, name)
+    value = lookups.get(key, _marker)
+    if value is _marker:
+        if len(lookups) >= CACHE_SIZE:
+            lookups.clear()
+        value = lookups[key] = adapters.lookup(required, provided, name)
+    return value
+
+
+def queryAdapter(ob, request, provided, name=u''):
+    """Adapt ob and request to provided like queryMultiAdapter."""
+    factory = lookup(ob, request, provided, name)
+    if factory is None:
+        return None
+    return factory(ob, request)
@@ -0,0 +1,374 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""Incremental parsing of request bodies
+
+HTTPRequest.processInputs uses 'parseInputs' to read the query string
+and the request body.  Form bodies are read in chunks and fed to a
+'MultipartParser' or 'UrlencodedParser', other bodies are copied to a
+'SpooledBody'.  The results look like a cgi.FieldStorage to
+processInputs.
+
+Servers that receive a request body in pieces can feed the pieces to
+a parser as they arrive, instead of spooling the raw body and having it
+parsed a second time.  processInputs uses the result when it is passed
+in the 'zope.fieldstorage' key of the request environment.
+"""
+
+import cgi
+import tempfile
+from cgi import MiniFieldStorage
+from cgi import parse_header
+from cgi import valid_boundary
+from cStringIO import StringIO
+from rfc822 import Message
+from urlparse import parse_qsl
+
+# parts larger than this are spooled to a temporary file
+SPOOL_THRESHOLD = 1 << 16
+
+# file uploads larger than this are spooled, like with cgi.FieldStorage
+UPLOAD_SPOOL_THRESHOLD = 1000
+
+# refuse part headers larger than this
+MAX_HEADER_SIZE = 1 << 16
+
+# the request body is read in chunks of this size
+CHUNK_SIZE = 1 << 16
+
+PREAMBLE, HEADERS, BODY, EPILOGUE = range(4)
+
+
+def make_file():
+    return tempfile.NamedTemporaryFile('w+b')
+
+
+def parseFields(qs):
+    """Return the fields of an url-encoded string."""
+    return [MiniFieldStorage(key, value)
+            for key, value in parse_qsl(qs, keep_blank_values=1)]
+
+
+def parseInputs(fp, environ):
+    """Parse the query string and body of a request like cgi.FieldStorage
+
+    Returns an object with a 'list' of fields for forms, or a
+    'SpooledBody' with 'list' set to None for other bodies.  Bodies are
+    only read for methods other than GET and HEAD.
+    """
+    method = environ.get('REQUEST_METHOD', 'GET').upper()
+    qs = environ.get('QUERY_STRING', '')
+    if method in ('GET', 'HEAD') or fp is None:
+        parser = UrlencodedParser()
+        parser.list = parseFields(qs)
+        return parser
+
+    if 'CONTENT_TYPE' in environ:
+        content_type = environ['CONTENT_TYPE']
+    elif method == 'POST':
+        content_type = 'application/x-www-form-urlencoded'
+    else:
+        content_type = 'text/plain'
+    length = environ.get('CONTENT_LENGTH')
+    if length:
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if cgi.maxlen and length > cgi.maxlen:
+            raise ValueError('Maximum content length exceeded')
+    else:
+        length = -1
+
+    ctype = content_type.split(';', 1)[0].strip().lower()
+    if ctype == 'application/x-www-form-urlencoded':
+        parser = UrlencodedParser(content_type)
+        readInto(parser, fp, length)
+        parser.close()
+        parser.list.extend(parseFields(qs))
+        return parser
+    if ctype[:10] == 'multipart/':
+        parser = MultipartParser(content_type)
+        parser.list.extend(parseFields(qs))
+        readInto(parser, fp, length)
+        parser.close(strict=False)
+        return parser
+    body = Part()
+    readInto(body, fp, length)
+    body.done()
+    return SpooledBody(body.file, content_type)
+
+
+def readInto(target, fp, length=-1):
+    """Read up to length bytes from fp in chunks and feed them to target.
+
+    All of fp is read if length is negative.
+    """
+    while length:
+        if length < 0 or length > CHUNK_SIZE:
+            size = CHUNK_SIZE
+        else:
+            size = length
+        data = fp.read(size)
+        if not data:
+            break
+        target.write(data)
+        if length > 0:
+            length = length - len(data)
+
+
+def parseHeaders(header):
+    """Return a dictionary of the lower-cased names and values of header.
+    """
+    headers = {}
+    name = None
+    for line in header.splitlines():
+        if line[:1] in (' ', '\t'):
+            if name is not None:
+                headers[name] = '%s %s' % (headers[name], line.strip())
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            name = None
+            continue
+        name = name.strip().lower()
+        headers[name] = value.strip()
+    return headers
+
+
+class Part:
+    """A part of a multipart body, like a cgi.FieldStorage item
+
+    'header' is the text of the part headers.
+    """
+
+    _headers = None
+
+    def __init__(self, header=''):
+        self._header = header
+        fields = parseHeaders(header)
+        disposition, params = parse_header(
+            fields.get('content-disposition', ''))
+        self.disposition = disposition
+        self.disposition_options = params
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.type = fields.get('content-type', 'text/plain')
+        self.file = StringIO()
+        self._size = 0
+        self._spooled = False
+        if self.filename is not None:
+            self._threshold = UPLOAD_SPOOL_THRESHOLD
+        else:
+            self._threshold = SPOOL_THRESHOLD
+
+    def __repr__(self):
+        return '<%s %r %r>' % (self.__class__.__name__,
+                               self.name, self.filename)
+
+    @property
+    def headers(self):
+        # Most parts are form fields whose headers are never looked at.
+        if self._headers is None:
+            self._headers = Message(StringIO(self._header), 0)
+        return self._headers
+
+    def write(self, data):
+        file = self.file
+        self._size = self._size + len(data)
+        if self._size > self._threshold and not self._spooled:
+            self.file = make_file()
+            self.file.write(file.getvalue())
+            self._spooled = True
+            file = self.file
+        file.write(data)
+
+    def done(self):
+        self.file.flush()
+        self.file.seek(0)
+
+    @property
+    def value(self):
+        file = self.file
+        file.seek(0)
+        value = file.read()
+        file.seek(0)
+        return value
+
+
+class MultipartParser:
+    """Push parser for multipart/form-data bodies
+
+    Call 'feed' with the pieces of the body and 'close' at the end.
+    Parts with more than 'SPOOL_THRESHOLD' bytes are written to a
+    temporary file while they arrive, so memory use doesn't grow with
+    the size of the body.  'ValueError' is raised for malformed bodies.
+    Lines end with CRLF, or with LF if the first delimiter line does.
+    """
+
+    file = None
+    filename = None
+
+    def __init__(self, content_type):
+        ctype, params = parse_header(content_type)
+        boundary = params.get('boundary', '')
+        if ctype[:10] != 'multipart/' or not valid_boundary(boundary):
+            raise ValueError('Invalid boundary in multipart form: %r'
+                             % (boundary,))
+        self.headers = {'content-type': content_type}
+        self.list = []
+        self._boundary = '--' + boundary
+        self._delimiter = '\n' + self._boundary
+        self._eol = None
+        self._buffer = '\n'
+        self._state = PREAMBLE
+        self._part = None
+
+    def feed(self, data):
+        buf = self._buffer + data
+        delimiter = self._delimiter
+        while 1:
+            state = self._state
+            if state == BODY:
+                i = buf.find(delimiter)
+                if i < 0:
+                    # Keep what could be the start of a delimiter.
+                    keep = len(delimiter) - 1
+                    if len(buf) > keep:
+                        self._part.write(buf[:-keep])
+                        buf = buf[-keep:]
+                    break
+                self._part.write(buf[:i])
+                self._part.done()
+                self._part = None
+                buf = buf[i:]
+                self._state = PREAMBLE
+            elif state == PREAMBLE:
+                i = buf.find(delimiter)
+                if i < 0:
+                    buf = buf[-(len(delimiter) - 1):]
+                    break
+                end = i + len(delimiter)
+                if len(buf) < end + 2:
+                    buf = buf[i:]
+                    break
+                if buf[end:end + 2] == '--':
+                    self._state = EPILOGUE
+                    buf = ''
+                    break
+                if self._eol is None:
+                    # The first delimiter line tells the line ending.
+                    j = buf.find('\n', end)
+                    if j < 0:
+                        if len(buf) > MAX_HEADER_SIZE:
+                            raise ValueError('Part headers too long')
+                        buf = buf[i:]
+                        break
+                    if buf[j - 1] == '\r':
+                        self._eol = '\r\n'
+                    else:
+                        self._eol = '\n'
+                    delimiter = self._delimiter = self._eol + self._boundary
+                buf = buf[end:]
+                self._state = HEADERS
+            elif state == HEADERS:
+                eol = self._eol
+                i = buf.find(eol + eol)
+                if i < 0:
+                    if len(buf) > MAX_HEADER_SIZE:
+                        raise ValueError('Part headers too long')
+                    break
+                # skip the rest of the delimiter line
+                header = buf[buf.find(eol) + len(eol):i + len(eol)]
+                part = self._part = Part(header)
+                self.list.append(part)
+                buf = buf[i + 2 * len(eol):]
+                self._state = BODY
+            else:
+                buf = ''
+                break
+        self._buffer = buf
+
+    write = feed
+
+    def close(self, strict=True):
+        """Finish parsing.
+
+        An incomplete body raises ValueError, unless strict is false;
+        then the last part ends with the data received, like with
+        cgi.FieldStorage.
+        """
+        if self._state != EPILOGUE:
+            if strict:
+                raise ValueError('Incomplete multipart body')
+            part = self._part
+            if part is not None:
+                data = self._buffer
+                if data.endswith(self._eol):
+                    data = data[:-len(self._eol)]
+                part.write(data)
+                part.done()
+                self._part = None
+            self._buffer = ''
+            self._state = EPILOGUE
+
+
+class UrlencodedParser:
+    """Push parser for application/x-www-form-urlencoded bodies
+
+    Fields are parsed as soon as the separator following them arrives.
+    """
+
+    file = None
+    filename = None
+
+    def __init__(self, content_type='application/x-www-form-urlencoded'):
+        self.headers = {'content-type': content_type}
+        self.list = []
+        self._pending = []
+
+    def feed(self, data):
+        i = max(data.rfind('&'), data.rfind(';'))
+        if i < 0:
+            self._pending.append(data)
+            return
+        self._pending.append(data[:i])
+        self.list.extend(parseFields(''.join(self._pending)))
+        self._pending = [data[i + 1:]]
+
+    write = feed
+
+    def close(self):
+        self.list.extend(parseFields(''.join(self._pending)))
+        self._pending = []
+
+
+class SpooledBody:
+    """A request body that is not a form, like a cgi.FieldStorage
+
+    The body has already been written to 'file' by the server.
+    """
+
+    list = None
+    filename = None
+
+    def __init__(self, file, content_type):
+        self.file = file
+        self.headers = {'content-type': content_type}
+
+    @property
+    def value(self):
+        file = self.file
+        file.seek(0)
+        value = file.read()
+        file.seek(0)
+        return value
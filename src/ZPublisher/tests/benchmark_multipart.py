@@ -0,0 +1,85 @@
+"""Compare the request body parsers.
+
+Parses typical form submissions and uploads with cgi.FieldStorage (as
+used by ZPublisher before) and with ZPublisher.multipart.parseInputs and
+prints the time per request::
+
+  python -m ZPublisher.tests.benchmark_multipart [repeat]
+"""
+
+import os
+import sys
+import time
+from cStringIO import StringIO
+from urllib import urlencode
+
+from ZPublisher.HTTPRequest import ZopeFieldStorage
+from ZPublisher.multipart import parseInputs
+
+BOUNDARY = '---------------------------7d91d1a2f0c1e'
+
+
+def multipart(fields, files=()):
+    lines = []
+    for name, value in fields:
+        lines.extend(['--' + BOUNDARY,
+                      'Content-Disposition: form-data; name="%s"' % name,
+                      '', value])
+    for name, data in files:
+        lines.extend(['--' + BOUNDARY,
+                      'Content-Disposition: form-data; name="%s"; '
+                      'filename="%s.bin"' % (name, name),
+                      'Content-Type: application/octet-stream',
+                      '', data])
+    lines.extend(['--' + BOUNDARY + '--', ''])
+    return ('multipart/form-data; boundary=' + BOUNDARY, '\r\n'.join(lines))
+
+
+def formFields(count):
+    fields = []
+    for i in range(count // 4):
+        fields.extend([('id:int', str(i)),
+                       ('items.title:records', 'Title %d' % i),
+                       ('items.tags:records:list', 'tag'),
+                       ('comment', 'Some text & more text ' * 3)])
+    return fields
+
+
+def corpora():
+    fields = formFields(1000)
+    binary = os.urandom(1 << 20)
+    yield ('url-encoded form, 1000 fields',
+           'application/x-www-form-urlencoded', urlencode(fields))
+    content_type, body = multipart(fields)
+    yield ('multipart form, 1000 fields', content_type, body)
+    content_type, body = multipart(
+        fields[:20], [('file%d' % i, binary[:100 << 10]) for i in range(20)])
+    yield ('multipart form, 20 uploads of 100KB', content_type, body)
+    content_type, body = multipart(fields[:4], [('file', binary * 16)])
+    yield ('multipart form, one 16MB upload', content_type, body)
+
+
+def timeParser(parser, content_type, body, repeat):
+    environ = {'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type,
+               'CONTENT_LENGTH': str(len(body)), 'QUERY_STRING': ''}
+    start = time.time()
+    for i in xrange(repeat):
+        parser(StringIO(body), environ.copy())
+    return (time.time() - start) / repeat * 1000
+
+
+def fieldStorage(fp, environ):
+    return ZopeFieldStorage(fp=fp, environ=environ, keep_blank_values=1)
+
+
+def main(args=sys.argv[1:]):
+    repeat = int(args and args[0] or 10)
+    print '%-40s %12s %12s' % ('', 'FieldStorage', 'parseInputs')
+    for title, content_type, body in corpora():
+        before = timeParser(fieldStorage, content_type, body, repeat)
+        after = timeParser(parseInputs, content_type, body, repeat)
+        print '%-40s %9.2f ms %9.2f ms' % (title, before, after)
+
+
+if __name__ == '__main__':
+    main()
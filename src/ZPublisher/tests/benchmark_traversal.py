@@ -0,0 +1,65 @@
+"""Measure the cost of publishing traversal per path segment.
+
+Traverses a path of nested folders with and without the adapter lookup
+cache of ZPublisher.lookup and prints the time spent per segment::
+
+  python -m ZPublisher.tests.benchmark_traversal [depth] [repeat]
+"""
+
+import sys
+import time
+
+from OFS.Application import Application
+from OFS.Folder import Folder
+from ZPublisher import lookup
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+
+def makeTree(depth):
+    app = Application()
+    folder = app
+    for i in range(depth):
+        folder._setObject('f', Folder('f'))
+        folder = folder.f
+    return app
+
+
+def traverse(app, path, repeat):
+    environ = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'REQUEST_METHOD': 'GET'}
+    start = time.time()
+    for i in xrange(repeat):
+        request = HTTPRequest(None, environ.copy(), HTTPResponse())
+        request['PARENTS'] = [app]
+        request.traverse(path)
+    return time.time() - start
+
+
+def perSegment(app, depth, repeat):
+    short = traverse(app, '/f', repeat)
+    deep = traverse(app, '/f' * depth, repeat)
+    return (deep - short) / (depth - 1) / repeat * 1e6
+
+
+def main(args=sys.argv[1:]):
+    depth = int(args and args[0] or 20)
+    repeat = int(args[1:] and args[1] or 2000)
+    app = makeTree(depth)
+    size = lookup.CACHE_SIZE
+    try:
+        lookup.CACHE_SIZE = 0
+        perSegment(app, depth, repeat // 10)  # warm up
+        before = perSegment(app, depth, repeat)
+    finally:
+        lookup.CACHE_SIZE = size
+    perSegment(app, depth, repeat // 10)
+    after = perSegment(app, depth, repeat)
+    print 'Traversal cost per segment (depth %d, %d requests):' % (
+        depth, repeat)
+    print '  without lookup cache: %6.2f usec' % before
+    print '  with lookup cache:    %6.2f usec' % after
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,8 @@
 
 import sys
 from ZPublisher.HTTPRangeSupport import parseRange, expandRanges
+from ZPublisher.HTTPRangeSupport import coalesceRanges
+from ZPublisher.HTTPRangeSupport import MultipartByteranges
 
 import unittest
 
@@ -121,10 +123,61 @@ class TestExpandRanges(unittest.TestCase):
         self.expectSets([(sys.maxint, None), (10, 20)], 50, [(10, 20)])
 
 
+class TestCoalesceRanges(unittest.TestCase):
+
+    def expectSets(self, sets, expect):
+        result = coalesceRanges(sets)
+        self.assertTrue(result == expect,
+            'Expected %s, got %s' % (`expect`, `result`))
+
+    def testNoOverlapInOrder(self):
+        self.expectSets([(1, 5), (1000, 2000), (3000, 5000)],
+            [(1, 5), (1000, 2000), (3000, 5000)])
+
+    def testNoOverlapOutOfOrder(self):
+        self.expectSets([(1000, 2000), (3000, 5000), (1, 5)],
+            [(1000, 2000), (3000, 5000), (1, 5)])
+
+    def testOverlapInOrder(self):
+        self.expectSets([(1, 10), (8, 20), (25, 5000)],
+            [(1, 20), (25, 5000)])
+
+    def testOverlapOutOfOrder(self):
+        self.expectSets([(25, 50), (8, 5000), (1, 10)], [(1, 5000)])
+
+    def testAdjacentOutOfOrder(self):
+        self.expectSets([(45, 50), (40, 45)], [(40, 50)])
+
+    def testContained(self):
+        self.expectSets([(100, 200), (0, 10), (120, 130), (150, 300)],
+            [(100, 300), (0, 10)])
+
+    def testDuplicates(self):
+        self.expectSets([(10, 20), (10, 20)], [(10, 20)])
+
+
+class TestMultipartByteranges(unittest.TestCase):
+
+    def testBody(self):
+        data = 'abcdefghijklmnopqrstuvwxyz'
+        body = MultipartByteranges([(1, 3), (10, 20)], len(data),
+                                   'text/plain', 'XYZ')
+        result = ''.join(body.parts(lambda start, end: [data[start:end]]))
+        self.assertEqual(result,
+            '\r\n--XYZ\r\nContent-Type: text/plain\r\n'
+            'Content-Range: bytes 1-2/26\r\n\r\nbc'
+            '\r\n--XYZ\r\nContent-Type: text/plain\r\n'
+            'Content-Range: bytes 10-19/26\r\n\r\nklmnopqrst'
+            '\r\n--XYZ--\r\n')
+        self.assertEqual(len(body), len(result))
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestRangeHeaderParse, 'test'))
     suite.addTest(unittest.makeSuite(TestExpandRanges, 'test'))
+    suite.addTest(unittest.makeSuite(TestCoalesceRanges, 'test'))
+    suite.addTest(unittest.makeSuite(TestMultipartByteranges, 'test'))
     return suite
 
 def main():
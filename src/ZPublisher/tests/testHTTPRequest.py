@@ -707,6 +707,90 @@ class HTTPRequestTests(unittest.TestCase):
         f.seek(0)
         self.assertEqual(f.xreadlines(),f)
 
+    def test_processInputs_w_parsed_multipart_body(self):
+        from ZPublisher.HTTPRequest import FileUpload
+        from ZPublisher.multipart import MultipartParser
+        parser = MultipartParser(TEST_ENVIRON['CONTENT_TYPE'])
+        parser.feed(TEST_FILE_DATA.replace('\n', '\r\n'))
+        parser.close()
+        environ = TEST_ENVIRON.copy()
+        environ['QUERY_STRING'] = 'foo=bar'
+        environ['zope.fieldstorage'] = parser
+        req = self._makeOne(environ=environ)
+        req.processInputs()
+        self.assertEqual(req.form['foo'], 'bar')
+        f = req.form['file']
+        self.assertTrue(isinstance(f, FileUpload))
+        self.assertEqual(f.filename, 'file')
+        self.assertEqual(f.headers['content-type'],
+                         'application/octet-stream')
+        self.assertEqual(f.read(), 'test\r\n')
+        self.assertFalse('zope.fieldstorage' in req.environ)
+
+    def test_processInputs_w_parsed_multipart_body_retried(self):
+        from ZPublisher.HTTPResponse import HTTPResponse
+        from ZPublisher.multipart import MultipartParser
+        parser = MultipartParser(TEST_ENVIRON['CONTENT_TYPE'])
+        parser.feed(TEST_FILE_DATA.replace('\n', '\r\n'))
+        parser.close()
+        environ = TEST_ENVIRON.copy()
+        environ['QUERY_STRING'] = 'foo=bar'
+        environ['zope.fieldstorage'] = parser
+        req = self._makeOne(environ=environ, response=HTTPResponse())
+        req.processInputs()
+        self.assertEqual(req.form['file'].read(), 'test\r\n')
+        self.assertFalse('zope.fieldstorage' in req._orig_env)
+        retried = req.retry()
+        retried.processInputs()
+        self.assertEqual(retried.form['foo'], 'bar')
+        self.assertEqual(retried.form['file'].read(), 'test\r\n')
+        self.assertEqual(len(parser.list), 1)
+
+    def test_processInputs_w_spooled_body(self):
+        from StringIO import StringIO
+        from ZPublisher.multipart import SpooledBody
+        body = StringIO('<html/>')
+        environ = {'REQUEST_METHOD': 'PUT', 'CONTENT_TYPE': 'text/html',
+                   'zope.fieldstorage': SpooledBody(body, 'text/html')}
+        req = self._makeOne(environ=environ)
+        req.processInputs()
+        self.assertTrue(req['BODYFILE'] is body)
+        self.assertEqual(req['BODY'], '<html/>')
+
+    def test_processInputs_w_cached_field_plans(self):
+        from ZPublisher.HTTPRequest import field_plans
+        inputs = (('num:int', '42'), ('items:tuple', 'one'),
+                  ('opt:ignore_empty', ''), ('other:ignore_empty', 'x'),
+                  ('go:method', 'ignored'), ('stay:default_method', 'x'))
+        field_plans.clear()
+        for i in range(2):
+            hits = field_plans.hits
+            req = self._processInputs(inputs)
+            self.assertEqual(req.form, {'num': 42, 'items': ('one',),
+                                        'other': 'x', 'go': 'ignored',
+                                        'stay': 'x'})
+            self.assertEqual(req.args, ())
+            self.assertEqual(req._hacked_path, 1)
+            self.assertEqual(req.other['PATH_INFO'][-3:], '/go')
+        self.assertEqual(field_plans.hits - hits, len(inputs))
+
+    def test_processInputs_w_replaced_converter(self):
+        from ZPublisher.Converters import type_converters
+        req = self._processInputs((('num:int', '42'),))
+        self.assertEqual(req.form, {'num': 42})
+        field2int = type_converters['int']
+        type_converters['int'] = float
+        try:
+            req = self._processInputs((('num:int', '42'),))
+        finally:
+            type_converters['int'] = field2int
+        self.assertEqual(req.form, {'num': 42.0})
+        self.assertTrue(isinstance(req.form['num'], float))
+
+    def test_processInputs_w_default_method_value(self):
+        req = self._processInputs(((':default_method', 'meth'),))
+        self.assertEqual(req.other['PATH_INFO'], '/meth')
+
     def test__authUserPW_simple( self ):
         import base64
         user_id = 'user'
@@ -1078,6 +1162,74 @@ class HTTPRequestTests(unittest.TestCase):
         req._script = ['foo', 'bar']
         self.assertEquals(req.getVirtualRoot(), '/foo/bar')
 
+class LazyHTTPRequestTests(HTTPRequestTests):
+    # Run all request tests with lazy input processing
+
+    def setUp(self):
+        from ZPublisher import HTTPRequest
+        HTTPRequest.lazy_inputs = True
+
+    def tearDown(self):
+        from ZPublisher import HTTPRequest
+        HTTPRequest.lazy_inputs = False
+
+    def _makeLazy(self, query_string='', **kw):
+        env = {'SERVER_NAME': 'testingharnas', 'SERVER_PORT': '80',
+               'QUERY_STRING': query_string}
+        env.update(kw)
+        req = self._makeOne(environ=env)
+        req.processInputs()
+        return req
+
+    def test_lazy_not_parsed_before_access(self):
+        req = self._makeLazy('num:int=1&rec.a:record=x')
+        self.assertTrue(req._inputs_pending)
+        self.assertEqual(req['URL'], 'http://testingharnas')
+        self.assertTrue(req._inputs_pending)
+        self.assertEqual(req['num'], 1)
+        self.assertFalse(req._inputs_pending)
+        self.assertEqual(req.form['rec'].a, 'x')
+
+    def test_lazy_form_attribute(self):
+        req = self._makeLazy('foo=<bar>')
+        self.assertEqual(req.taintedform['foo'], '<bar>')
+        self.assertEqual(req.form['foo'], '<bar>')
+
+    def test_lazy_method_processed_eagerly(self):
+        req = self._makeLazy('submit%3Amethod=Save', PATH_INFO='/doc')
+        self.assertFalse(req._inputs_pending)
+        self.assertEqual(req.other['PATH_INFO'], '/doc/submit')
+
+    def test_lazy_form_body_processed_eagerly(self):
+        from StringIO import StringIO
+        env = TEST_ENVIRON.copy()
+        req = self._makeOne(stdin=StringIO(TEST_FILE_DATA), environ=env)
+        req.processInputs()
+        self.assertFalse(req._inputs_pending)
+
+    def test_lazy_put_body(self):
+        from StringIO import StringIO
+        env = {'SERVER_NAME': 'testingharnas', 'SERVER_PORT': '80',
+               'REQUEST_METHOD': 'PUT', 'CONTENT_TYPE': 'text/plain',
+               'CONTENT_LENGTH': '4'}
+        req = self._makeOne(stdin=StringIO('data'), environ=env)
+        req.processInputs()
+        self.assertTrue(req._inputs_pending)
+        self.assertEqual(req['BODY'], 'data')
+        self.assertEqual(req.form, {})
+
+    def test_lazy_postProcessInputs(self):
+        req = self._makeLazy('foo=%C3%A4')
+        req.postProcessInputs()
+        self.assertTrue(req._inputs_pending)
+        self.assertEqual(req['foo'], u'\xe4')
+
+    def test_lazy_clear(self):
+        req = self._makeLazy('foo=bar')
+        req.clear()
+        self.assertEqual(req.form, {})
+
+
 TEST_ENVIRON = {
     'CONTENT_TYPE': 'multipart/form-data; boundary=12345',
     'REQUEST_METHOD': 'POST',
@@ -1105,8 +1257,60 @@ test %s
 ''' % ('test' * 1000)
 
 
+class FieldPlanCacheTests(unittest.TestCase):
+
+    def _makeOne(self, max_entries=1000):
+        from ZPublisher.HTTPRequest import FieldPlanCache
+        return FieldPlanCache(max_entries)
+
+    def test_compileFieldPlan(self):
+        from ZPublisher.HTTPRequest import compileFieldPlan
+        from ZPublisher.HTTPRequest import CONVERTED, RECORDS, SEQUENCE
+        self.assertEqual(compileFieldPlan('foo'),
+                         ('foo', 0, None, '', (), (), False))
+        self.assertEqual(
+            compileFieldPlan('a.b:int:utf8:tuple:records:ignore_empty'),
+            ('a.b', CONVERTED | RECORDS | SEQUENCE, 'int',
+             'utf8', ('a.b:int:utf8',), (), True))
+        self.assertEqual(compileFieldPlan('x:default_method:method'),
+                         ('x', 0, None, '', (),
+                          ((False, 'x:default_method'), (True, 'x')), False))
+        self.assertEqual(compileFieldPlan(':action')[5], ((False, None),))
+
+    def test_get_cached(self):
+        cache = self._makeOne()
+        plan = cache.get('foo:int')
+        self.assertTrue(cache.get('foo:int') is plan)
+        stats = cache.getStatistics()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_max_entries(self):
+        cache = self._makeOne(2)
+        for name in ('a:int', 'b:int', 'c:int'):
+            cache.get(name)
+        self.assertEqual(cache.getStatistics()['entries'], 1)
+        cache.max_entries = 0
+        cache.get('d:int')
+        self.assertEqual(cache.getStatistics()['entries'], 1)
+
+    def test_new_converter_clears(self):
+        from ZPublisher.Converters import type_converters
+        cache = self._makeOne()
+        self.assertEqual(cache.get('foo:bar')[1], 0)
+        type_converters['bar'] = int
+        try:
+            self.assertEqual(cache.get('foo:bar')[2], 'bar')
+        finally:
+            del type_converters['bar']
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(RecordTests))
     suite.addTest(unittest.makeSuite(HTTPRequestTests))
+    suite.addTest(unittest.makeSuite(LazyHTTPRequestTests))
+    suite.addTest(unittest.makeSuite(FieldPlanCacheTests))
     return suite
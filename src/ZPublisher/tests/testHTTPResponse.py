@@ -663,6 +663,14 @@ class HTTPResponseTests(unittest.TestCase):
         self.assertEqual(response.getHeader('Content-Encoding'), 'piglatin')
         self.assertEqual(response.body, BEFORE)
 
+    def test_setBody_compression_already_gzip_encoded(self):
+        BEFORE = 'foo' * 100 # body must get smaller on compression
+        response = self._makeOne()
+        response.setHeader('Content-Encoding', 'gzip')
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.setBody(BEFORE)
+        self.assertEqual(response.body, BEFORE)
+
     def test_setBody_compression_too_short_to_gzip(self):
         BEFORE = 'foo' # body must get smaller on compression
         response = self._makeOne()
@@ -703,6 +711,75 @@ class HTTPResponseTests(unittest.TestCase):
         response.setBody('foo' * 100) # body must get smaller on compression
         self.assertEqual(response.getHeader('Vary'), None)
 
+    def test_setBody_compression_decodes(self):
+        import gzip
+        from StringIO import StringIO
+        response = self._makeOne()
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.setBody('foo' * 100)
+        self.assertEqual(response.getHeader('Content-Encoding'), 'gzip')
+        self.assertEqual(int(response.getHeader('Content-Length')),
+                         len(response.body))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.body)).read(),
+                         'foo' * 100)
+
+    def test_setBody_compression_below_min_size(self):
+        from ZPublisher import HTTPResponse
+        HTTPResponse.compression_min_size = 1000
+        try:
+            response = self._makeOne()
+            response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+            response.setBody('foo' * 100)
+        finally:
+            HTTPResponse.compression_min_size = 0
+        self.assertFalse(response.getHeader('Content-Encoding'))
+        self.assertEqual(response.body, 'foo' * 100)
+
+    def test__startCompression(self):
+        response = self._makeOne()
+        self.assertFalse(response._startCompression())
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.setHeader('Content-Length', '300')
+        self.assertTrue(response._startCompression())
+        self.assertEqual(response.getHeader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getHeader('Content-Length'), None)
+        self.assertTrue('Accept-Encoding' in response.getHeader('Vary'))
+
+    def test__startCompression_uncompressible(self):
+        from ZPublisher import HTTPResponse
+        response = self._makeOne()
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.setHeader('Content-Type', 'image/png')
+        self.assertFalse(response._startCompression())
+        response.setHeader('Content-Type', 'text/plain')
+        response.setHeader('Content-Encoding', 'deflate')
+        self.assertFalse(response._startCompression())
+        del response.headers['content-encoding']
+        response.setHeader('Content-Length', '300')
+        HTTPResponse.compression_min_size = 1000
+        try:
+            self.assertFalse(response._startCompression())
+        finally:
+            HTTPResponse.compression_min_size = 0
+        self.assertEqual(response.getHeader('Content-Length'), '300')
+
+    def test__compressStream(self):
+        import gzip
+        from StringIO import StringIO
+        response = self._makeOne()
+        self.assertEqual(response._compressStream('abc'), 'abc')
+        self.assertEqual(response._endStream('def'), 'def')
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response._startCompression()
+        chunk = response._compressStream('abc')
+        data = StringIO(chunk)
+        # each chunk can be decoded right away
+        self.assertEqual(gzip.GzipFile(fileobj=data).read(3), 'abc')
+        data = chunk + response._endStream('def')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         'abcdef')
+        self.assertEqual(response._endStream(), '')
+
     def test_redirect_defaults(self):
         URL = 'http://example.com'
         response = self._makeOne()
@@ -1,12 +1,40 @@
 import unittest
 from zope.interface.verify import verifyClass
 from ZPublisher.Iterators import IStreamIterator, filestream_iterator
+from ZPublisher.Iterators import byterange_iterator, file_range_reader
 
 class TestFileStreamIterator(unittest.TestCase):
     def testInterface(self):
         verifyClass(IStreamIterator, filestream_iterator)
 
+class TestByterangeIterator(unittest.TestCase):
+    def _makeBody(self, ranges, size):
+        from ZPublisher.HTTPRangeSupport import MultipartByteranges
+        return MultipartByteranges(ranges, size, 'text/plain', 'XYZ')
+
+    def testInterface(self):
+        verifyClass(IStreamIterator, byterange_iterator)
+
+    def testIterate(self):
+        from StringIO import StringIO
+        data = 'abcdefghij' * 10
+        f = StringIO(data)
+        closed = []
+        body = self._makeBody([(5, 25), (90, 100)], len(data))
+        iterator = byterange_iterator(body, file_range_reader(f, 8),
+                                      lambda: closed.append(1))
+        result = list(iterator)
+        self.assertEqual(closed, [1])
+        self.assertEqual(len(iterator), len(''.join(result)))
+        self.assertEqual(''.join(result),
+            ''.join(body.parts(lambda start, end: [data[start:end]])))
+        # the data is read in chunks of at most 8 bytes
+        self.assertEqual(result[1:4], ['fghijabc', 'defghija', 'bcde'])
+        self.assertRaises(StopIteration, iterator.next)
+        self.assertEqual(closed, [1])
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest( unittest.makeSuite( TestFileStreamIterator ) )
+    suite.addTest( unittest.makeSuite( TestByterangeIterator ) )
     return suite
@@ -0,0 +1,181 @@
+import unittest
+
+
+class DummyRequest(dict):
+
+    def __init__(self, method='GET', **headers):
+        self['REQUEST_METHOD'] = method
+        self.headers = headers
+
+    def get_header(self, name, default=None):
+        return self.headers.get(name.lower().replace('-', '_'), default)
+
+
+class DummyResponse:
+
+    status = 200
+
+    def setStatus(self, status):
+        self.status = status
+
+
+class MatchETagTests(unittest.TestCase):
+
+    def _callFUT(self, header, etag, weak=True):
+        from ZPublisher.HTTPConditional import matchETag
+        return matchETag(header, etag, weak)
+
+    def test_match(self):
+        self.assertTrue(self._callFUT('"a"', '"a"'))
+        self.assertTrue(self._callFUT('"b", "a"', '"a"'))
+        self.assertFalse(self._callFUT('"b"', '"a"'))
+        self.assertFalse(self._callFUT('"a"', None))
+
+    def test_star(self):
+        self.assertTrue(self._callFUT(' * ', '"a"'))
+        self.assertTrue(self._callFUT('*', None))
+
+    def test_weak(self):
+        self.assertTrue(self._callFUT('W/"a"', '"a"'))
+        self.assertFalse(self._callFUT('W/"a"', '"a"', weak=False))
+
+    def test_gzip_variant(self):
+        self.assertTrue(self._callFUT('"a-gzip"', '"a"'))
+        self.assertTrue(self._callFUT('"a"', '"a-gzip"'))
+        self.assertFalse(self._callFUT('"a"', '"a-gzip"', weak=False))
+        self.assertTrue(self._callFUT('"a-gzip"', '"a-gzip"', weak=False))
+
+
+class HandleConditionalTests(unittest.TestCase):
+
+    def _callFUT(self, request, etag='"a"', last_modified=1000000000):
+        from ZPublisher.HTTPConditional import handleConditional
+        response = DummyResponse()
+        return handleConditional(request, response, etag,
+                                 last_modified), response.status
+
+    def test_no_conditions(self):
+        self.assertEqual(self._callFUT(DummyRequest()), (False, 200))
+
+    def test_if_none_match(self):
+        self.assertEqual(self._callFUT(DummyRequest(if_none_match='"a"')),
+                         (True, 304))
+        self.assertEqual(self._callFUT(DummyRequest(if_none_match='"b"')),
+                         (False, 200))
+        self.assertEqual(self._callFUT(DummyRequest('HEAD',
+                                                    if_none_match='*')),
+                         (True, 304))
+        self.assertEqual(self._callFUT(DummyRequest('POST',
+                                                    if_none_match='"a"')),
+                         (True, 412))
+
+    def test_if_none_match_overrides_if_modified_since(self):
+        request = DummyRequest(
+            if_none_match='"b"',
+            if_modified_since='Sat, 01 Jan 2050 00:00:00 GMT')
+        self.assertEqual(self._callFUT(request), (False, 200))
+
+    def test_if_modified_since(self):
+        request = DummyRequest(
+            if_modified_since='Sun, 09 Sep 2001 01:46:40 GMT')
+        self.assertEqual(self._callFUT(request), (True, 304))
+        self.assertEqual(self._callFUT(request, last_modified=1000000001),
+                         (False, 200))
+        self.assertEqual(self._callFUT(request, last_modified=None),
+                         (False, 200))
+        request['REQUEST_METHOD'] = 'POST'
+        self.assertEqual(self._callFUT(request), (False, 200))
+
+    def test_if_modified_since_invalid(self):
+        request = DummyRequest(if_modified_since='bogus')
+        self.assertEqual(self._callFUT(request), (False, 200))
+
+    def test_if_match(self):
+        self.assertEqual(self._callFUT(DummyRequest(if_match='"a"')),
+                         (False, 200))
+        self.assertEqual(self._callFUT(DummyRequest(if_match='"b"')),
+                         (True, 412))
+        self.assertEqual(self._callFUT(DummyRequest(if_match='W/"a"')),
+                         (True, 412))
+        self.assertEqual(self._callFUT(DummyRequest(if_match='*'), None),
+                         (False, 200))
+
+    def test_if_unmodified_since(self):
+        request = DummyRequest(
+            if_unmodified_since='Sun, 09 Sep 2001 01:46:39 GMT')
+        self.assertEqual(self._callFUT(request), (True, 412))
+        self.assertEqual(self._callFUT(request, last_modified=999999999),
+                         (False, 200))
+        request.headers['if_match'] = '"a"'
+        self.assertEqual(self._callFUT(request), (False, 200))
+
+
+class IfRangeMatchesTests(unittest.TestCase):
+
+    def _callFUT(self, if_range=None, etag='"a"', last_modified=1000000000):
+        from ZPublisher.HTTPConditional import ifRangeMatches
+        if if_range is None:
+            request = DummyRequest()
+        else:
+            request = DummyRequest(if_range=if_range)
+        return ifRangeMatches(request, etag, last_modified)
+
+    def test_no_if_range(self):
+        self.assertTrue(self._callFUT())
+
+    def test_etag(self):
+        self.assertTrue(self._callFUT('"a"'))
+        self.assertFalse(self._callFUT('"b"'))
+        self.assertFalse(self._callFUT('W/"a"'))
+        self.assertFalse(self._callFUT('"a"', etag=None))
+
+    def test_date(self):
+        self.assertTrue(self._callFUT('Sun, 09 Sep 2001 01:46:40 GMT'))
+        self.assertFalse(self._callFUT('Sun, 09 Sep 2001 01:46:39 GMT'))
+        self.assertFalse(self._callFUT('Sun, 09 Sep 2001 01:46:40 GMT',
+                                       last_modified=None))
+
+    def test_invalid_date(self):
+        self.assertTrue(self._callFUT('bogus'))
+
+
+class FunctionTests(unittest.TestCase):
+
+    def test_parseHTTPDate(self):
+        from ZPublisher.HTTPConditional import parseHTTPDate
+        self.assertEqual(parseHTTPDate('Sun, 09 Sep 2001 01:46:40 GMT'),
+                         1000000000)
+        self.assertEqual(
+            parseHTTPDate('Sun, 09 Sep 2001 01:46:40 GMT; length=10'),
+            1000000000)
+        self.assertEqual(parseHTTPDate('bogus'), None)
+
+    def test_contentETag(self):
+        from ZPublisher.HTTPConditional import contentETag
+        etag = contentETag('abc')
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(contentETag(u'abc'), etag)
+        self.assertNotEqual(contentETag('abd'), etag)
+
+    def test_gzipETag(self):
+        from ZPublisher.HTTPConditional import gzipETag
+        self.assertEqual(gzipETag('"a"'), '"a-gzip"')
+        self.assertEqual(gzipETag(None), None)
+
+    def test_serialETag(self):
+        from persistent import Persistent
+        from ZPublisher.HTTPConditional import serialETag
+        ob = Persistent()
+        self.assertEqual(serialETag(ob), None)
+        ob._p_jar = object()
+        ob._p_serial = '\0' * 7 + '\1'
+        self.assertEqual(serialETag(ob), '"0000000000000001"')
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(MatchETagTests),
+        unittest.makeSuite(HandleConditionalTests),
+        unittest.makeSuite(IfRangeMatchesTests),
+        unittest.makeSuite(FunctionTests),
+        ))
@@ -110,6 +110,37 @@ class WSGIResponseTests(unittest.TestCase):
         response.finalize()
         self.assertEqual(response.getHeader('Connection'), None)
 
+    def test_write_wo_start_response_buffers(self):
+        from StringIO import StringIO
+        stdout = StringIO()
+        response = self._makeOne(stdout=stdout)
+        response.write('abc')
+        response.write('def')
+        self.assertEqual(stdout.getvalue(), 'abcdef')
+        self.assertFalse(response.headersSent())
+
+    def test_write_w_start_response_streams(self):
+        from StringIO import StringIO
+        stdout = StringIO()
+        written = []
+        calls = []
+        def start_response(status, headers):
+            calls.append((status, headers))
+            return written.append
+        response = self._makeOne(stdout=stdout)
+        response._start_response = start_response
+        response.setHeader('Content-Type', 'text/csv')
+        response.write('abc')
+        self.assertTrue(response.headersSent())
+        response.write('def')
+        self.assertEqual(written, ['abc', 'def'])
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(len(calls), 1)
+        status, headers = calls[0]
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(('Content-Type', 'text/csv') in headers)
+        self.assertFalse('Content-Length' in dict(headers))
+
     def test_listHeaders_skips_Server_header_wo_server_version_set(self):
         response = self._makeOne()
         response.setBody('TESTING')
@@ -148,6 +179,17 @@ class WSGIResponseTests(unittest.TestCase):
     #    response._chunking = True
     #    self.assertEqual(str(response), '0\r\n\r\n')
 
+    def test_setBody_w_stream_iterator(self):
+        from ZPublisher.HTTPRangeSupport import MultipartByteranges
+        from ZPublisher.Iterators import byterange_iterator
+        body = MultipartByteranges([(0, 1), (3, 5)], 10, 'text/plain', 'X')
+        iterator = byterange_iterator(body, lambda start, end: ['x' * 4])
+        response = self._makeOne()
+        response.setBody(iterator)
+        self.assertTrue(response.body is iterator)
+        self.assertEqual(response.getHeader('Content-Length'),
+                         str(len(body)))
+
     def test___str___raises(self):
         response = self._makeOne()
         response.setBody('TESTING')
@@ -353,6 +395,108 @@ class Test_publish_module(unittest.TestCase):
         self.assertTrue(('Content-Length', '0') in headers)
         self.assertEqual(kw, {})
 
+    def test_HTTP_1_1_keeps_connection_by_default(self):
+        from zExceptions import Redirect
+        environ = self._makeEnviron()
+        start_response = DummyCallable()
+        _publish = DummyCallable()
+        _publish._raise = Redirect('/redirect_to')
+        self._callFUT(environ, start_response, _publish)
+        (status, headers), kw = start_response._called_with
+        self.assertFalse('Connection' in dict(headers))
+
+    def test_HTTP_1_1_connection_close(self):
+        from zExceptions import Redirect
+        environ = self._makeEnviron(CONNECTION_TYPE='Close')
+        start_response = DummyCallable()
+        _publish = DummyCallable()
+        _publish._raise = Redirect('/redirect_to')
+        self._callFUT(environ, start_response, _publish)
+        (status, headers), kw = start_response._called_with
+        self.assertTrue(('Connection', 'close') in headers)
+
+    def test_response_write_streams(self):
+        environ = self._makeEnviron()
+        written = []
+        calls = []
+        def start_response(status, headers):
+            calls.append(status)
+            return written.append
+        def _publish(request, module_name):
+            response = request.response
+            response.setHeader('Content-Type', 'text/plain')
+            response.write('chunk1')
+            self.assertEqual(written, ['chunk1'])
+            response.write('chunk2')
+            return response
+        app_iter = self._callFUT(environ, start_response, _publish)
+        self.assertEqual(list(app_iter), [])
+        self.assertEqual(written, ['chunk1', 'chunk2'])
+        self.assertEqual(calls, ['200 OK'])
+
+    def test_response_write_streams_then_body(self):
+        environ = self._makeEnviron()
+        written = []
+        def start_response(status, headers):
+            return written.append
+        def _publish(request, module_name):
+            response = request.response
+            response.setHeader('Content-Type', 'text/plain')
+            response.write('chunk')
+            response.setBody('tail')
+            return response
+        app_iter = self._callFUT(environ, start_response, _publish)
+        self.assertEqual(list(app_iter), ['tail'])
+        self.assertEqual(written, ['chunk'])
+
+    def test_response_write_streams_compressed(self):
+        import gzip
+        from StringIO import StringIO
+        environ = self._makeEnviron()
+        written = []
+        calls = []
+        def start_response(status, headers):
+            calls.append(headers)
+            return written.append
+        def _publish(request, module_name):
+            response = request.response
+            response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+            response.setHeader('Content-Type', 'text/plain')
+            response.setHeader('Content-Length', '12')
+            response.write('chunk1')
+            response.write('chunk2')
+            return response
+        app_iter = self._callFUT(environ, start_response, _publish)
+        headers = dict(calls[0])
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertFalse('Content-Length' in headers)
+        data = ''.join(written + list(app_iter))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         'chunk1chunk2')
+
+    def test_response_write_streams_request_closed_after_publish(self):
+        environ = self._makeEnviron()
+        _request = DummyRequest()
+        _request._closed = False
+        def _close():
+            _request._closed = True
+        _request.close = _close
+        def _request_factory(stdin, environ, response):
+            _request.response = response
+            return _request
+        closed_while_streaming = []
+        def start_response(status, headers):
+            return lambda data: closed_while_streaming.append(
+                _request._closed)
+        def _publish(request, module_name):
+            request.response.setHeader('Content-Type', 'text/plain')
+            request.response.write('chunk')
+            return request.response
+        self._callFUT(environ, start_response, _publish,
+                      _request_factory=_request_factory)
+        self.assertEqual(closed_while_streaming, [False])
+        self.assertTrue(_request._closed)
+
     def test_response_body_is_file(self):
         class DummyFile(file):
             def __init__(self):
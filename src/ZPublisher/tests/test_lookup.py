@@ -0,0 +1,114 @@
+import unittest
+
+from zope.interface import implements
+from zope.interface import Interface
+from zope.publisher.interfaces import IPublishTraverse
+
+
+class IContent(Interface):
+    pass
+
+
+class Content(object):
+    implements(IContent)
+
+
+class Request(object):
+    pass
+
+
+class Traverser(object):
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+
+class LookupTests(unittest.TestCase):
+
+    def setUp(self):
+        from zope.component.testing import setUp
+        setUp()
+
+    def tearDown(self):
+        from zope.component.testing import tearDown
+        tearDown()
+
+    def _registry(self):
+        from zope.component import getSiteManager
+        return getSiteManager().adapters
+
+    def test_lookup_cached(self):
+        from ZPublisher.lookup import lookup
+        ob, request = Content(), Request()
+        self.assertEqual(lookup(ob, request, IPublishTraverse), None)
+        generations, lookups = self._registry()._v_publisher_lookups
+        self.assertEqual(lookups.values(), [None])
+        self.assertEqual(lookup(ob, request, IPublishTraverse), None)
+        self.assertEqual(len(lookups), 1)
+
+    def test_registration_invalidates(self):
+        from zope.component import provideAdapter
+        from ZPublisher.lookup import queryAdapter
+        ob, request = Content(), Request()
+        self.assertEqual(queryAdapter(ob, request, IPublishTraverse), None)
+        provideAdapter(Traverser, (IContent, Interface), IPublishTraverse)
+        adapter = queryAdapter(ob, request, IPublishTraverse)
+        self.assertTrue(isinstance(adapter, Traverser))
+        self.assertTrue(adapter.context is ob)
+        self.assertTrue(adapter.request is request)
+
+    def test_base_registry_change_invalidates(self):
+        from zope.component import getGlobalSiteManager
+        from zope.component.registry import Components
+        from zope.component.hooks import setSite, setHooks, resetHooks
+        from ZPublisher.lookup import lookup
+
+        class Site(object):
+            def getSiteManager(self):
+                return local
+
+        local = Components('local', (getGlobalSiteManager(),))
+        setHooks()
+        setSite(Site())
+        try:
+            ob, request = Content(), Request()
+            self.assertEqual(lookup(ob, request, IPublishTraverse), None)
+            getGlobalSiteManager().registerAdapter(
+                Traverser, (IContent, Interface), IPublishTraverse)
+            self.assertEqual(lookup(ob, request, IPublishTraverse),
+                             Traverser)
+        finally:
+            setSite(None)
+            resetHooks()
+
+    def test_cache_size(self):
+        from ZPublisher import lookup
+        old = lookup.CACHE_SIZE
+        lookup.CACHE_SIZE = 1
+        try:
+            lookup.lookup(Content(), Request(), IPublishTraverse)
+            lookup.lookup(Content(), Request(), IPublishTraverse, 'x')
+            lookups = self._registry()._v_publisher_lookups[1]
+            self.assertEqual(lookups.keys()[0][-1], 'x')
+            lookup.CACHE_SIZE = 0
+            lookup.lookup(Content(), Request(), IPublishTraverse, 'y')
+            self.assertEqual(len(lookups), 1)
+        finally:
+            lookup.CACHE_SIZE = old
+
+    def test_default_view_name(self):
+        from zope.component import provideAdapter
+        from zope.publisher.interfaces import IDefaultViewName
+        from ZPublisher.BaseRequest import DefaultPublishTraverse
+        ob, request = Content(), Request()
+        traverser = DefaultPublishTraverse(ob, request)
+        self.assertEqual(traverser.browserDefault(request), (ob, ()))
+        provideAdapter('view', (IContent, Interface), IDefaultViewName)
+        self.assertEqual(traverser.browserDefault(request), (ob, ('@@view',)))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(LookupTests),
+    ))
@@ -0,0 +1,219 @@
+import unittest
+
+BODY = '\r\n'.join([
+    'preamble',
+    '--12345',
+    'Content-Disposition: form-data; name="title"',
+    '',
+    'A title',
+    '--12345',
+    'Content-Disposition: form-data; name="file"; filename="file.txt"',
+    'Content-Type: text/plain',
+    '',
+    'line 1\r\nline 2\r\n--1234',
+    '--12345--',
+    'epilogue',
+    ])
+
+
+class MultipartParserTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from ZPublisher.multipart import MultipartParser
+        return MultipartParser
+
+    def _makeOne(self, content_type='multipart/form-data; boundary=12345'):
+        return self._getTargetClass()(content_type)
+
+    def _checkParts(self, parser):
+        title, file = parser.list
+        self.assertEqual(title.name, 'title')
+        self.assertEqual(title.filename, None)
+        self.assertEqual(title.value, 'A title')
+        self.assertEqual(file.name, 'file')
+        self.assertEqual(file.filename, 'file.txt')
+        self.assertEqual(file.headers['content-type'], 'text/plain')
+        self.assertEqual(file.file.read(), 'line 1\r\nline 2\r\n--1234')
+
+    def test_invalid_boundary(self):
+        self.assertRaises(ValueError, self._makeOne, 'multipart/form-data')
+        self.assertRaises(ValueError, self._makeOne,
+                          'text/plain; boundary=12345')
+
+    def test_feed_all(self):
+        parser = self._makeOne()
+        parser.feed(BODY)
+        parser.close()
+        self._checkParts(parser)
+
+    def test_feed_bytewise(self):
+        parser = self._makeOne()
+        for c in BODY:
+            parser.feed(c)
+        parser.close()
+        self._checkParts(parser)
+
+    def test_body_starts_with_delimiter(self):
+        parser = self._makeOne()
+        parser.feed(BODY[len('preamble\r\n'):])
+        parser.close()
+        self._checkParts(parser)
+
+    def test_incomplete_body(self):
+        parser = self._makeOne()
+        parser.feed(BODY[:-20])
+        self.assertRaises(ValueError, parser.close)
+
+    def test_headers_too_long(self):
+        from ZPublisher import multipart
+        parser = self._makeOne()
+        parser.feed('--12345\r\n')
+        self.assertRaises(ValueError, parser.feed,
+                          'X: ' + 'x' * multipart.MAX_HEADER_SIZE)
+
+    def test_lf_line_endings(self):
+        parser = self._makeOne()
+        parser.feed(BODY.replace('\r\n', '\n'))
+        parser.close()
+        title, file = parser.list
+        self.assertEqual(title.value, 'A title')
+        self.assertEqual(file.headers['content-type'], 'text/plain')
+        self.assertEqual(file.value, 'line 1\nline 2\n--1234')
+
+    def test_incomplete_body_not_strict(self):
+        parser = self._makeOne()
+        parser.feed(BODY[:BODY.index('--1234\r\n--12345--')])
+        parser.close(strict=False)
+        title, file = parser.list
+        self.assertEqual(file.value, 'line 1\r\nline 2')
+
+    def test_small_uploads_are_spooled(self):
+        from ZPublisher import multipart
+        data = 'x' * (multipart.UPLOAD_SPOOL_THRESHOLD + 1)
+        parser = self._makeOne()
+        parser.feed('--12345\r\n'
+                    'Content-Disposition: form-data; name="a"; filename="a"'
+                    '\r\n\r\n' + data + '\r\n--12345\r\n'
+                    'Content-Disposition: form-data; name="b"'
+                    '\r\n\r\n' + data + '\r\n--12345--')
+        parser.close()
+        upload, field = parser.list
+        self.assertTrue(upload.file.name)
+        self.assertFalse(hasattr(field.file, 'name'))
+
+    def test_large_parts_are_spooled(self):
+        from ZPublisher import multipart
+        data = 'x' * (multipart.SPOOL_THRESHOLD + 1)
+        parser = self._makeOne()
+        parser.feed('--12345\r\n'
+                    'Content-Disposition: form-data; name="a"; filename="a"'
+                    '\r\n\r\n')
+        for i in range(0, len(data), 1000):
+            parser.feed(data[i:i + 1000])
+        parser.feed('\r\n--12345--\r\n')
+        parser.close()
+        part, = parser.list
+        self.assertTrue(part.file.name)
+        self.assertEqual(part.file.read(), data)
+
+
+class UrlencodedParserTests(unittest.TestCase):
+
+    def test_feed_bytewise(self):
+        from ZPublisher.multipart import UrlencodedParser
+        parser = UrlencodedParser()
+        for c in 'a=1&b=x+y%26z;c&d=':
+            parser.feed(c)
+        parser.close()
+        self.assertEqual([(f.name, f.value) for f in parser.list],
+                         [('a', '1'), ('b', 'x y&z'), ('c', ''), ('d', '')])
+
+
+class ParseInputsTests(unittest.TestCase):
+
+    def _callFUT(self, body, **environ):
+        from StringIO import StringIO
+        from ZPublisher.multipart import parseInputs
+        environ.setdefault('REQUEST_METHOD', 'POST')
+        environ.setdefault('CONTENT_LENGTH', str(len(body)))
+        return parseInputs(StringIO(body), environ)
+
+    def _fields(self, fs):
+        return [(f.name, f.value) for f in fs.list]
+
+    def _fieldStorage(self, body, **environ):
+        from StringIO import StringIO
+        from cgi import FieldStorage
+        environ.setdefault('REQUEST_METHOD', 'POST')
+        environ.setdefault('CONTENT_LENGTH', str(len(body)))
+        return FieldStorage(StringIO(body), environ=environ,
+                            keep_blank_values=1)
+
+    def test_get(self):
+        fs = self._callFUT('ignored', REQUEST_METHOD='GET',
+                           QUERY_STRING='a=1&b')
+        self.assertEqual(self._fields(fs), [('a', '1'), ('b', '')])
+
+    def test_urlencoded(self):
+        environ = {'QUERY_STRING': 'q=1',
+                   'CONTENT_TYPE': 'application/x-www-form-urlencoded'}
+        fs = self._callFUT('a=1&a=2', **environ)
+        self.assertEqual(self._fields(fs), [('a', '1'), ('a', '2'), ('q', '1')])
+        self.assertEqual(self._fields(fs), self._fields(
+            self._fieldStorage('a=1&a=2', **environ)))
+
+    def test_post_without_content_type(self):
+        fs = self._callFUT('a=1')
+        self.assertEqual(self._fields(fs), [('a', '1')])
+
+    def test_content_length(self):
+        fs = self._callFUT('a=1&b=2', CONTENT_LENGTH='3')
+        self.assertEqual(self._fields(fs), [('a', '1')])
+
+    def test_maxlen(self):
+        import cgi
+        old, cgi.maxlen = cgi.maxlen, 10
+        try:
+            self.assertRaises(ValueError, self._callFUT, 'a=' + 'x' * 10)
+        finally:
+            cgi.maxlen = old
+
+    def test_multipart(self):
+        environ = {'QUERY_STRING': 'q=1',
+                   'CONTENT_TYPE': 'multipart/form-data; boundary=12345'}
+        fs = self._callFUT(BODY, **environ)
+        expected = [('q', '1'), ('title', 'A title'),
+                    ('file', 'line 1\r\nline 2\r\n--1234')]
+        self.assertEqual(self._fields(fs), expected)
+        self.assertEqual(self._fields(self._fieldStorage(BODY, **environ)),
+                         expected)
+        self.assertEqual(fs.list[2].filename, 'file.txt')
+
+    def test_other_body(self):
+        fs = self._callFUT('<xml/>', REQUEST_METHOD='PUT',
+                           CONTENT_TYPE='text/xml')
+        self.assertEqual(fs.list, None)
+        self.assertEqual(fs.headers['content-type'], 'text/xml')
+        self.assertEqual(fs.value, '<xml/>')
+        self.assertEqual(fs.file.read(), '<xml/>')
+
+
+class SpooledBodyTests(unittest.TestCase):
+
+    def test_value(self):
+        from StringIO import StringIO
+        from ZPublisher.multipart import SpooledBody
+        body = SpooledBody(StringIO('<html/>'), 'text/html')
+        self.assertEqual(body.list, None)
+        self.assertEqual(body.headers['content-type'], 'text/html')
+        self.assertEqual(body.value, '<html/>')
+        self.assertEqual(body.file.tell(), 0)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(MultipartParserTests),
+        unittest.makeSuite(UrlencodedParserTests),
+        unittest.makeSuite(ParseInputsTests),
+        unittest.makeSuite(SpooledBodyTests),
+    ))
@@ -0,0 +1,175 @@
+import unittest
+
+import transaction
+from OFS.Folder import Folder
+from zope.interface import Interface
+
+
+class ILayer(Interface):
+    pass
+
+
+class TreeFolder(Folder):
+    # A folder keeping its items in a BTree, like BTreeFolder2.
+
+    def __init__(self, id):
+        from BTrees.OOBTree import OOBTree
+        Folder.__init__(self, id)
+        self._tree = OOBTree()
+
+    def __getattr__(self, name):
+        if name != '_tree':
+            try:
+                return self._tree[name]
+            except KeyError:
+                pass
+        raise AttributeError(name)
+
+
+class TraversalCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        from zope.component.testing import setUp
+        from zope.component import provideHandler
+        from zope.lifecycleevent.interfaces import IObjectMovedEvent
+        from ZODB import DB
+        from ZODB.DemoStorage import DemoStorage
+        from OFS.Application import Application
+        from OFS.Folder import Folder
+        from ZPublisher import traversalcache
+        setUp()
+        provideHandler(traversalcache.containerChanged, (IObjectMovedEvent,))
+        traversalcache.configure(100)
+        self.cache = traversalcache.cache
+        self.db = DB(DemoStorage())
+        conn = self.db.open()
+        app = Application()
+        conn.root()['Application'] = app
+        app._setObject('folder', Folder('folder'))
+        app.folder._setObject('sub', Folder('sub'))
+        transaction.commit()
+        conn.close()
+        self.connections = []
+
+    def tearDown(self):
+        from zope.component.testing import tearDown
+        from ZPublisher import traversalcache
+        transaction.abort()
+        for conn in self.connections:
+            conn.close()
+        self.db.close()
+        traversalcache.configure(0)
+        tearDown()
+
+    def _getApp(self):
+        conn = self.db.open()
+        self.connections.append(conn)
+        return conn.root()['Application']
+
+    def _makeRequest(self, app):
+        from ZPublisher.HTTPResponse import HTTPResponse
+        from ZPublisher.HTTPRequest import HTTPRequest
+        environ = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'REQUEST_METHOD': 'GET'}
+        response = HTTPResponse()
+        request = HTTPRequest(None, environ, response)
+        request['PARENTS'] = [app]
+        return request
+
+    def _traverse(self, path, app=None):
+        if app is None:
+            app = self._getApp()
+        request = self._makeRequest(app)
+        return request.traverse(path), request
+
+    def test_replay(self):
+        from Acquisition import aq_base
+        first, request1 = self._traverse('/folder/sub')
+        stats = self.cache.getStatistics()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['misses'], 2)
+        second, request2 = self._traverse('/folder/sub')
+        stats = self.cache.getStatistics()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(second.getPhysicalPath(), ('', 'folder', 'sub'))
+        self.assertFalse(aq_base(second) is aq_base(first))
+        self.assertEqual(request2['URL'], 'http://localhost/folder/sub')
+        self.assertEqual(request2.roles, request1.roles)
+        self.assertEqual([p.getId() for p in request2['PARENTS']],
+                         ['folder', ''])
+
+    def test_changed_object(self):
+        self._traverse('/folder/sub')
+        app = self._getApp()
+        app.folder.title = 'changed'
+        transaction.commit()
+        ob, request = self._traverse('/folder/sub')
+        self.assertEqual(ob.aq_parent.title, 'changed')
+        self.assertEqual(self.cache.getStatistics()['hits'], 0)
+        self._traverse('/folder/sub')
+        self.assertEqual(self.cache.getStatistics()['hits'], 2)
+
+    def test_removed_object(self):
+        from zExceptions import NotFound
+        self._traverse('/folder/sub')
+        app = self._getApp()
+        app.folder.manage_delObjects(['sub'])
+        self.assertEqual(self.cache.getStatistics()['entries'], 0)
+        # A request using an older connection records the object again
+        self._traverse('/folder/sub')
+        transaction.commit()
+        self.assertEqual(self.cache.getStatistics()['entries'], 0)
+        self.assertTrue(self.cache.getStatistics()['invalidations'])
+        self.assertRaises(NotFound, self._traverse, '/folder/sub')
+
+    def test_removed_from_tree(self):
+        # Removing an item from a BTree doesn't change the container, and
+        # another process doesn't empty our cache.
+        from zExceptions import NotFound
+        app = self._getApp()
+        app._setObject('tree', TreeFolder('tree'))
+        app.tree._tree['sub'] = Folder('sub')
+        transaction.commit()
+        self._traverse('/tree/sub')
+        self._traverse('/tree/sub')
+        self.assertEqual(self.cache.getStatistics()['hits'], 2)
+        app = self._getApp()
+        del app.tree._tree['sub']
+        transaction.commit()
+        self.assertRaises(NotFound, self._traverse, '/tree/sub')
+
+    def test_acquired_not_cached(self):
+        ob, request = self._traverse('/folder/sub/folder/sub')
+        self.assertEqual(self.cache.getStatistics()['entries'], 2)
+        ob, request = self._traverse('/folder/sub/folder/sub')
+        self.assertEqual(self.cache.getStatistics()['hits'], 2)
+        self.assertEqual([p.getId() for p in request['PARENTS']],
+                         ['folder', 'sub', 'folder', ''])
+
+    def test_layers(self):
+        from zope.interface import alsoProvides
+        self._traverse('/folder')
+        request = self._makeRequest(self._getApp())
+        alsoProvides(request, ILayer)
+        request.traverse('/folder')
+        self.assertEqual(self.cache.getStatistics()['hits'], 0)
+        self.assertEqual(self.cache.getStatistics()['entries'], 2)
+
+    def test_virtual_root(self):
+        self._traverse('/folder/sub')
+        request = self._makeRequest(self._getApp())
+        request['VirtualRootPhysicalPath'] = ('', 'folder')
+        request.traverse('/folder/sub')
+        self.assertEqual(self.cache.getStatistics()['hits'], 0)
+
+    def test_max_entries(self):
+        self.cache.max_entries = 1
+        self._traverse('/folder/sub')
+        self.assertEqual(self.cache.getStatistics()['entries'], 1)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(TraversalCacheTests),
+    ))
@@ -0,0 +1,184 @@
+##############################################################################
+#
+# Copyright (c) 2010 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cache of publishing traversal steps.
+
+BaseRequest.traverse resolves every path segment through traverseName and
+getRoles on every request.  When the cache is enabled (see the
+'traversal-cache-size' directive) a step that resolved a persistent
+subobject stored on its parent under the traversed name is remembered as
+the oid and serial of the subobject and the roles found for it.  Later
+requests replay the step by getting the name from the parent, which must
+still yield the same object in the same state, and reusing the roles.
+
+A step is keyed by the virtual root, the oids and serials of all objects
+traversed so far, the traversed name and the interfaces provided by the
+request, so changes to an object on the path, to the skin or layers of
+the request, or to the virtual hosting configuration all cause a miss.
+Containers that keep their subobjects in separate persistent objects
+(e.g. in a BTree) do not change when an item is removed, which the lookup
+on the parent detects, also for changes committed by other processes.
+The cache is emptied whenever an object is added, moved or removed in
+this process, too.
+"""
+
+import weakref
+
+import transaction
+from Acquisition import aq_base
+from Acquisition import aq_inner
+from Acquisition import aq_parent
+from zope.interface import providedBy
+from zope.publisher.interfaces import IPublishTraverse
+from ZPublisher.lookup import lookup
+
+# The cache used by BaseRequest.traverse, None if disabled.
+cache = None
+
+
+def configure(max_entries):
+    """Enable the cache with up to max_entries steps, or disable it."""
+    global cache
+    if max_entries:
+        cache = TraversalCache(max_entries)
+    else:
+        cache = None
+
+
+def stepId(ob):
+    """Return the oid and serial identifying the state of ob, or None."""
+    base = aq_base(ob)
+    if getattr(base, '_p_oid', None) is None or base._p_changed:
+        return None
+    base._p_activate()
+    return base._p_oid, base._p_serial
+
+
+class TraversalCache(object):
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._txn = None
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.hits = self.misses = self.invalidations = 0
+
+    def start(self, root):
+        """Return the chain for the top-level object of a traversal."""
+        step = stepId(root)
+        if step is None:
+            return None
+        return (step,)
+
+    def key(self, request, chain, name):
+        return (request.other.get('VirtualRootPhysicalPath'), chain, name,
+                tuple(providedBy(request)))
+
+    def lookup(self, key, parent):
+        """Replay a step.
+
+        Returns the subobject, its roles and the chain extended by the
+        subobject, or None.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            oid, serial, roles = entry
+            pbase = aq_base(parent)
+            ob = aq_base(getattr(pbase, key[2], None))
+            if (getattr(ob, '_p_jar', None) is not None and
+                ob._p_jar is pbase._p_jar and
+                stepId(ob) == (oid, serial)):
+                self.hits += 1
+                return ob.__of__(parent), roles, key[1] + ((oid, serial),)
+        self.misses += 1
+        return None
+
+    def record(self, request, key, parent, name, ob, roles):
+        """Remember a step resolved by traversal.
+
+        Returns the chain extended by ob, or None if the step cannot be
+        replayed; later steps of the traversal are not cached either.
+        """
+        step = self.cacheable(request, parent, name, ob)
+        if step is None:
+            return None
+        if len(self._entries) >= self.max_entries:
+            self._entries = {}
+        self._entries[key] = step + (roles,)
+        return key[1] + (step,)
+
+    def cacheable(self, request, parent, name, ob):
+        """Return the step id for ob if it can be replayed, else None.
+
+        This is the case for persistent objects stored on the parent
+        under the traversed name if the parent doesn't use a custom
+        traversal adapter.  Acquired objects are not cached as their
+        roles depend on objects outside of the traversed path.
+        """
+        if name[:1] in '@+':
+            return None
+        base = aq_base(ob)
+        pbase = aq_base(parent)
+        if (getattr(base, '_p_jar', None) is None or
+            base._p_jar is not getattr(pbase, '_p_jar', None)):
+            return None
+        if aq_base(aq_parent(aq_inner(ob))) is not pbase:
+            return None
+        if aq_base(getattr(pbase, name, None)) is not base:
+            return None
+        if (IPublishTraverse.providedBy(parent) or
+            lookup(parent, request, IPublishTraverse) is not None):
+            return None
+        return stepId(ob)
+
+    def clear(self):
+        self._entries = {}
+
+    def invalidate(self):
+        """Empty the cache now and after the current transaction commits.
+
+        Other threads may record steps until the changes are committed.
+        """
+        self.clear()
+        self.invalidations += 1
+        txn = transaction.get()
+        if self._txn is None or self._txn() is not txn:
+            self._txn = weakref.ref(txn)
+            txn.addAfterCommitHook(self._afterCommit)
+
+    def _afterCommit(self, status):
+        self.clear()
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': total and float(self.hits) / total or 0.0,
+            'invalidations': self.invalidations,
+            }
+
+
+def containerChanged(event):
+    """Empty the cache when an object is added, moved or removed."""
+    if cache is not None:
+        cache.invalidate()
+
+
+def getStatistics():
+    """Return the statistics of the cache, or None if it is disabled."""
+    if cache is not None:
+        return cache.getStatistics()
@@ -39,7 +39,7 @@ from ZServer.Producers import LoggingProducer
 from ZServer.Producers import CallbackProducer
 from ZServer.Producers import file_part_producer
 from ZServer.Producers import file_close_producer
-from ZServer.Producers import iterator_producer
+from ZServer.Producers import stream_producer
 from ZServer.DebugLogger import log
 
 
@@ -64,10 +64,13 @@ class ZServerHTTPResponse(HTTPResponse):
 
     def __str__(self):
         if self._wrote:
+            data = self._endStream()
             if self._chunking:
-                return '0\r\n\r\n'
+                if data:
+                    data = '%x\r\n%s\r\n' % (len(data), data)
+                return data + '0\r\n\r\n'
             else:
-                return ''
+                return data
 
         headers = self.headers
         body = self.body
@@ -180,10 +183,17 @@ class ZServerHTTPResponse(HTTPResponse):
                         self._templock = thread.allocate_lock()
                 except: pass
 
+            if self._startCompression():
+                # The length of the compressed stream is unknown, the
+                # connection has to be closed unless chunking is used.
+                if self._http_version != '1.1' or not self.http_chunk:
+                    self._http_connection = 'close'
+
             self._streaming = 1
             stdout.write(str(self))
             self._wrote = 1
 
+        data = self._compressStream(data)
         if not data: return
 
         if self._chunking:
@@ -260,7 +270,7 @@ class ZServerHTTPResponse(HTTPResponse):
         if IStreamIterator.providedBy(body):
             assert(self.headers.has_key('content-length'))
             # wrap the iterator up in a producer that medusa can understand
-            self._bodyproducer = iterator_producer(body)
+            self._bodyproducer = stream_producer(body)
             HTTPResponse.setBody(self, '', title, is_error, **kw)
             return self
         else:
@@ -272,6 +282,9 @@ class ChannelPipe:
     the channel will be being handled by another thread, thus
     restrict access to channel to the push method only."""
 
+    # set by start_response if a WSGI response body needs chunking
+    _chunking = 0
+
     def __init__(self, request):
         self._channel = request.channel
         self._request = request
@@ -282,12 +295,25 @@ class ChannelPipe:
     def write(self, text, l=None):
         if self._channel.closed:
             return
+        if self._chunking:
+            if not text:
+                # an empty chunk would end the body
+                return
+            text = '%x\r\n%s\r\n' % (len(text), text)
+            l = None
         if l is None: l = len(text)
         self._bytes = self._bytes + l
         self._channel.push(text,0)
         Wakeup()
 
     def close(self):
+        if self._chunking:
+            self._chunking = 0
+            # A chunked response is only closed while open for more when
+            # publishing failed half way.  Without the last chunk the
+            # client can tell that the body is incomplete.
+            if not self._close:
+                self.write('0\r\n\r\n')
         log('A', id(self._request),
                 '%s %s' % (self._request.reply_code, self._bytes))
         if not self._channel.closed:
@@ -327,25 +353,56 @@ class ChannelPipe:
 
     def start_response(self, status, headers, exc_info=None):
         # Used for WSGI
-        self._request.reply_code = int(status.split(' ')[0])
+        code = int(status.split(' ')[0])
+        self._request.reply_code = code
+        headers = list(headers)
+        names = dict([(k.lower(), v.lower()) for k, v in headers])
+        if self._close or not self._keep_alive(code, headers, names):
+            self._close = 1
+            if 'connection' not in names:
+                headers.append(('Connection', 'close'))
+        elif self._request.version == '1.0' and 'connection' not in names:
+            headers.append(('Connection', 'Keep-Alive'))
         status = 'HTTP/%s %s\r\n' % (self._request.version, status)
         self.write(status)
-        headers = '\r\n'.join([': '.join(x) for x in headers])
-        self.write(headers)
+        self.write('\r\n'.join([': '.join(x) for x in headers]))
         self.write('\r\n\r\n')
+        if ('transfer-encoding' not in names and
+            ('Transfer-Encoding', 'chunked') in headers):
+            # we added chunked encoding, frame the body from now on
+            self._chunking = 1
         return self.write
-        
+
+    def _keep_alive(self, code, headers, names):
+        # Decide whether the connection can stay open after a WSGI
+        # response, switching to chunked encoding if the response length
+        # is not known up front.
+        request = self._request
+        version = request.version
+        connection = get_connection(request)
+        if version not in ('1.0', '1.1'):
+            return 0
+        if 'close' in (connection, names.get('connection')):
+            return 0
+        if version == '1.0' and connection != 'keep-alive':
+            return 0
+        if (request.command.upper() == 'HEAD' or
+            code in (204, 304) or 100 <= code < 200):
+            # there is no body to delimit
+            return 1
+        if 'content-length' in names:
+            return 1
+        if version == '1.1' and 'transfer-encoding' not in names:
+            headers.append(('Transfer-Encoding', 'chunked'))
+            return 1
+        return 0
+
 
 is_proxying_match = re.compile(r'[^ ]* [^ \\]*:').match
 proxying_connection_re = re.compile ('Proxy-Connection: (.*)', re.IGNORECASE)
 
-def make_response(request, headers):
-    "Simple http response factory"
-    # should this be integrated into the HTTPResponse constructor?
-
-    response = ZServerHTTPResponse(stdout=ChannelPipe(request),
-                                   stderr=StringIO())
-    response._http_version = request.version
+def get_connection(request):
+    "Return the lowercased connection header of a medusa request"
     if request.version == '1.0' and is_proxying_match(request.request):
         # a request that was made as if this zope was an http 1.0 proxy.
         # that means we have to use some slightly different http
@@ -354,7 +411,15 @@ def make_response(request, headers):
     else:
         # a normal http request
         connection_re = http_server.CONNECTION
-    response._http_connection = http_server.get_header(connection_re,
-                                                       request.header).lower()
+    return http_server.get_header(connection_re, request.header).lower()
+
+def make_response(request, headers):
+    "Simple http response factory"
+    # should this be integrated into the HTTPResponse constructor?
+
+    response = ZServerHTTPResponse(stdout=ChannelPipe(request),
+                                   stderr=StringIO())
+    response._http_version = request.version
+    response._http_connection = get_connection(request)
     response._server_version = request.channel.server.SERVER_IDENT
     return response
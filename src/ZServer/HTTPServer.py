@@ -41,8 +41,12 @@ import socket
 from cStringIO import StringIO
 
 from PubCore import handle
+from PubCore import overloaded
+from PubCore import recordShed
 from HTTPResponse import make_response
 from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.multipart import MultipartParser
+from ZPublisher.multipart import SpooledBody
 from App.config import getConfiguration
 
 import asyncore
@@ -62,11 +66,14 @@ from medusa import logger
 
 
 CONTENT_LENGTH  = re.compile('Content-Length: ([0-9]+)',re.I)
+CONTENT_TYPE    = re.compile('Content-Type: (.*)', re.I)
 CONNECTION      = re.compile('Connection: (.*)', re.I)
 USER_AGENT      = re.compile('User-Agent: (.*)', re.I)
 
 is_proxying_match = re.compile(r'[^ ]* [^ \\]*:').match
 
+SHED_MESSAGE = 'The server is too busy to handle the request, try again later.'
+
 
 # maps request some headers to environment variables.
 # (those that don't start with 'HTTP_')
@@ -81,10 +88,31 @@ class zhttp_collector:
         from ZServer import LARGE_FILE_THRESHOLD
         self.handler = handler
         self.request = request
+        self.parser = None
+        self.spooled = 0
+        self.failed = 0
         if size > LARGE_FILE_THRESHOLD:
-            # write large upload data to a file
-            from tempfile import TemporaryFile
-            self.data = TemporaryFile('w+b')
+            content_type = get_header(CONTENT_TYPE, request.header) or ''
+            ctype = content_type.split(';')[0].strip().lower()
+            if ctype == 'multipart/form-data':
+                # parse the upload while it arrives, spooling every
+                # file to its own temporary file
+                try:
+                    self.parser = MultipartParser(content_type)
+                except ValueError:
+                    pass
+            elif ctype != 'application/x-www-form-urlencoded' and (
+                ctype or request.command.upper() != 'POST'):
+                # the publisher can use the spooled body as it is
+                self.spooled = 1
+            self.content_type = content_type
+        if self.parser is not None:
+            self.data = StringIO()
+        elif size > LARGE_FILE_THRESHOLD:
+            # write large upload data to a file, named so that it can
+            # be moved into a blob
+            from tempfile import NamedTemporaryFile
+            self.data = NamedTemporaryFile('w+b')
         else:
             self.data = StringIO()
         request.channel.set_terminator(size)
@@ -93,7 +121,14 @@ class zhttp_collector:
     # put and post collection methods
     #
     def collect_incoming_data (self, data):
-        self.data.write(data)
+        if self.parser is not None:
+            try:
+                self.parser.feed(data)
+            except ValueError:
+                self.parser = None
+                self.failed = 1
+        elif not self.failed:
+            self.data.write(data)
 
     def found_terminator(self):
         # reset collector
@@ -103,8 +138,22 @@ class zhttp_collector:
         self.data.seek(0)
         r=self.request
         d=self.data
+        parser=self.parser
         del self.request
         del self.data
+        del self.parser
+        if parser is not None:
+            try:
+                parser.close()
+            except ValueError:
+                self.failed = 1
+            else:
+                r.fieldstorage = parser
+        elif self.spooled:
+            r.fieldstorage = SpooledBody(d, self.content_type)
+        if self.failed:
+            r.error(400)
+            return
         self.handler.continue_request(d,r)
 
 class zhttp_handler:
@@ -112,6 +161,9 @@ class zhttp_handler:
 
     _force_connection_close = 0
 
+    # seconds a client is asked to wait after its request has been shed
+    shed_retry_after = 1
+
     def __init__ (self, module, uri_base=None, env=None):
         """Creates a zope_handler
 
@@ -239,6 +291,10 @@ class zhttp_handler:
                 key='HTTP_%s' % ("_".join(key.split( "-"))).upper()
                 if value and not env_has(key):
                     env[key]=value
+        # a body that was parsed or spooled while it arrived
+        fieldstorage = getattr(request, 'fieldstorage', None)
+        if fieldstorage is not None:
+            env['zope.fieldstorage'] = fieldstorage
         env.update(self.env_override)
         return env
 
@@ -272,9 +328,27 @@ class zhttp_handler:
             zresponse._http_connection = 'close'
         zrequest=HTTPRequest(sin, env, zresponse)
         request.channel.current_request=None
+        if not request.channel.working and overloaded():
+            # The request queue is full, refuse the request right away
+            # instead of letting it wait for a publisher thread.
+            request.channel.working=1
+            self.shed_request(zrequest, zresponse)
+            return
         request.channel.queue.append((self.module_name, zrequest, zresponse))
         request.channel.work()
 
+    def shed_request(self, zrequest, zresponse):
+        "refuse a request with a 503 because the server is overloaded"
+        recordShed()
+        zresponse.setStatus(503)
+        zresponse.setHeader('Retry-After', str(self.shed_retry_after))
+        zresponse.setBody(SHED_MESSAGE)
+        try:
+            zresponse.outputBody()
+            zresponse._finish()
+        finally:
+            zrequest.close()
+
     def status(self):
         return producers.simple_producer("""
             <li>Zope Handler
@@ -285,6 +359,7 @@ class zhttp_handler:
             )
 
 from HTTPResponse import ChannelPipe
+from HTTPResponse import get_connection
 
 class zwsgi_handler(zhttp_handler):
     
@@ -299,21 +374,12 @@ class zwsgi_handler(zhttp_handler):
         DebugLogger.log('I', id(request), s)
 
         env=self.get_environment(request)
-        version = request.version
-        if version=='1.0' and is_proxying_match(request.request):
-            # a request that was made as if this zope was an http 1.0 proxy.
-            # that means we have to use some slightly different http
-            # headers to manage persistent connections.
-            connection_re = proxying_connection_re
-        else:
-            # a normal http request
-            connection_re = CONNECTION
-        
-        env['http_connection'] = get_header(connection_re,
-                                            request.header).lower()
+        env['http_connection'] = get_connection(request)
         env['server_version']=request.channel.server.SERVER_IDENT
 
         env['wsgi.output'] = ChannelPipe(request)
+        if self._force_connection_close:
+            env['wsgi.output']._close = 1
         env['wsgi.input'] = sin
         env['wsgi.errors']       = sys.stderr
         env['wsgi.version']      = (1,0)
@@ -323,10 +389,28 @@ class zwsgi_handler(zhttp_handler):
         env['wsgi.url_scheme']   = env['SERVER_PROTOCOL'].split('/')[0]
 
         request.channel.current_request=None
+        if not request.channel.working and overloaded():
+            request.channel.working=1
+            self.shed_request(env, env['wsgi.output'].start_response)
+            return
         request.channel.queue.append(('Zope2WSGI', env, 
                                       env['wsgi.output'].start_response))
         request.channel.work()
 
+    def shed_request(self, env, start_response):
+        "refuse a request with a 503 because the server is overloaded"
+        recordShed()
+        output = env['wsgi.output']
+        # close the connection, and say so in the response headers
+        output._close = 1
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(SHED_MESSAGE))),
+            ('Retry-After', str(self.shed_retry_after)),
+            ])
+        output.write(SHED_MESSAGE)
+        output.close()
+
 
 class zhttp_channel(http_channel):
     "http channel"
@@ -337,10 +421,17 @@ class zhttp_channel(http_channel):
 
     def __init__(self, server, conn, addr):
         http_channel.__init__(self, server, conn, addr)
+        # The producer fifo is only used through these functions, as it
+        # may be a deque or a fifo, depending on the asynchat version.
         if isinstance(self.producer_fifo, (fifo, asynchat.fifo)):
             self.producer_fifo_push = self.producer_fifo.push
             self.producer_fifo_first = self.producer_fifo.first
             self.producer_fifo_pop = self.producer_fifo.pop
+            push_front = getattr(self.producer_fifo, 'push_front', None)
+            if push_front is None:
+                # asynchat's fifo keeps a deque
+                push_front = self.producer_fifo.list.appendleft
+            self.producer_fifo_push_front = push_front
         else:
             self.producer_fifo_push = self.producer_fifo.append
             def first():
@@ -349,6 +440,7 @@ class zhttp_channel(http_channel):
             def pop():
                 del self.producer_fifo[0]
             self.producer_fifo_pop = pop
+            self.producer_fifo_push_front = self.producer_fifo.appendleft
         requestCloseOnExec(conn)
         self.queue = []
         self.working=0
@@ -365,6 +457,37 @@ class zhttp_channel(http_channel):
 
     push_with_producer=push
 
+    # send file producers with sendfile(2) where possible
+    use_sendfile = 1
+
+    def initiate_send(self):
+        # Producers are normally asked for their data by asynchat.  Look
+        # at them here first, so that a file producer at the head of the
+        # fifo can send straight from the file to our socket.
+        while self.producer_fifo and self.connected:
+            first = self.producer_fifo_first()
+            if first is None or isinstance(first, (str, buffer)):
+                break
+            if self.use_sendfile and getattr(first, 'can_sendfile', 0):
+                offset = first.offset
+                try:
+                    more = first.sendfile(self.socket.fileno())
+                except (socket.error, EnvironmentError):
+                    self.handle_error()
+                    return
+                self.server.bytes_out.increment(first.offset - offset)
+                if not more:
+                    # nothing was left to send
+                    self.producer_fifo_pop()
+                    continue
+                return
+            data = first.more()
+            if data:
+                self.producer_fifo_push_front(data)
+            else:
+                self.producer_fifo_pop()
+        http_channel.initiate_send(self)
+
     def clean_shutdown_control(self,phase,time_in_this_phase):
         if phase==3:
             # This is the shutdown phase where we are trying to finish processing
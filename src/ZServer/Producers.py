@@ -15,8 +15,19 @@ ZServer pipe utils. These producers basically function as callbacks.
 """
 
 import asyncore
+import errno
+import os
 import sys
 
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        # Python 2 backport of os.sendfile
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
 class ShutdownProducer:
     "shuts down medusa"
     def more(self):
@@ -98,6 +109,66 @@ class file_close_producer:
             self.file=None
         return ''
 
+class file_sendfile_producer:
+    """producer for the rest of an open file
+
+    Channels that know about it send the file with sendfile(2), which
+    copies the data from the file to the socket in the kernel.  Other
+    channels, or platforms without sendfile, read it through 'more'.
+    """
+    # match http_channel's outgoing buffer size
+    out_buffer_size = 1<<16
+    can_sendfile = sendfile is not None
+
+    def __init__(self, file):
+        self.file=file
+        self.offset=file.tell()
+        self.end=os.fstat(file.fileno()).st_size
+
+    def more(self):
+        file=self.file
+        if file is None: return ''
+        size=min(self.end-self.offset, self.out_buffer_size)
+        data=''
+        if size > 0:
+            file.seek(self.offset)
+            data=file.read(size)
+        if data:
+            self.offset=self.offset+len(data)
+            return data
+        self.file=None
+        return ''
+
+    def sendfile(self, fd):
+        """Send the next part of the file to the socket 'fd'
+
+        Return false when the whole file was sent.  Errors that mean
+        that sendfile can't be used for this file make the producer
+        fall back to 'more'.
+        """
+        file=self.file
+        if file is None: return 0
+        count=self.end-self.offset
+        if count <= 0:
+            self.file=None
+            return 0
+        try:
+            sent=sendfile(fd, file.fileno(), self.offset, count)
+        except EnvironmentError, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 1
+            if e.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                           errno.EOPNOTSUPP):
+                self.can_sendfile=False
+                return 1
+            raise
+        if not sent:
+            # the file shrunk
+            self.file=None
+            return 0
+        self.offset=self.offset+sent
+        return 1
+
 class iterator_producer:
     def __init__(self, iterator):
         self.iterator = iterator
@@ -107,3 +178,16 @@ class iterator_producer:
             return self.iterator.next()
         except StopIteration:
             return ''
+
+
+def stream_producer(iterator):
+    """Return a producer for a stream iterator
+
+    File stream iterators return the rest of their file, so they can
+    be sent with a file_sendfile_producer.
+    """
+    from ZPublisher.Iterators import filestream_iterator
+    next = getattr(type(iterator), 'next', None)
+    if getattr(next, 'im_func', None) is filestream_iterator.next.im_func:
+        return file_sendfile_producer(iterator)
+    return iterator_producer(iterator)
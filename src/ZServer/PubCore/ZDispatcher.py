@@ -0,0 +1,259 @@
+##############################################################################
+#
+# Copyright (c) 2002 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+"""Worker thread pool with a bounded, observable request queue
+"""
+
+import thread
+import threading
+import time
+from collections import deque
+
+# number of recent queue wait times kept for computing percentiles
+WAIT_SAMPLES = 1000
+
+
+def _percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[int(round(p * (len(samples) - 1)))]
+
+
+class ZDispatcher:
+    """Worker thread pool
+
+    Requests are queued in a FIFO and handed to the first idle worker
+    thread.  The worker threads do no locking; they simply call
+    'accept' to block until there is work to do.
+
+    The pool starts with 'n' workers.  If 'max_threads' is larger than
+    that, the pool is adaptive: extra workers are started while queued
+    requests wait longer than 'spawn_wait' seconds.  Every
+    'idle_timeout' seconds, as many workers beyond the first 'n' exit
+    as stayed idle during all of that time.  Idle workers block without
+    a timeout, so they don't poll and are woken as soon as there is
+    work.
+
+    The queue can be given a high-water mark.  The dispatcher itself
+    never refuses work, but servers can ask 'overloaded' before
+    handing over a request and shed load instead.
+    """
+
+    def __init__(self, n=1, high_water_mark=0, publisher=None,
+                 max_threads=0, spawn_wait=0.5, idle_timeout=60):
+        if publisher is None:
+            from ZServerPublisher import ZServerPublisher as publisher
+        self._publisher = publisher
+        self._cond = threading.Condition(threading.Lock())
+        self._requests = deque()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._local = threading.local()
+        self.high_water_mark = high_water_mark
+        self.min_threads = n
+        self.max_threads = max(n, max_threads)
+        self.spawn_wait = spawn_wait
+        self.idle_timeout = idle_timeout
+        self.threads = 0
+        self.idle = 0
+        self.busy = 0
+        self.handled = 0
+        self.shed = 0
+        self.max_depth = 0
+        self.spawned = 0
+        self.retired = 0
+        self._timer = None
+        self._reaper = None
+        self._idle_low = 0  # fewest idle workers since the last reaping
+        self._retiring = 0  # idle workers that are asked to exit
+
+        self._cond.acquire() # workers will block until all are started
+        try:
+            while n > 0:
+                self._spawn()
+                n = n-1
+        finally:
+            self._cond.release()
+
+    def _spawn(self):
+        # must be called with the lock held
+        thread.start_new_thread(self._publisher, (self.accept,))
+        self.threads = self.threads + 1
+
+    def _maybe_spawn(self, now):
+        # Start an extra worker if the oldest queued request waited for
+        # too long and nobody is about to pick it up.  If it hasn't waited
+        # long enough yet, check again when it has, as there may be
+        # neither new requests nor free workers to do so until then.
+        # Must be called with the lock held.
+        requests = self._requests
+        if requests and not self.idle and self.threads < self.max_threads:
+            waited = now - requests[0][0]
+            if waited >= self.spawn_wait:
+                self._spawn()
+                self.spawned = self.spawned + 1
+                self._schedule_reap()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.spawn_wait - waited,
+                                              self._check_spawn)
+                self._timer.setDaemon(True)
+                self._timer.start()
+
+    def _check_spawn(self):
+        self._cond.acquire()
+        try:
+            self._timer = None
+            self._maybe_spawn(time.time())
+        finally:
+            self._cond.release()
+
+    def _schedule_reap(self):
+        # Must be called with the lock held.
+        if (self._reaper is None and
+                self.threads - self._retiring > self.min_threads):
+            self._idle_low = self.idle
+            self._reaper = threading.Timer(self.idle_timeout, self._reap)
+            self._reaper.setDaemon(True)
+            self._reaper.start()
+
+    def _reap(self):
+        # Ask the workers beyond the minimum that weren't needed since
+        # the last check to exit.
+        self._cond.acquire()
+        try:
+            self._reaper = None
+            excess = min(self._idle_low, self.idle - self._retiring,
+                         self.threads - self._retiring - self.min_threads)
+            if excess > 0:
+                self._retiring = self._retiring + excess
+                self._cond.notify(excess)
+            self._schedule_reap()
+        finally:
+            self._cond.release()
+
+    def adaptive(self):
+        """Return true if the pool grows and shrinks with the load
+        """
+        return self.max_threads > self.min_threads
+
+    def accept(self):
+        """Return a request from the request queue
+
+        If no requests are in the request queue, then block until
+        there is one.  In adaptive mode, return None if the calling
+        worker should exit because it has been idle for too long.
+        """
+        local = self._local
+        self._cond.acquire()
+        try:
+            if getattr(local, 'working', False):
+                # the calling worker finished its previous request
+                local.working = False
+                self.busy = self.busy - 1
+
+            requests = self._requests
+            adaptive = self.adaptive()
+            while not requests:
+                self.idle = self.idle + 1
+                try:
+                    self._cond.wait()
+                finally:
+                    self.idle = self.idle - 1
+                    if self.idle < self._idle_low:
+                        self._idle_low = self.idle
+                if not requests and self._retiring:
+                    # Retire this worker, there is not enough work.
+                    self._retiring = self._retiring - 1
+                    self.threads = self.threads - 1
+                    self.retired = self.retired + 1
+                    return None
+
+            queued, name, request, response = requests.popleft()
+            now = time.time()
+            wait = now - queued
+            self._waits.append(wait)
+            self.handled = self.handled + 1
+            self.busy = self.busy + 1
+            local.working = True
+            if adaptive:
+                self._maybe_spawn(now)
+        finally:
+            self._cond.release()
+
+        # make the queue wait available to the publisher
+        environ = getattr(request, 'environ', request)
+        try:
+            environ['zserver.queue_wait'] = wait
+        except TypeError:
+            pass
+        return name, request, response
+
+    def handle(self, name, request, response):
+        """Queue a request for processing
+        """
+        self._cond.acquire()
+        try:
+            requests = self._requests
+            now = time.time()
+            requests.append((now, name, request, response))
+            depth = len(requests)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            # there is work again, keep the workers asked to exit
+            self._retiring = 0
+            self._cond.notify()
+            if self.adaptive():
+                self._maybe_spawn(now)
+        finally:
+            self._cond.release()
+
+    def overloaded(self):
+        """Return true if a new request should be rejected
+
+        This is the case when the queue has reached the high-water
+        mark.  A high-water mark of 0 means that the queue is unbounded.
+        """
+        hwm = self.high_water_mark
+        return not not (hwm and len(self._requests) >= hwm)
+
+    def recordShed(self):
+        """Count a request that was refused because of overload
+        """
+        self._cond.acquire()
+        try:
+            self.shed = self.shed + 1
+        finally:
+            self._cond.release()
+
+    def getStatistics(self):
+        """Return a snapshot of the dispatcher counters as a mapping
+        """
+        self._cond.acquire()
+        try:
+            waits = list(self._waits)
+            return {
+                'depth': len(self._requests),
+                'max_depth': self.max_depth,
+                'high_water_mark': self.high_water_mark,
+                'threads': self.threads,
+                'min_threads': self.min_threads,
+                'max_threads': self.max_threads,
+                'spawned': self.spawned,
+                'retired': self.retired,
+                'busy': self.busy,
+                'handled': self.handled,
+                'shed': self.shed,
+                'wait_p50': _percentile(waits, 0.5),
+                'wait_p99': _percentile(waits, 0.99),
+                }
+        finally:
+            self._cond.release()
@@ -15,14 +15,48 @@ import logging
 
 LOG = logging.getLogger('ZServerPublisher')
 
+def release_connections(threads):
+    """Keep no more than 'threads' available connections per database
+
+    Called when a publisher thread exits, so that connections (and their
+    caches) the remaining 'threads' publisher threads can't use are
+    freed instead of lingering in the connection pools.  Shrinking a
+    pool discards its oldest available connections; its size is
+    restored right away.
+    """
+    import Zope2
+    DB = getattr(Zope2, 'DB', None)
+    if DB is None:
+        return
+    for db in DB.databases.values():
+        db._a()
+        try:
+            pool = db.pool
+            size = pool.size
+            if threads < size:
+                pool.size = threads
+                pool.size = size
+        finally:
+            db._r()
+
 class ZServerPublisher:
     def __init__(self, accept):
         from sys import exc_info
         from ZPublisher import publish_module
         from ZPublisher.WSGIPublisher import publish_module as publish_wsgi
+        from ZPublisher.Iterators import IStreamIterator
+        from ZServer.Producers import stream_producer
         while 1:
           try:
-            name, a, b=accept()
+            job=accept()
+            if job is None:
+                # The dispatcher retired this thread.
+                from ZServer.PubCore import getStatistics
+                stats = getStatistics()
+                if stats is not None:
+                    release_connections(stats['threads'])
+                break
+            name, a, b=job
             if name == "Zope2":
                 try:
                     publish_module(
@@ -34,13 +68,32 @@ class ZServerPublisher:
                     a=b=None
 
             elif name == "Zope2WSGI":
+                output = a['wsgi.output']
                 try:
-                    res = publish_wsgi(a, b)
-                    for r in res:
-                        a['wsgi.output'].write(r)
+                    try:
+                        res = publish_wsgi(a, b)
+                        if (IStreamIterator.providedBy(res) and
+                            not output._chunking):
+                            # Stream iterators are handed to the channel
+                            # like ZServerHTTPResponse does, so files can
+                            # be sent directly.  They are released along
+                            # with the producer.
+                            output.write(stream_producer(res), 0)
+                        else:
+                            try:
+                                for r in res:
+                                    output.write(r)
+                            finally:
+                                close = getattr(res, 'close', None)
+                                if close is not None:
+                                    close()
+                    except:
+                        # The response may be incomplete, so the
+                        # connection can't be reused.
+                        output._close = 1
+                        raise
                 finally:
-                    # TODO: Support keeping connections open.
-                    a['wsgi.output']._close = 1
-                    a['wsgi.output'].close()
+                    output.close()
+                    a=b=output=None
           except:
             LOG.error('exception caught', exc_info=True)
@@ -11,22 +11,72 @@
 #
 ##############################################################################
 
-import ZRendezvous
+import ZDispatcher
 
+_dispatcher=None
 _handle=None
 _n=1
+_high_water_mark=0
+_max_threads=0
+_spawn_wait=0.5
+_idle_timeout=60
 
 def handle(*args, **kw):
-    global _handle
+    global _handle, _dispatcher
 
-    if _handle is None: _handle=ZRendezvous.ZRendevous(_n).handle
+    if _handle is None:
+        _dispatcher=ZDispatcher.ZDispatcher(
+            _n, _high_water_mark, max_threads=_max_threads,
+            spawn_wait=_spawn_wait, idle_timeout=_idle_timeout)
+        _handle=_dispatcher.handle
 
     return apply(_handle, args, kw)
 
+def overloaded():
+    """Return true if the request queue has reached its high-water mark.
+    """
+    return _dispatcher is not None and _dispatcher.overloaded()
+
+def recordShed():
+    """Count a request that was refused because of overload.
+    """
+    if _dispatcher is not None:
+        _dispatcher.recordShed()
+
+def getStatistics():
+    """Return the request queue counters, or None if not yet started.
+    """
+    if _dispatcher is None:
+        return None
+    return _dispatcher.getStatistics()
+
+def setHighWaterMark(n):
+    """Set the request queue depth at which HTTP requests are refused.
+
+    0 means that the queue is unbounded.
+    """
+    global _high_water_mark
+    _high_water_mark=n
+    if _dispatcher is not None:
+        _dispatcher.high_water_mark=n
+
+def setThreadPool(max_threads, spawn_wait=0.5, idle_timeout=60):
+    """Let the number of threads grow up to max_threads under load.
+
+    Extra threads are started while requests wait longer than
+    spawn_wait seconds for a thread, and exit again after idle_timeout
+    seconds without work.  The number of threads set with
+    setNumberOfThreads is the minimum.
+    """
+    global _max_threads, _spawn_wait, _idle_timeout
+    _max_threads=max_threads
+    _spawn_wait=spawn_wait
+    _idle_timeout=idle_timeout
+
 def setNumberOfThreads(n):
-    """This function will self-destruct in 4 statements.
+    """Set the number of threads.
+
+    This has no effect once the first request has been handled.
     """
     global _n
     _n=n
-    global setNumberOfThreads
-    del setNumberOfThreads
@@ -0,0 +1,102 @@
+import unittest
+
+MULTIPART = '\r\n'.join([
+    '--12345',
+    'Content-Disposition: form-data; name="file"; filename="file.txt"',
+    '',
+    'x' * 100,
+    '--12345--',
+    '',
+    ])
+
+
+class DummyChannel:
+
+    def set_terminator(self, terminator):
+        self.terminator = terminator
+
+
+class DummyRequest:
+
+    def __init__(self, command, content_type):
+        self.command = command
+        self.header = ['Content-Type: %s' % content_type]
+        self.channel = DummyChannel()
+        self.errors = []
+
+    def error(self, code):
+        self.errors.append(code)
+
+
+class DummyHandler:
+
+    def continue_request(self, sin, request):
+        self.sin = sin
+        self.request = request
+
+
+class ZHTTPCollectorTests(unittest.TestCase):
+
+    def setUp(self):
+        import ZServer
+        self._old_threshold = ZServer.LARGE_FILE_THRESHOLD
+        ZServer.LARGE_FILE_THRESHOLD = 10
+
+    def tearDown(self):
+        import ZServer
+        ZServer.LARGE_FILE_THRESHOLD = self._old_threshold
+
+    def _collect(self, request, body, chunk=7):
+        from ZServer.HTTPServer import zhttp_collector
+        handler = DummyHandler()
+        collector = zhttp_collector(handler, request, len(body))
+        self.assertTrue(request.collector is collector)
+        for i in range(0, len(body), chunk):
+            collector.collect_incoming_data(body[i:i + chunk])
+        collector.found_terminator()
+        self.assertEqual(request.channel.terminator, '\r\n\r\n')
+        return handler
+
+    def test_multipart_is_parsed_while_arriving(self):
+        request = DummyRequest('POST', 'multipart/form-data; boundary=12345')
+        handler = self._collect(request, MULTIPART)
+        self.assertTrue(handler.request is request)
+        self.assertEqual(handler.sin.read(), '')
+        part, = request.fieldstorage.list
+        self.assertEqual(part.filename, 'file.txt')
+        self.assertEqual(part.file.read(), 'x' * 100)
+
+    def test_malformed_multipart(self):
+        request = DummyRequest('POST', 'multipart/form-data; boundary=12345')
+        handler = self._collect(request, MULTIPART[:-20] + ' ' * 20)
+        self.assertEqual(request.errors, [400])
+        self.assertFalse(hasattr(handler, 'request'))
+
+    def test_put_body_is_spooled(self):
+        request = DummyRequest('PUT', 'text/plain')
+        handler = self._collect(request, 'x' * 100)
+        self.assertTrue(handler.sin.name)
+        self.assertEqual(handler.sin.read(), 'x' * 100)
+        self.assertTrue(request.fieldstorage.file is handler.sin)
+        self.assertEqual(request.fieldstorage.headers['content-type'],
+                         'text/plain')
+
+    def test_urlencoded_body_is_left_to_the_publisher(self):
+        request = DummyRequest('POST', 'application/x-www-form-urlencoded')
+        handler = self._collect(request, 'a=' + 'x' * 100)
+        self.assertEqual(handler.sin.read(), 'a=' + 'x' * 100)
+        self.assertFalse(hasattr(request, 'fieldstorage'))
+
+    def test_small_body(self):
+        import ZServer
+        ZServer.LARGE_FILE_THRESHOLD = 1000
+        request = DummyRequest('POST', 'multipart/form-data; boundary=12345')
+        handler = self._collect(request, MULTIPART)
+        self.assertEqual(handler.sin.read(), MULTIPART)
+        self.assertFalse(hasattr(request, 'fieldstorage'))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(ZHTTPCollectorTests),
+    ))
@@ -0,0 +1,205 @@
+import errno
+import os
+import socket
+import tempfile
+import unittest
+
+
+def fake_sendfile(out_fd, in_fd, offset, count):
+    os.lseek(in_fd, offset, 0)
+    return os.write(out_fd, os.read(in_fd, min(count, 7)))
+
+
+class FileSendfileProducerTests(unittest.TestCase):
+
+    def setUp(self):
+        from ZServer import Producers
+        self._old_sendfile = Producers.sendfile
+        Producers.sendfile = fake_sendfile
+        self.file = tempfile.TemporaryFile()
+        self.file.write('0123456789' * 3)
+        self.file.seek(0)
+
+    def tearDown(self):
+        from ZServer import Producers
+        Producers.sendfile = self._old_sendfile
+        self.file.close()
+
+    def _makeOne(self, file):
+        from ZServer.Producers import file_sendfile_producer
+        producer = file_sendfile_producer(file)
+        producer.can_sendfile = True
+        return producer
+
+    def test_more_from_current_position(self):
+        self.file.seek(25)
+        producer = self._makeOne(self.file)
+        producer.out_buffer_size = 3
+        self.assertEqual(producer.more(), '567')
+        self.assertEqual(producer.more(), '89')
+        self.assertEqual(producer.more(), '')
+        self.assertEqual(producer.more(), '')
+
+    def test_sendfile(self):
+        r, w = os.pipe()
+        try:
+            producer = self._makeOne(self.file)
+            sent = 0
+            while producer.sendfile(w):
+                sent = sent + 1
+            self.assertEqual(sent, 5)
+            self.assertEqual(os.read(r, 100), '0123456789' * 3)
+            self.assertFalse(producer.sendfile(w))
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_sendfile_falls_back_on_EINVAL(self):
+        from ZServer import Producers
+        def sendfile(*args):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        Producers.sendfile = sendfile
+        producer = self._makeOne(self.file)
+        self.assertTrue(producer.sendfile(-1))
+        self.assertFalse(producer.can_sendfile)
+        self.assertEqual(producer.more(), '0123456789' * 3)
+
+    def test_sendfile_EAGAIN(self):
+        from ZServer import Producers
+        def sendfile(*args):
+            raise OSError(errno.EAGAIN, 'Try again')
+        Producers.sendfile = sendfile
+        producer = self._makeOne(self.file)
+        self.assertTrue(producer.sendfile(-1))
+        self.assertTrue(producer.can_sendfile)
+        self.assertEqual(producer.offset, 0)
+
+
+class StreamProducerTests(unittest.TestCase):
+
+    def _callFUT(self, iterator):
+        from ZServer.Producers import stream_producer
+        return stream_producer(iterator)
+
+    def test_filestream_iterator(self):
+        from ZPublisher.Iterators import filestream_iterator
+        from ZServer.Producers import file_sendfile_producer
+        producer = self._callFUT(filestream_iterator(__file__, 'rb'))
+        self.assertTrue(isinstance(producer, file_sendfile_producer))
+
+    def test_filestream_iterator_subclass_overriding_next(self):
+        from ZPublisher.Iterators import filestream_iterator
+        from ZServer.Producers import iterator_producer
+        class partial_iterator(filestream_iterator):
+            def next(self):
+                raise StopIteration
+        producer = self._callFUT(partial_iterator(__file__, 'rb'))
+        self.assertTrue(isinstance(producer, iterator_producer))
+
+    def test_other_iterator(self):
+        from ZServer.Producers import iterator_producer
+        producer = self._callFUT(iter(['a', 'b']))
+        self.assertTrue(isinstance(producer, iterator_producer))
+
+
+class DummyServer:
+
+    def __init__(self):
+        from ZServer.medusa.counter import counter
+        self.bytes_out = counter()
+
+
+class DummyProducer:
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def more(self):
+        if self.chunks:
+            return self.chunks.pop(0)
+        return ''
+
+
+class ZHTTPChannelSendfileTests(unittest.TestCase):
+
+    def setUp(self):
+        from ZServer import Producers
+        self._old_sendfile = Producers.sendfile
+        Producers.sendfile = fake_sendfile
+        self.sock, self.peer = socket.socketpair()
+        self.file = tempfile.TemporaryFile()
+        self.file.write('0123456789')
+        self.file.seek(0)
+
+    def tearDown(self):
+        from ZServer import Producers
+        Producers.sendfile = self._old_sendfile
+        self.channel.del_channel()
+        self.sock.close()
+        self.peer.close()
+        self.file.close()
+
+    def _makeOne(self):
+        from ZServer.HTTPServer import zhttp_channel
+        self.channel = zhttp_channel(DummyServer(), self.sock, None)
+        return self.channel
+
+    def _producer(self):
+        from ZServer.Producers import file_sendfile_producer
+        producer = file_sendfile_producer(self.file)
+        producer.can_sendfile = True
+        return producer
+
+    def _send_all(self, channel):
+        while channel.producer_fifo:
+            channel.initiate_send()
+        return self.peer.recv(1000)
+
+    def test_sends_file_with_sendfile(self):
+        channel = self._makeOne()
+        producer = self._producer()
+        read = []
+        producer.more = lambda: read.append(1)
+        channel.push('head:', 0)
+        channel.push(DummyProducer(), 0)
+        channel.push(producer, 0)
+        channel.push(DummyProducer(':tail'), 0)
+        self.assertEqual(self._send_all(channel), 'head:0123456789:tail')
+        self.assertEqual(read, [])
+        self.assertEqual(channel.server.bytes_out.as_long(), 20)
+
+    def test_sendfile_disabled(self):
+        channel = self._makeOne()
+        channel.use_sendfile = 0
+        producer = self._producer()
+        producer.sendfile = None
+        channel.push(producer, 0)
+        self.assertEqual(self._send_all(channel), '0123456789')
+
+
+class ZHTTPChannelRealSendfileTests(ZHTTPChannelSendfileTests):
+    """Send with the sendfile function found, run only if there is one"""
+
+    def setUp(self):
+        ZHTTPChannelSendfileTests.setUp(self)
+        from ZServer import Producers
+        Producers.sendfile = self._old_sendfile
+
+    def _producer(self):
+        from ZServer.Producers import file_sendfile_producer
+        producer = file_sendfile_producer(self.file)
+        self.assertTrue(producer.can_sendfile)
+        return producer
+
+
+def test_suite():
+    from ZServer.Producers import sendfile
+    suite = unittest.TestSuite((
+        unittest.makeSuite(FileSendfileProducerTests),
+        unittest.makeSuite(StreamProducerTests),
+        unittest.makeSuite(ZHTTPChannelSendfileTests),
+    ))
+    if sendfile is not None:
+        # os.sendfile or the pysendfile package, see the sendfile extra
+        suite.addTest(unittest.makeSuite(ZHTTPChannelRealSendfileTests))
+    return suite
@@ -0,0 +1,246 @@
+import threading
+import unittest
+
+
+class ZDispatcherTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from ZServer.PubCore.ZDispatcher import ZDispatcher
+        return ZDispatcher
+
+    def _makeOne(self, *arg, **kw):
+        return self._getTargetClass()(*arg, **kw)
+
+    def test_no_workers(self):
+        dispatcher = self._makeOne(0)
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['threads'], 0)
+        self.assertEqual(stats['busy'], 0)
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['wait_p50'], 0.0)
+        self.assertEqual(stats['wait_p99'], 0.0)
+
+    def test_handle_accept_fifo(self):
+        dispatcher = self._makeOne(0)
+        first, second = {}, {}
+        dispatcher.handle('Zope2', first, 'r1')
+        dispatcher.handle('Zope2', second, 'r2')
+        self.assertEqual(dispatcher.getStatistics()['depth'], 2)
+        self.assertEqual(dispatcher.getStatistics()['max_depth'], 2)
+        name, request, response = dispatcher.accept()
+        self.assertEqual(name, 'Zope2')
+        self.assertTrue(request is first)
+        self.assertEqual(response, 'r1')
+        self.assertTrue(request['zserver.queue_wait'] >= 0)
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['depth'], 1)
+        self.assertEqual(stats['busy'], 1)
+        self.assertEqual(stats['handled'], 1)
+        # accepting again means the previous request was finished
+        name, request, response = dispatcher.accept()
+        self.assertTrue(request is second)
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['busy'], 1)
+        self.assertEqual(stats['handled'], 2)
+
+    def test_queue_wait_on_request_environ(self):
+        class DummyRequest:
+            def __init__(self):
+                self.environ = {}
+        dispatcher = self._makeOne(0)
+        request = DummyRequest()
+        dispatcher.handle('Zope2', request, None)
+        dispatcher.accept()
+        self.assertTrue('zserver.queue_wait' in request.environ)
+
+    def test_overloaded_unbounded(self):
+        dispatcher = self._makeOne(0)
+        for i in range(100):
+            dispatcher.handle('Zope2', {}, None)
+        self.assertFalse(dispatcher.overloaded())
+        self.assertEqual(dispatcher.getStatistics()['shed'], 0)
+
+    def test_overloaded_high_water_mark(self):
+        dispatcher = self._makeOne(0, high_water_mark=2)
+        dispatcher.handle('Zope2', {}, None)
+        self.assertFalse(dispatcher.overloaded())
+        dispatcher.handle('Zope2', {}, None)
+        self.assertTrue(dispatcher.overloaded())
+        self.assertEqual(dispatcher.getStatistics()['shed'], 0)
+        dispatcher.recordShed()
+        self.assertEqual(dispatcher.getStatistics()['shed'], 1)
+        dispatcher.accept()
+        self.assertFalse(dispatcher.overloaded())
+
+    def test_workers_process_requests(self):
+        done = []
+        finished = threading.Event()
+        def publisher(accept):
+            while 1:
+                name, request, response = accept()
+                done.append(request)
+                if len(done) == 10:
+                    finished.set()
+        dispatcher = self._makeOne(3, publisher=publisher)
+        requests = [{'n': i} for i in range(10)]
+        for request in requests:
+            dispatcher.handle('Zope2', request, None)
+        finished.wait(5)
+        self.assertEqual(sorted([r['n'] for r in done]), range(10))
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['threads'], 3)
+        self.assertEqual(stats['handled'], 10)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_not_adaptive_by_default(self):
+        dispatcher = self._makeOne(0)
+        self.assertFalse(dispatcher.adaptive())
+        dispatcher = self._makeOne(0, max_threads=2)
+        self.assertTrue(dispatcher.adaptive())
+
+    def test_adaptive_spawns_and_retires(self):
+        done = []
+        exited = threading.Event()
+        def publisher(accept):
+            while 1:
+                job = accept()
+                if job is None:
+                    exited.set()
+                    break
+                done.append(job[1])
+        dispatcher = self._makeOne(0, publisher=publisher, max_threads=1,
+                                   spawn_wait=0, idle_timeout=0.05)
+        dispatcher.handle('Zope2', {}, None)
+        exited.wait(5)
+        self.assertEqual(len(done), 1)
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['spawned'], 1)
+        self.assertEqual(stats['retired'], 1)
+        self.assertEqual(stats['threads'], 0)
+        self.assertEqual(stats['busy'], 0)
+
+    def test_adaptive_retires_down_to_min_threads(self):
+        import time
+        release = threading.Event()
+        exited = threading.Event()
+        def publisher(accept):
+            while 1:
+                job = accept()
+                if job is None:
+                    exited.set()
+                    break
+                release.wait(5)
+        dispatcher = self._makeOne(1, publisher=publisher, max_threads=3,
+                                   spawn_wait=0, idle_timeout=0.05)
+        dispatcher.handle('Zope2', {}, None)
+        for i in range(500):
+            if dispatcher.getStatistics()['busy']:
+                break
+            time.sleep(0.01)
+        dispatcher.handle('Zope2', {}, None)
+        self.assertEqual(dispatcher.getStatistics()['spawned'], 1)
+        release.set()
+        exited.wait(5)
+        time.sleep(0.2)
+        stats = dispatcher.getStatistics()
+        self.assertEqual(stats['retired'], 1)
+        self.assertEqual(stats['threads'], 1)
+
+    def test_adaptive_spawns_without_new_requests(self):
+        started = []
+        release = threading.Event()
+        spawned = threading.Event()
+        def publisher(accept):
+            started.append(1)
+            if len(started) == 2:
+                spawned.set()
+            accept()
+            release.wait(5)
+        dispatcher = self._makeOne(1, publisher=publisher, max_threads=2,
+                                   spawn_wait=0.05)
+        try:
+            # the only worker is busy with the first request, nothing
+            # happens after the second request is queued
+            dispatcher.handle('Zope2', {}, None)
+            dispatcher.handle('Zope2', {}, None)
+            spawned.wait(5)
+            self.assertEqual(dispatcher.getStatistics()['spawned'], 1)
+        finally:
+            release.set()
+
+    def test_adaptive_respects_max_threads(self):
+        release = threading.Event()
+        def publisher(accept):
+            accept()
+            release.wait(5)
+        dispatcher = self._makeOne(0, publisher=publisher, max_threads=2,
+                                   spawn_wait=0)
+        try:
+            for i in range(5):
+                dispatcher.handle('Zope2', {}, None)
+            self.assertEqual(dispatcher.getStatistics()['threads'], 2)
+        finally:
+            release.set()
+
+
+class PercentileTests(unittest.TestCase):
+
+    def _callFUT(self, samples, p):
+        from ZServer.PubCore.ZDispatcher import _percentile
+        return _percentile(samples, p)
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT([], 0.5), 0.0)
+
+    def test_percentiles(self):
+        samples = range(101)
+        self.assertEqual(self._callFUT(samples, 0.5), 50)
+        self.assertEqual(self._callFUT(samples, 0.99), 99)
+        self.assertEqual(self._callFUT(samples, 1.0), 100)
+
+
+class ReleaseConnectionsTests(unittest.TestCase):
+
+    def setUp(self):
+        import Zope2
+        from ZODB import DB
+        from ZODB.DemoStorage import DemoStorage
+        self._saved = Zope2.__dict__.get('DB')
+        self.db = DB(DemoStorage(), pool_size=3)
+        Zope2.DB = self.db
+
+    def tearDown(self):
+        import Zope2
+        if self._saved is None:
+            del Zope2.DB
+        else:
+            Zope2.DB = self._saved
+        self.db.close()
+
+    def _callFUT(self, threads):
+        from ZServer.PubCore.ZServerPublisher import release_connections
+        return release_connections(threads)
+
+    def test_releases_connections_beyond_threads(self):
+        connections = [self.db.open() for i in range(3)]
+        for conn in connections:
+            conn.close()
+        self.assertEqual(len(self.db.pool.available), 3)
+        self._callFUT(1)
+        self.assertEqual(len(self.db.pool.available), 1)
+        self.assertEqual(self.db.getPoolSize(), 3)
+
+    def test_keeps_connections_of_threads(self):
+        self.db.open().close()
+        self._callFUT(5)
+        self.assertEqual(len(self.db.pool.available), 1)
+        self.assertEqual(self.db.getPoolSize(), 3)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(ZDispatcherTests),
+        unittest.makeSuite(PercentileTests),
+        unittest.makeSuite(ReleaseConnectionsTests),
+    ))
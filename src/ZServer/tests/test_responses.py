@@ -279,6 +279,45 @@ class ZServerHTTPResponseTestCase(unittest.TestCase):
         response.addHeader('foo', 'bar')
         self.assertTrue('Foo: bar' in str(response))
 
+    def test_write_compressed_chunks(self):
+        import gzip
+        channel = DummyChannel()
+        response = ZServerHTTPResponse(stdout=channel)
+        response._http_version = '1.1'
+        response._http_connection = 'keep-alive'
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.setHeader('Content-Type', 'text/plain')
+        response.setHeader('Content-Length', 1200)
+        response.write('hello ' * 100)
+        response.write('world ' * 100)
+        channel.write(str(response))
+        headers, body = channel.all().split('\r\n\r\n', 1)
+        self.assertTrue('Content-Encoding: gzip' in headers)
+        self.assertTrue('Transfer-Encoding: chunked' in headers)
+        self.assertFalse('Content-Length' in headers)
+        self.assertFalse('Connection' in headers)
+        data = []
+        while body:
+            size, body = body.split('\r\n', 1)
+            data.append(body[:int(size, 16)])
+            body = body[int(size, 16) + 2:]
+        self.assertEqual(data[-1], '')
+        data = gzip.GzipFile(fileobj=StringIO(''.join(data))).read()
+        self.assertEqual(data, 'hello ' * 100 + 'world ' * 100)
+
+    def test_write_compressed_HTTP_1_0_closes(self):
+        import gzip
+        channel = DummyChannel()
+        response = ZServerHTTPResponse(stdout=channel)
+        response._http_connection = 'keep-alive'
+        response.enableHTTPCompression({'HTTP_ACCEPT_ENCODING': 'gzip'})
+        response.write('hello ' * 100)
+        channel.write(str(response))
+        headers, body = channel.all().split('\r\n\r\n', 1)
+        self.assertTrue('Connection: close' in headers)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(body)).read(),
+                         'hello ' * 100)
+
 class _Reporter(object):
     def __init__(self): self.events = []
     def __call__(self, event): self.events.append(event)
@@ -306,11 +345,139 @@ class ZServerHTTPResponseEventsTestCase(unittest.TestCase):
         
         self.assertTrue('datachunk1datachunk2' in out.getvalue())
 
+class DummyPushChannel:
+    closed = 0
+
+    def __init__(self):
+        self.pushed = []
+
+    def push(self, data, send=1):
+        self.pushed.append(data)
+
+    def all(self):
+        return ''.join([x for x in self.pushed if isinstance(x, str)])
+
+    def done(self):
+        pass
+
+class DummyMedusaRequest:
+    reply_code = 200
+
+    def __init__(self, version='1.1', command='GET', header=()):
+        self.channel = DummyPushChannel()
+        self.version = version
+        self.command = command
+        self.header = list(header)
+        self.request = '%s / HTTP/%s' % (command, version)
+
+    def log(self, bytes):
+        pass
+
+class ChannelPipeWSGITestCase(unittest.TestCase):
+    """Test connection handling of WSGI responses"""
+
+    def _makeOne(self, *args, **kw):
+        from ZServer.HTTPResponse import ChannelPipe
+        request = DummyMedusaRequest(*args, **kw)
+        return ChannelPipe(request), request.channel
+
+    def _respond(self, pipe, headers, body=(), status='200 OK'):
+        write = pipe.start_response(status, headers)
+        for chunk in body:
+            write(chunk)
+        pipe.close()
+
+    def test_HTTP_1_1_content_length_keeps_connection(self):
+        pipe, channel = self._makeOne()
+        self._respond(pipe, [('Content-Length', '5')], ['hello'])
+        self.assertTrue(channel.all().endswith('\r\n\r\nhello'))
+        self.assertFalse('Connection' in channel.all())
+        self.assertFalse(None in channel.pushed)
+
+    def test_HTTP_1_1_connection_close_request(self):
+        pipe, channel = self._makeOne(header=['Connection: close'])
+        self._respond(pipe, [('Content-Length', '5')], ['hello'])
+        self.assertTrue('Connection: close' in channel.all())
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_HTTP_1_1_connection_close_response(self):
+        pipe, channel = self._makeOne()
+        self._respond(pipe, [('Content-Length', '5'), ('Connection', 'close')],
+                      ['hello'])
+        self.assertEqual(channel.all().count('Connection'), 1)
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_HTTP_1_1_wo_content_length_uses_chunking(self):
+        pipe, channel = self._makeOne()
+        self._respond(pipe, [('Content-Type', 'text/plain')],
+                      ['hello', '', 'world!'])
+        output = channel.all()
+        self.assertTrue(output.startswith('HTTP/1.1 200 OK\r\n'))
+        self.assertTrue('Transfer-Encoding: chunked' in output)
+        self.assertTrue(output.endswith(
+            '\r\n\r\n5\r\nhello\r\n6\r\nworld!\r\n0\r\n\r\n'))
+        self.assertFalse(None in channel.pushed)
+
+    def test_HTTP_1_1_HEAD_wo_content_length(self):
+        pipe, channel = self._makeOne(command='HEAD')
+        self._respond(pipe, [('Content-Type', 'text/plain')])
+        self.assertFalse('chunked' in channel.all())
+        self.assertTrue(channel.all().endswith('\r\n\r\n'))
+        self.assertFalse(None in channel.pushed)
+
+    def test_HTTP_1_0_wo_keep_alive(self):
+        pipe, channel = self._makeOne('1.0')
+        self._respond(pipe, [('Content-Length', '5')], ['hello'])
+        self.assertTrue('Connection: close' in channel.all())
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_HTTP_1_0_keep_alive(self):
+        pipe, channel = self._makeOne('1.0', header=['Connection: Keep-Alive'])
+        self._respond(pipe, [('Content-Length', '5')], ['hello'])
+        self.assertTrue('Connection: Keep-Alive' in channel.all())
+        self.assertFalse(None in channel.pushed)
+
+    def test_HTTP_1_0_keep_alive_wo_content_length(self):
+        pipe, channel = self._makeOne('1.0', header=['Connection: Keep-Alive'])
+        self._respond(pipe, [('Content-Type', 'text/plain')], ['hello'])
+        self.assertTrue('Connection: close' in channel.all())
+        self.assertFalse('chunked' in channel.all())
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_forced_close(self):
+        pipe, channel = self._makeOne()
+        pipe._close = 1
+        self._respond(pipe, [('Content-Length', '5')], ['hello'])
+        self.assertTrue('Connection: close' in channel.all())
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_chunked_response_failing_half_way(self):
+        pipe, channel = self._makeOne()
+        write = pipe.start_response('200 OK', [('Content-Type', 'text/plain')])
+        write('hello')
+        pipe._close = 1
+        pipe.close()
+        output = channel.all()
+        self.assertTrue(output.endswith('\r\n\r\n5\r\nhello\r\n'))
+        self.assertFalse('0\r\n\r\n' in output)
+        self.assertEqual(channel.pushed[-1], None)
+
+    def test_shed_request_closes_connection(self):
+        from ZServer.HTTPServer import zwsgi_handler
+        pipe, channel = self._makeOne()
+        handler = zwsgi_handler('Zope2')
+        handler.shed_request({'wsgi.output': pipe}, pipe.start_response)
+        output = channel.all()
+        self.assertTrue(output.startswith('HTTP/1.1 503 '))
+        self.assertTrue('Connection: close' in output)
+        self.assertEqual(channel.pushed[-1], None)
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTests((
         unittest.makeSuite(ZServerResponseTestCase),
         unittest.makeSuite(ZServerHTTPResponseTestCase),
-        unittest.makeSuite(ZServerHTTPResponseEventsTestCase)
+        unittest.makeSuite(ZServerHTTPResponseEventsTestCase),
+        unittest.makeSuite(ChannelPipeWSGITestCase),
     ))
     return suite
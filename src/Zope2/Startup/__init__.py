@@ -181,7 +181,18 @@ class ZopeStarter:
     def setupZServer(self):
         # Increase the number of threads
         import ZServer
-        ZServer.setNumberOfThreads(self.cfg.zserver_threads)
+        pool = self.cfg.zserver_thread_pool
+        if pool is None:
+            ZServer.setNumberOfThreads(self.cfg.zserver_threads)
+        else:
+            min_threads = pool.min_threads
+            if min_threads is None:
+                min_threads = min(self.cfg.zserver_threads, pool.max_threads)
+            ZServer.setNumberOfThreads(min_threads)
+            ZServer.PubCore.setThreadPool(pool.max_threads, pool.spawn_wait,
+                                          pool.idle_timeout)
+        ZServer.PubCore.setHighWaterMark(
+            self.cfg.zserver_queue_high_water_mark)
         ZServer.CONNECTION_LIMIT = self.cfg.max_listen_sockets
 
     def serverListen(self):
@@ -39,6 +39,14 @@ def datetime_format(value):
             )
     return value
 
+def compression_level(value):
+    value = int(value)
+    if not 1 <= value <= 9:
+        raise ValueError, (
+            "http-compression-level must be between 1 and 9"
+            )
+    return value
+
 def cgi_environment(section):
     return section.environ
 
@@ -59,6 +67,15 @@ class LoggerFactory(logger.LoggerFactory):
         section.propagate = False
         logger.LoggerFactory.__init__(self, section)
 
+# ZServer thread pool
+
+def zserver_thread_pool(section):
+    if (section.min_threads is not None and
+        section.min_threads > section.max_threads):
+        raise ValueError, ('zserver-thread-pool: min-threads must not be '
+                           'larger than max-threads')
+    return section
+
 # DNS resolver
 
 def dns_resolver(hostname):
@@ -53,6 +53,11 @@ def session_timeout_minutes(value):
     value not in (None, default) and _setenv('ZSESSION_TIMEOUT_MINS', value)
     return value
 
+def session_inband_housekeeping(value):
+    from Products.Transience import Transience
+    Transience.INBAND_HOUSEKEEPING = value
+    return value
+
 def large_file_threshold(value):
     import ZServer
     ZServer.LARGE_FILE_THRESHOLD = value
@@ -82,6 +87,30 @@ def enable_ms_public_header(value):
     import webdav
     webdav.enable_ms_public_header = value
 
+def file_blobs(value):
+    import OFS.Image
+    OFS.Image.USE_BLOBS = value
+
+def lazy_form_parsing(value):
+    from ZPublisher import HTTPRequest
+    HTTPRequest.lazy_inputs = value
+
+def traversal_cache_size(value):
+    from ZPublisher import traversalcache
+    traversalcache.configure(value)
+
+def http_compression_level(value):
+    from ZPublisher import HTTPResponse
+    HTTPResponse.compression_level = value
+
+def http_compression_min_size(value):
+    from ZPublisher import HTTPResponse
+    HTTPResponse.compression_min_size = value
+
+def gzip_cache_size(value):
+    from App import gzipcache
+    gzipcache.configure(value)
+
 # server handlers
 
 def root_handler(config):
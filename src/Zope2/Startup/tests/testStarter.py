@@ -183,6 +183,27 @@ class ZopeStarterTestCase(test_logger.LoggingTestBase):
         from ZServer.PubCore import _n
         self.assertEqual(_n, 10)
 
+    def testSetupZServerThreadPool(self):
+        conf = self.load_config_text("""
+            instancehome <<INSTANCE_HOME>>
+            zserver-threads 2
+            <zserver-thread-pool>
+              max-threads 8
+              idle-timeout 2m
+            </zserver-thread-pool>""")
+        starter = self.get_starter(conf)
+        from ZServer import PubCore
+        old = (PubCore._max_threads, PubCore._spawn_wait,
+               PubCore._idle_timeout)
+        try:
+            starter.setupZServer()
+            self.assertEqual(PubCore._n, 2)
+            self.assertEqual(PubCore._max_threads, 8)
+            self.assertEqual(PubCore._spawn_wait, 0.5)
+            self.assertEqual(PubCore._idle_timeout, 120)
+        finally:
+            PubCore.setThreadPool(*old)
+
     def testSetupServers(self):
         # We generate a random port number to test against, so that multiple
         # test runs of this at the same time can succeed
@@ -126,6 +126,133 @@ class StartupTestCase(unittest.TestCase):
         finally:
             webdav.enable_ms_public_header = default_setting
 
+    def test_file_blobs(self):
+        import OFS.Image
+        from Zope2.Startup.handlers import handleConfig
+
+        default_setting = OFS.Image.USE_BLOBS
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                """)
+            handleConfig(None, handler)
+            self.assertFalse(OFS.Image.USE_BLOBS)
+
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                file-blobs on
+                """)
+            handleConfig(None, handler)
+            self.assertTrue(OFS.Image.USE_BLOBS)
+        finally:
+            OFS.Image.USE_BLOBS = default_setting
+
+    def test_lazy_form_parsing(self):
+        from ZPublisher import HTTPRequest
+        from Zope2.Startup.handlers import handleConfig
+
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                lazy-form-parsing on
+                """)
+            handleConfig(None, handler)
+            self.assertTrue(HTTPRequest.lazy_inputs)
+        finally:
+            HTTPRequest.lazy_inputs = False
+
+    def test_traversal_cache_size(self):
+        from ZPublisher import traversalcache
+        from Zope2.Startup.handlers import handleConfig
+
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                """)
+            handleConfig(None, handler)
+            self.assertEqual(traversalcache.cache, None)
+
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                traversal-cache-size 100
+                """)
+            handleConfig(None, handler)
+            self.assertEqual(traversalcache.cache.max_entries, 100)
+        finally:
+            traversalcache.configure(0)
+
+    def test_http_compression(self):
+        from ZPublisher import HTTPResponse
+        from Zope2.Startup.handlers import handleConfig
+
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                http-compression-level 1
+                http-compression-min-size 1KB
+                """)
+            handleConfig(None, handler)
+            self.assertEqual(HTTPResponse.compression_level, 1)
+            self.assertEqual(HTTPResponse.compression_min_size, 1024)
+        finally:
+            HTTPResponse.compression_level = 6
+            HTTPResponse.compression_min_size = 0
+
+        self.assertRaises(ZConfig.DataConversionError,
+                          self.load_config_text, """\
+            instancehome <<INSTANCE_HOME>>
+            http-compression-level 10
+            """)
+
+    def test_gzip_cache_size(self):
+        from App import gzipcache
+        from Zope2.Startup.handlers import handleConfig
+
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                """)
+            handleConfig(None, handler)
+            self.assertEqual(gzipcache.cache.max_size, 16 << 20)
+
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                gzip-cache-size 0
+                """)
+            handleConfig(None, handler)
+            self.assertEqual(gzipcache.cache, None)
+        finally:
+            gzipcache.configure(0)
+
+    def test_session_inband_housekeeping(self):
+        from Products.Transience import Transience
+        from Zope2.Startup.handlers import handleConfig
+
+        try:
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                """)
+            handleConfig(None, handler)
+            self.assertTrue(Transience.INBAND_HOUSEKEEPING)
+            self.assertEqual(conf.transience_housekeeping, None)
+
+            conf, handler = self.load_config_text("""\
+                instancehome <<INSTANCE_HOME>>
+                session-inband-housekeeping off
+                <transience-housekeeping>
+                  container /temp_folder/session_data
+                  container /sessions
+                </transience-housekeeping>
+                """)
+            handleConfig(None, handler)
+            self.assertFalse(Transience.INBAND_HOUSEKEEPING)
+            section = conf.transience_housekeeping
+            self.assertEqual(section.containers,
+                             ['/temp_folder/session_data', '/sessions'])
+            self.assertEqual(section.interval, 20)
+        finally:
+            Transience.INBAND_HOUSEKEEPING = True
+
     def test_path(self):
         p1 = tempfile.mktemp()
         p2 = tempfile.mktemp()
@@ -210,6 +337,34 @@ class StartupTestCase(unittest.TestCase):
             """)
         self.assertEqual(conf.default_zpublisher_encoding, 'iso-8859-15')
 
+    def test_zserver_thread_pool(self):
+        conf, dummy = self.load_config_text("""\
+            instancehome <<INSTANCE_HOME>>
+            """)
+        self.assertEqual(conf.zserver_thread_pool, None)
+
+        conf, dummy = self.load_config_text("""\
+            instancehome <<INSTANCE_HOME>>
+            <zserver-thread-pool>
+              max-threads 8
+            </zserver-thread-pool>
+            """)
+        pool = conf.zserver_thread_pool
+        self.assertEqual(pool.min_threads, None)
+        self.assertEqual(pool.max_threads, 8)
+        self.assertEqual(pool.spawn_wait, 0.5)
+        self.assertEqual(pool.idle_timeout, 60)
+
+    def test_zserver_thread_pool_min_larger_than_max(self):
+        self.assertRaises(ZConfig.DataConversionError,
+                          self.load_config_text, """\
+            instancehome <<INSTANCE_HOME>>
+            <zserver-thread-pool>
+              min-threads 4
+              max-threads 2
+            </zserver-thread-pool>
+            """)
+
 
 def test_suite():
     return unittest.makeSuite(StartupTestCase)